@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+""" Runs deploy command against local mock Salesforce using synthetic orgs of several sizes,
+reports median time and throughput of each phase over several repetitions and compares them with stored
+baseline. Request counts must not grow, times are compared loosely after scaling baseline by the speed of
+this machine relative to the one which recorded it (measured by a fixed calibration workload)
+
+    python -m benchmarks.run_benchmarks --sizes 100,1000 --latency 20
+    python -m benchmarks.run_benchmarks --update-baseline
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sfdclib import SfdcLogger
+
+from benchmarks.synthetic_org import generate_org
+from metamatelib.deploy import DeployCommand
+from metamatelib.metamate import parse_command_line_args
+from tests.mock_salesforce import MockSalesforce, home_directory, mock_command
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SCENARIOS = ['cold', 'warm']
+# Phases shorter than this are too noisy to be compared with baseline
+MIN_COMPARED_SECONDS = 0.2
+CALIBRATION_ROUNDS = 5
+CALIBRATION_BYTES = 4 * 1024 * 1024
+USERNAME = 'benchmark@example.com'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks deploy command against local mock Salesforce')
+    parser.add_argument('--sizes', type=str, default='100,1000,5000,20000',
+                        help='comma separated numbers of classes in synthetic orgs')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='milliseconds mock Salesforce waits before responding to each request')
+    parser.add_argument('--api-workers', type=int, default=4,
+                        help='maximum number of concurrent Tooling API requests')
+    parser.add_argument('--container-size', type=int,
+                        help='maximum number of classes compiled in one metadata container')
+    parser.add_argument('--changed-ratio', type=float, default=0.01,
+                        help='share of service classes contained in deployment package')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help='path to baseline results')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='replace baseline with results of this run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times each scenario is run, median times are reported')
+    parser.add_argument('--max-regression', type=float, default=1.0,
+                        help='fail if a phase is slower than baseline scaled by calibration by more than this '
+                             'share')
+    parser.add_argument('--output', type=str,
+                        help='write results to this JSON file')
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    return args
+
+
+def deploy_argv(args, source_dir, deploy_zip, report_path):
+    argv = ['deploy', '--username', USERNAME, '--password', 'Password', '--sandbox', '--check-only',
+            '--deploy-zip', deploy_zip, '--source-dir', source_dir, '--test-level', 'RunSpecifiedTests',
+            '--use-cache', '--version', '45.0', '--api-workers', str(args.api_workers),
+            '--poll-interval', '0.01', '--poll-max-interval', '0.05', '--report', report_path]
+    if args.container_size:
+        argv += ['--container-size', str(args.container_size)]
+    return argv
+
+
+def summarize(report, class_count):
+    """ Returns phase times, request count and throughput (classes per second) of a run """
+    phases = dict((name, round(phase['Time'], 4)) for name, phase in report['Phases'].items())
+    throughput = dict()
+    if phases.get('scan'):
+        throughput['scan'] = round(class_count / phases['scan'], 1)
+    compiled = report['Counters'].get('classes_compiled', 0)
+    if compiled and phases.get('dependencies'):
+        throughput['dependencies'] = round(compiled / phases['dependencies'], 1)
+    return {
+        'Time': round(report['Time'], 4),
+        'Phases': phases,
+        'Requests': sum(stats['Count'] for stats in report['Requests'].values()),
+        'Throughput': throughput,
+        'Tests': report['Tests']
+    }
+
+
+def calibrate():
+    """ Returns the best time of a fixed CPU workload, used to compare speed of machines """
+    data = bytes(range(256)) * (CALIBRATION_BYTES // 256)
+    best = None
+    for _ in range(CALIBRATION_ROUNDS):
+        start = time.perf_counter()
+        digest = data
+        for _ in range(8):
+            digest = hashlib.sha1(digest + data).digest()
+        json.loads(json.dumps([{'Name': 'Class%05d' % i, 'Hash': digest.hex()} for i in range(20000)]))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 4)
+
+
+def combine_runs(runs):
+    """ Combines summaries of repeated runs of one scenario, times and throughput are medians, the highest
+    request count is kept so that any extra request is reported """
+    phases = dict()
+    for phase in sorted(set(phase for run in runs for phase in run['Phases'])):
+        phases[phase] = round(statistics.median(run['Phases'].get(phase, 0.0) for run in runs), 4)
+    throughput = dict()
+    for phase in sorted(set(phase for run in runs for phase in run['Throughput'])):
+        throughput[phase] = round(statistics.median(run['Throughput'].get(phase, 0.0) for run in runs), 1)
+    return {
+        'Time': round(statistics.median(run['Time'] for run in runs), 4),
+        'Phases': phases,
+        'Requests': max(run['Requests'] for run in runs),
+        'Throughput': throughput,
+        'Tests': runs[0]['Tests']
+    }
+
+
+def run_size(args, class_count):
+    """ Runs cold (empty cache) and warm (second run) scenarios for one org size args.repeat times """
+    with tempfile.TemporaryDirectory() as work_dir:
+        classes, source_dir, deploy_zip = generate_org(work_dir, class_count, args.changed_ratio)
+        mock_salesforce = MockSalesforce(classes, latency=args.latency / 1000, deploy_checks=2).start()
+        runs = dict((scenario, list()) for scenario in SCENARIOS)
+        try:
+            for repetition in range(args.repeat):
+                # Every repetition starts with empty local cache
+                home_dir = os.path.join(work_dir, 'home%s' % repetition)
+                os.makedirs(home_dir)
+                with home_directory(home_dir):
+                    for scenario in SCENARIOS:
+                        report_path = os.path.join(home_dir, '%s.json' % scenario)
+                        cmd_args = parse_command_line_args(deploy_argv(args, source_dir, deploy_zip, report_path))
+                        if not mock_command(DeployCommand, cmd_args, SfdcLogger(0), mock_salesforce).run():
+                            raise Exception("Deploy command failed in %s scenario with %s classes" % (
+                                scenario, class_count))
+                        with open(report_path, 'r', encoding='utf-8') as file:
+                            runs[scenario].append(summarize(json.load(file), class_count))
+        finally:
+            mock_salesforce.stop()
+        return dict((scenario, combine_runs(scenario_runs)) for scenario, scenario_runs in runs.items())
+
+
+def find_regressions(results, baseline, max_regression):
+    """ Returns descriptions of runs sending more requests than baseline and phases slower than baseline
+    scaled by calibration times of both machines """
+    regressions = list()
+    scale = 1.0
+    if results.get('Calibration') and baseline.get('Calibration'):
+        scale = results['Calibration'] / baseline['Calibration']
+    for size, scenarios in sorted(results['Results'].items()):
+        for scenario, result in sorted(scenarios.items()):
+            expected = baseline['Results'].get(size, dict()).get(scenario)
+            if expected is None:
+                continue
+            times = dict(result['Phases'], total=result['Time'])
+            expected_times = dict((phase, seconds * scale) for phase, seconds in
+                                  dict(expected['Phases'], total=expected['Time']).items())
+            for phase, seconds in sorted(times.items()):
+                # Phases missing from baseline (i.e. added later) are not compared
+                expected_seconds = expected_times.get(phase, 0.0)
+                if expected_seconds >= MIN_COMPARED_SECONDS and seconds > expected_seconds * (1 + max_regression):
+                    regressions.append("%s classes, %s run: %s took %.2f s, baseline %.2f s" % (
+                        size, scenario, phase, seconds, expected_seconds))
+            if result['Requests'] > expected['Requests']:
+                regressions.append("%s classes, %s run: %s requests sent, baseline %s" % (
+                    size, scenario, result['Requests'], expected['Requests']))
+    return regressions
+
+
+def print_results(results):
+    print("Calibration: %.3f s, median of %s run(s)" % (results['Calibration'], results['Repeat']))
+    for size, scenarios in sorted(results['Results'].items(), key=lambda item: int(item[0])):
+        for scenario, result in sorted(scenarios.items()):
+            print("%s classes, %s run: %.2f s, %s requests, %s tests" % (
+                size, scenario, result['Time'], result['Requests'], result['Tests']))
+            for phase, seconds in sorted(result['Phases'].items()):
+                throughput = result['Throughput'].get(phase)
+                print("  %-22s %8.3f s%s" % (
+                    phase, seconds, '' if throughput is None else "  %10.1f classes/s" % throughput))
+
+
+def main(argv):
+    args = parse_args(argv)
+    results = {
+        'Settings': {'Latency': args.latency, 'ApiWorkers': args.api_workers,
+                     'ContainerSize': args.container_size, 'ChangedRatio': args.changed_ratio},
+        'Calibration': calibrate(),
+        'Repeat': args.repeat,
+        'Results': dict()
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results['Results'][str(size)] = run_size(args, size)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print("Baseline written to %s" % args.baseline)
+        return 0
+    if not os.path.isfile(args.baseline):
+        print("Baseline %s does not exist, nothing to compare with" % args.baseline)
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    if baseline['Settings'] != results['Settings']:
+        print("Baseline was recorded with different settings %s, nothing to compare with" % baseline['Settings'])
+        return 0
+    regressions = find_regressions(results, baseline, args.max_regression)
+    for regression in regressions:
+        print("Regression: %s" % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,94 @@
+""" Generates synthetic Apex source tree and deployment ZIP used by benchmarks """
+import os
+from zipfile import ZipFile, ZIP_DEFLATED
+
+CLASS_META_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ApexClass xmlns="http://soap.sforce.com/2006/04/metadata">
+    <apiVersion>37.0</apiVersion>
+    <status>Active</status>
+</ApexClass>"""
+
+PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <types>
+{members}
+        <name>ApexClass</name>
+    </types>
+    <version>37.0</version>
+</Package>"""
+
+SERVICE_CLASS = """public class {name} {{
+    // Synthetic service class
+    public Integer revision = {revision};
+
+    public {dependency} next() {{
+        return new {dependency}();
+    }}
+}}"""
+
+TEST_CLASS = """@isTest
+private class {name} {{
+    @isTest
+    static void test() {{
+        {service} s = new {service}();
+        System.assertNotEquals(null, s.next());
+    }}
+}}"""
+
+
+def service_name(index):
+    return 'Service%05d' % index
+
+
+def generate_classes(class_count, revision=0):
+    """ Returns dictionary in format {'class_name_1': 'class body'}
+    Half of the classes are services, each referencing the next one, the other half are their tests """
+    service_count = max(1, class_count // 2)
+    classes = dict()
+    for i in range(service_count):
+        classes[service_name(i)] = SERVICE_CLASS.format(
+            name=service_name(i), dependency=service_name((i + 1) % service_count), revision=revision)
+        if len(classes) < class_count:
+            classes['%sTest' % service_name(i)] = TEST_CLASS.format(
+                name='%sTest' % service_name(i), service=service_name(i))
+    return classes
+
+
+def changed_class_names(classes, changed_ratio):
+    """ Returns names of service classes included in deployment package """
+    services = sorted(name for name in classes if not name.endswith('Test'))
+    count = max(1, int(len(services) * changed_ratio))
+    step = max(1, len(services) // count)
+    return services[::step][:count]
+
+
+def write_source_dir(classes, source_dir):
+    classes_dir = os.path.join(source_dir, 'classes')
+    os.makedirs(classes_dir, exist_ok=True)
+    for name, body in classes.items():
+        with open(os.path.join(classes_dir, '%s.cls' % name), 'w', encoding='utf-8') as file:
+            file.write(body)
+        with open(os.path.join(classes_dir, '%s.cls-meta.xml' % name), 'w', encoding='utf-8') as file:
+            file.write(CLASS_META_XML)
+
+
+def write_deploy_zip(classes, names, zip_path):
+    members = '\n'.join('        <members>%s</members>' % name for name in sorted(names))
+    with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zipfile:
+        zipfile.writestr('package.xml', PACKAGE_XML.format(members=members))
+        for name in sorted(names):
+            zipfile.writestr('classes/%s.cls' % name, classes[name])
+            zipfile.writestr('classes/%s.cls-meta.xml' % name, CLASS_META_XML)
+
+
+def generate_org(work_dir, class_count, changed_ratio=0.01):
+    """ Writes source directory and deployment ZIP containing changed service classes
+    Returns tuple (classes, source_dir, deploy_zip) """
+    classes = generate_classes(class_count)
+    source_dir = os.path.join(work_dir, 'src')
+    write_source_dir(classes, source_dir)
+    changed = dict((name, classes[name].replace('revision = 0', 'revision = 1'))
+                   for name in changed_class_names(classes, changed_ratio))
+    deploy_zip = os.path.join(work_dir, 'deploy.zip')
+    write_deploy_zip(dict(classes, **changed), changed.keys(), deploy_zip)
+    return classes, source_dir, deploy_zip
@@ -0,0 +1,157 @@
+""" Batch command which deploys packages to several orgs concurrently """
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from metamatelib.abstract_command import AbstractCommand
+from metamatelib.deploy import DeployCommand
+from metamatelib.deploy_package import DeployPackage
+from metamatelib.package_minimizer import minimized_zip_path
+from metamatelib.test_extractor import scan_classes
+from sfdclib import SfdcLogger
+
+PRINT_LOCK = threading.Lock()
+
+
+class PrefixedLogger(SfdcLogger):
+    """ Logger which prefixes messages with target name, lines logged from different threads do not interleave """
+    def __init__(self, prefix, level=SfdcLogger._INFO):
+        super().__init__(level)
+        self._prefix = prefix
+
+    def _log(self, level, msg):
+        with PRINT_LOCK:
+            super()._log(level, "[%s] %s" % (self._prefix, msg))
+
+
+class SharedSources:
+    """ Deployment packages and source directory scans shared by deploy commands running in one process
+    Each package is read and each source directory is scanned once no matter how many targets use it """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+        self._results = dict()
+
+    def _get(self, key, load):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._results:
+                self._results[key] = load()
+            return self._results[key]
+
+    def package(self, zip_path, source_dir):
+        return self._get(('package', os.path.abspath(zip_path), source_dir),
+                         lambda: DeployPackage(zip_path, source_dir))
+
+    def scan_package(self, package):
+        return self._get(('package-scan', id(package)), package.scan_classes)
+
+    def test_runtimes(self, load):
+        return self._get(('test-runtimes',), load)
+
+    def scan_source_dir(self, source_dir, workers=None, log=None):
+        return self._get(('scan', os.path.abspath(source_dir)),
+                         lambda: scan_classes(source_dir, workers=workers, log=log))
+
+
+def load_manifest(manifest_path):
+    """ Loads batch manifest from YAML or JSON file in format
+    {
+        'defaults': {'deploy-zip': '../deploy.zip', 'check-only': True},
+        'targets': [{'name': 'qa', 'username': 'user@example.com.qa', 'password': 'Password', 'sandbox': True}]
+    }
+    Returns list of targets with defaults applied """
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        if manifest_path.lower().endswith('.json'):
+            manifest = json.load(file)
+        else:
+            manifest = yaml.safe_load(file)
+    if not isinstance(manifest, dict) or not manifest.get('targets'):
+        raise Exception("Manifest %s does not list any targets" % manifest_path)
+
+    targets = list()
+    names = set()
+    usernames = set()
+    for i, target in enumerate(manifest['targets']):
+        options = dict(manifest.get('defaults') or dict())
+        options.update(target)
+        options.setdefault('name', options.get('username') or "target%s" % (i + 1))
+        if options['name'] in names:
+            raise Exception("Target name %s is used more than once" % options['name'])
+        if options.get('username') in usernames:
+            raise Exception("Username %s is used by more than one target" % options['username'])
+        names.add(options['name'])
+        usernames.add(options.get('username'))
+        targets.append(options)
+    return targets
+
+
+def build_deploy_argv(options):
+    """ Converts target options to deploy command line arguments, option names are long switch names """
+    argv = ['deploy']
+    for key, value in options.items():
+        if key == 'name' or value is None or value is False:
+            continue
+        argv.append('--%s' % key)
+        if value is not True:
+            argv.append(str(value))
+    return argv
+
+
+class BatchCommand(AbstractCommand):
+    """ Batch command """
+    def __init__(self, args, log, parse_args):
+        super().__init__(args, log)
+        self._parse_args = parse_args
+        self._shared = SharedSources()
+
+    def _target_args(self, options):
+        args = self._parse_args(build_deploy_argv(options))
+        if args.minimize and not args.minimized_zip:
+            # Targets must not overwrite each other's minimized packages
+            zip_root = os.path.splitext(args.deploy_zip)[0]
+            args.minimized_zip = minimized_zip_path("%s-%s.zip" % (zip_root, options['name']))
+        return args
+
+    def _run_target(self, name, args):
+        log = PrefixedLogger(name)
+        started = time.time()
+        cmd = DeployCommand(args, log, self._shared)
+        try:
+            state = 'Succeeded' if cmd.run() else 'Failed'
+        except Exception as ex:
+            log.err("%s" % ex)
+            state = 'Error'
+        return {
+            'Name': name,
+            'Username': args.username,
+            'State': state,
+            'Tests': len(cmd.unit_tests_to_run),
+            'Time': time.time() - started
+        }
+
+    def run(self):
+        """ Gets called by Metamate """
+        targets = load_manifest(self._args.manifest)
+        # Arguments of all targets are validated before any of them is started
+        target_args = [(options['name'], self._target_args(options)) for options in targets]
+
+        workers = self._args.workers or len(target_args)
+        self._log.inf("Running %s target(s) using %s worker(s)" % (len(target_args), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._run_target, name, args) for name, args in target_args]
+            results = [future.result() for future in futures]
+
+        self._log.inf("Summary")
+        for result in results:
+            self._log.inf("  %-20s %-9s %-40s tests: %-5s %.1f s" % (
+                result['Name'], result['State'], result['Username'], result['Tests'], result['Time']))
+        failed = [result for result in results if result['State'] != 'Succeeded']
+        if failed:
+            self._log.err("%s of %s target(s) failed" % (len(failed), len(results)))
+        return len(failed) == 0
@@ -0,0 +1,94 @@
+""" Local cache bundles: symbol tables and test run times of an org packed into one compressed file
+so that fresh build agents do not have to compile all test classes again """
+import gzip
+import json
+import time
+
+from metamatelib.file_lock import write_file_atomically
+from metamatelib.metamatecache import CACHE_FORMAT_VERSION
+from metamatelib.test_sharding import TEST_RUNTIMES_FILE_NAME
+
+BUNDLE_FORMAT = 'metamate-cache-bundle'
+BUNDLE_VERSION = 1
+
+
+def build_bundle(cache, username, source_hashes=None):
+    """ Returns bundle containing class data of all cached classes, only classes whose hash matches
+    source_hashes ({'class_name_1': 'hash'}) are included when it is given. Format:
+    {
+        'Format': 'metamate-cache-bundle',
+        'Version': 1,
+        'CacheFormatVersion': 1,
+        'Username': 'user@example.com',
+        'Created': 1466501224.0,
+        'ApiVersions': ['45.0'],
+        'Classes': {'class_name_1': {'Id': '01p...', 'References': ['class_name_2'], 'Hash': '...',
+                                     'ApiVersion': '45.0'}},
+        'TestRuntimes': {'test_class_name_1': {'Time': 1520.0, 'Recorded': 1466501224.0}}
+    } """
+    classes = dict()
+    for class_name in sorted(cache.class_names()):
+        data = cache.get_class_data(class_name)
+        if data is None or 'Hash' not in data:
+            # Removed meanwhile or cached before hashes were introduced, such entries are never used
+            continue
+        if source_hashes is not None and source_hashes.get(class_name) != data['Hash']:
+            continue
+        classes[class_name] = data
+    return {
+        'Format': BUNDLE_FORMAT,
+        'Version': BUNDLE_VERSION,
+        'CacheFormatVersion': CACHE_FORMAT_VERSION,
+        'Username': username,
+        'Created': time.time(),
+        'ApiVersions': sorted(set(data.get('ApiVersion') for data in classes.values() if data.get('ApiVersion'))),
+        'Classes': classes,
+        'TestRuntimes': cache.load_json(TEST_RUNTIMES_FILE_NAME, dict())
+    }
+
+
+def write_bundle(bundle, path):
+    """ Writes gzip compressed JSON bundle, file is replaced atomically """
+    write_file_atomically(path, gzip.compress(json.dumps(bundle, separators=(',', ':')).encode('utf-8')))
+
+
+def read_bundle(path):
+    """ Reads and validates bundle written by write_bundle """
+    try:
+        with gzip.open(path, 'rb') as file:
+            bundle = json.loads(file.read().decode('utf-8'))
+    except (OSError, EOFError, ValueError) as ex:
+        raise Exception("Could not read cache bundle %s: %s" % (path, ex))
+    if not isinstance(bundle, dict) or bundle.get('Format') != BUNDLE_FORMAT:
+        raise Exception("%s is not a Metamate cache bundle" % path)
+    if bundle.get('Version', 0) > BUNDLE_VERSION or bundle.get('CacheFormatVersion', 0) > CACHE_FORMAT_VERSION:
+        raise Exception("Cache bundle %s was created by newer version of Metamate, please upgrade" % path)
+    if not isinstance(bundle.get('Classes'), dict):
+        raise Exception("Cache bundle %s does not contain class data" % path)
+    return bundle
+
+
+def select_imported_classes(bundle, cache, source_hashes=None):
+    """ Returns class data from bundle which should be merged into local cache
+    Local entries are kept unless they are stale (their hash does not match source_hashes) and bundle contains
+    an entry matching source. Bundle entries not matching source_hashes are skipped """
+    imported = dict()
+    for class_name, data in bundle['Classes'].items():
+        if source_hashes is not None and source_hashes.get(class_name) != data.get('Hash'):
+            continue
+        local = cache.get_class_data(class_name)
+        if local == data:
+            continue
+        if local is None or (source_hashes is not None and local.get('Hash') != source_hashes.get(class_name)):
+            imported[class_name] = data
+    return imported
+
+
+def merge_bundle_test_runtimes(cache, bundle):
+    """ Adds run times from bundle, the latest recorded time of each class wins """
+    def update(runtimes):
+        for class_name, data in bundle.get('TestRuntimes', dict()).items():
+            if class_name not in runtimes or runtimes[class_name]['Recorded'] < data['Recorded']:
+                runtimes[class_name] = data
+        return runtimes
+    cache.update_json(TEST_RUNTIMES_FILE_NAME, update, dict())
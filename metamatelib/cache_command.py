@@ -0,0 +1,57 @@
+""" Cache export and import commands """
+import os
+
+from metamatelib.abstract_command import AbstractCommand
+from metamatelib.cache_bundle import \
+    build_bundle, \
+    merge_bundle_test_runtimes, \
+    read_bundle, \
+    select_imported_classes, \
+    write_bundle
+from metamatelib.metamatecache import MetamateCache
+from metamatelib.test_extractor import scan_classes
+
+
+class CacheCommand(AbstractCommand):
+    """ Exports local cache of an org into a bundle or merges a bundle into local cache """
+    def run(self):
+        """ Gets called by Metamate """
+        cache = MetamateCache(self._args.username, self._args.cache_backend)
+        cache.load()
+        try:
+            if self._args.cache_command == 'export':
+                return self._export(cache)
+            return self._import(cache)
+        finally:
+            cache.close()
+
+    def _source_hashes(self):
+        """ Returns hashes of classes in source directory or None if it is not given """
+        if not self._args.source_dir:
+            return None
+        self._log.inf("Scanning source directory")
+        scan = scan_classes(self._args.source_dir, workers=self._args.scan_workers, log=self._log)
+        return dict((obj, result['Hash']) for obj, result in scan.items())
+
+    def _export(self, cache):
+        source_hashes = self._source_hashes()
+        self._log.inf("Exporting local cache of %s" % self._args.username)
+        bundle = build_bundle(cache, self._args.username, source_hashes)
+        write_bundle(bundle, self._args.output)
+        self._log.inf("  %s class(es) and run times of %s test class(es) written to %s (%s bytes)" % (
+            len(bundle['Classes']), len(bundle['TestRuntimes']), self._args.output,
+            os.path.getsize(self._args.output)))
+        return True
+
+    def _import(self, cache):
+        self._log.inf("Reading cache bundle %s" % self._args.input)
+        bundle = read_bundle(self._args.input)
+        if bundle['Username'] != self._args.username:
+            self._log.wrn("Bundle was exported from local cache of %s" % bundle['Username'])
+        source_hashes = self._source_hashes()
+        imported = select_imported_classes(bundle, cache, source_hashes)
+        cache.add_classes_data(imported)
+        merge_bundle_test_runtimes(cache, bundle)
+        self._log.inf("  %s of %s class(es) merged into local cache of %s" % (
+            len(imported), len(bundle['Classes']), self._args.username))
+        return True
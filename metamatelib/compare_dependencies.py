@@ -0,0 +1,48 @@
+""" Compare dependencies command """
+import json
+
+from metamatelib.abstract_command import AbstractCommand
+from metamatelib.local_dependency_finder import \
+    LOCAL_API_VERSION, \
+    compare_dependencies, \
+    find_local_class_dependencies
+from metamatelib.metamatecache import MetamateCache
+from metamatelib.test_extractor import scan_classes
+
+
+class CompareDependenciesCommand(AbstractCommand):
+    """ Compares dependencies found in local source with symbol tables cached by deploy command """
+    def run(self):
+        """ Gets called by Metamate """
+        cache = MetamateCache(self._args.username, self._args.cache_backend)
+        cache.load()
+
+        self._log.inf("Scanning source directory")
+        scan = scan_classes(self._args.source_dir, workers=self._args.scan_workers, log=self._log)
+
+        self._log.inf("Looking for classes with up to date symbol tables in local cache")
+        reference = dict()
+        for obj, result in scan.items():
+            data = cache.get_class_data(obj)
+            if data is not None and data.get('Hash') == result['Hash'] and \
+                    data.get('ApiVersion') != LOCAL_API_VERSION and not data.get('Unresolved'):
+                reference[obj] = data
+        if len(reference) == 0:
+            self._log.err("Local cache does not contain symbol tables of classes found in source directory, "
+                          "run deploy command with --use-cache switch first")
+            return False
+
+        candidate = find_local_class_dependencies(self._log, list(reference.keys()), self._args.source_dir, scan)
+        report = compare_dependencies(reference, candidate, scan.keys())
+
+        for class_name, diff in report['Classes'].items():
+            self._log.inf("%s\n  Missing: %s\n  Extra: %s" % (
+                class_name, ', '.join(diff['Missing']), ', '.join(diff['Extra'])))
+        self._log.inf("===== %s class(es) compared, %s reference(s) matched, %s missing, %s extra" % (
+            len(reference), report['Matched'], report['Missing'], report['Extra']))
+        self._log.inf("===== Precision: %.3f Recall: %.3f" % (report['Precision'], report['Recall']))
+
+        if self._args.output:
+            with open(self._args.output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+        return True
@@ -1,26 +1,53 @@
 """ Test class dependency finder """
+import hashlib
 import os
-import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from sfdclib import SfdcToolingApi
+from metamatelib.metrics import measure
+from metamatelib.poller import Poller
+from metamatelib.tooling_api import ToolingApi
+
+
+# Salesforce rejects query URLs longer than 16 KB
+QUERY_MAX_LENGTH = 10000
+
+
+def split_names_into_queries(query, names, max_length=QUERY_MAX_LENGTH):
+    """ Returns queries selecting records by name so that each query stays shorter than max_length """
+    queries = list()
+    chunk = list()
+    length = len(query)
+    for name in names:
+        if len(chunk) > 0 and length + len(name) + 3 > max_length:
+            queries.append(query.format("','".join(chunk)))
+            chunk = list()
+            length = len(query)
+        chunk.append(name)
+        length += len(name) + 3
+    if len(chunk) > 0:
+        queries.append(query.format("','".join(chunk)))
+    return queries
 
 
 def retrieve_apex_classes(session, classes=None):
-    """ Retrieves list of Apex classes """
-    tooling = SfdcToolingApi(session)
+    """ Retrieves list of Apex classes, long lists of class names are split into several queries """
+    tooling = ToolingApi(session)
     query = "SELECT Id,Name FROM ApexClass"
-    if classes is not None:
-        query += " WHERE Name IN ('{0}')".format("','".join(classes))
-    res = tooling.anon_query(query)
+    if classes is None:
+        queries = [query]
+    else:
+        queries = split_names_into_queries(query + " WHERE Name IN ('{0}')", classes)
     apex_classes = dict()
-    for apex_class in res['records']:
-        apex_classes[apex_class['Name']] = apex_class['Id']
+    for query in queries:
+        for apex_class in tooling.query_all(query):
+            apex_classes[apex_class['Name']] = apex_class['Id']
     return apex_classes
 
 
-def create_metadata_container(tooling):
+def create_metadata_container(tooling, name='MetamateMetadataContainer'):
     """ (Re)creates metadata container """
-    container = {'Name': 'MetamateMetadataContainer'}
+    container = {'Name': name}
 
     res = tooling.anon_query(
         "SELECT Id,Name FROM MetadataContainer WHERE Name='%s'" % container['Name'])
@@ -37,22 +64,84 @@ def create_metadata_container(tooling):
     return container
 
 
-def find_test_class_dependencies(log, session, test_classes, source_dir, use_cache, cache):
-    """ Finds test class dependencies """
+def hash_class_body(class_body):
+    """ Returns hash of Apex class body, used to detect stale cache entries """
+    return hashlib.sha1(class_body.encode('utf-8')).hexdigest()
+
+
+def unresolved_class_data(class_hash, api_version):
+    """ Class data of a class Salesforce could not produce symbol table for (class is missing from the org or
+    did not compile), cached so that unchanged class is not sent to Salesforce again. Its references have to be
+    found some other way (i.e. in local source) """
+    return {
+        'Id': None,
+        'References': list(),
+        'Hash': class_hash,
+        'ApiVersion': api_version,
+        'Unresolved': True
+    }
+
+
+def select_unresolved_classes(dependencies):
+    """ Returns sorted names of classes whose data was produced by unresolved_class_data """
+    return sorted(class_name for class_name, data in dependencies.items() if data.get('Unresolved'))
+
+
+def is_cache_entry_valid(data, class_hash, api_version):
+    """ Checks whether cached class data was produced from the same body and API version """
+    return data is not None and \
+        data.get('Hash') == class_hash and \
+        data.get('ApiVersion') == api_version
+
+
+def find_test_class_dependencies(log, session, test_classes, source_dir, use_cache, cache, class_hashes=None,
+                                 metrics=None, connect=None, **retrieve_kwargs):
+    """ Finds test class dependencies, class body hashes are calculated unless passed in class_hashes
+    Session does not have to be connected, connect is called before the first API request so that Salesforce
+    is not contacted when all test classes are cached
+    Remaining keyword arguments are passed to retrieve_class_dependencies """
     if use_cache:
-        # Retrieve info about classes not in cache
-        classes_to_recompile = list(set(test_classes) - set(cache.keys()))
-        apex_classes = retrieve_apex_classes(session, classes_to_recompile)
+        log.inf("Looking for test classes changed since they were cached")
+        api_version = session.get_api_version()
+        dependencies = dict()
+        classes_to_recompile = dict()
+        for class_name in test_classes:
+            if class_hashes is not None and class_name in class_hashes:
+                class_hash = class_hashes[class_name]
+            else:
+                class_hash = hash_class_body(read_class_body(source_dir, class_name))
+            data = cache.get_class_data(class_name)
+            if is_cache_entry_valid(data, class_hash, api_version):
+                dependencies[class_name] = data
+            else:
+                classes_to_recompile[class_name] = class_hash
+        log.inf("  %s test class(es) need to be recompiled" % len(classes_to_recompile))
+        if metrics is not None:
+            metrics.count('dependency_cache_hits', len(dependencies))
+            metrics.count('dependency_cache_misses', len(classes_to_recompile))
+        if len(classes_to_recompile) == 0:
+            return dependencies, reverse_class_dependencies(dependencies)
+        if connect is not None:
+            connect()
+
+        # Retrieve info about classes which are not cached or changed
+        with measure(metrics, 'retrieve_apex_classes'):
+            apex_classes = retrieve_apex_classes(session, list(classes_to_recompile.keys()))
         classes = dict()
         for class_name, class_id in apex_classes.items():
             classes[class_id] = class_name
-        dependencies = retrieve_class_dependencies(log, session, classes, source_dir)
-        # Add cached data
-        for class_name, data in cache.items():
-            dependencies[class_name] = data
+        dependencies.update(retrieve_class_dependencies(
+            log, session, classes, source_dir, metrics=metrics, **retrieve_kwargs))
+        for class_name, class_hash in classes_to_recompile.items():
+            if class_name not in dependencies and class_name not in apex_classes:
+                # Test class added by the deployment package does not exist in the org yet
+                dependencies[class_name] = unresolved_class_data(class_hash, api_version)
     else:
+        if connect is not None:
+            connect()
         log.inf("Retrieving list of Apex classes from Salesforce")
-        apex_classes = retrieve_apex_classes(session)
+        with measure(metrics, 'retrieve_apex_classes'):
+            apex_classes = retrieve_apex_classes(session)
 
         log.inf("Looking for tests that exist both locally and in Salesforce")
         matching_tests = dict()  # Format: {'Class_Id': 'Class_Name'}
@@ -62,76 +151,219 @@ def find_test_class_dependencies(log, session, test_classes, source_dir, use_cac
 
         if len(matching_tests) == 0:
             log.inf("No matching classes found in both Salesforce and local source folder")
-            return dict()
+            return dict(), dict()
 
-        dependencies = retrieve_class_dependencies(log, session, matching_tests, source_dir)
+        dependencies = retrieve_class_dependencies(
+            log, session, matching_tests, source_dir, metrics=metrics, **retrieve_kwargs)
     return dependencies, reverse_class_dependencies(dependencies)
 
 
-def retrieve_class_dependencies(log, session, classes, source_dir):
-    """ Retrieves class dependencies from Salesforce.com """
-    tooling = SfdcToolingApi(session)
-    log.inf("Creating metadata container")
-    container = create_metadata_container(tooling)
+def run_concurrently(func, items, max_workers):
+    """ Calls func for each item with at most max_workers calls in flight, yields results in order """
+    if max_workers is None or max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(func, items):
+            yield result
+
+
+def extract_class_references(symbol_table):
+    """ Returns names of non-managed classes referenced in symbol table """
+    refs = list()
+    for ref in symbol_table['externalReferences']:
+        # Skip managed code dependencies
+        if ref['namespace'] is None:
+            refs.append(ref['name'])
+    return refs
+
+
+def add_class_members(log, tooling, container, classes, source_dir, max_workers=1, batch_size=200):
+    """ Adds classes to metadata container
+    Members are added in batches of up to batch_size records using sObject Collections,
+    up to max_workers requests are sent concurrently. Returns member ids and class body hashes
+    in format ({'Member_Id': 'Class_Name'}, {'Class_Name': 'Hash'}) """
+    if not tooling.supports_collections():
+        batch_size = 1
+    batch_size = max(1, min(batch_size, tooling.COLLECTIONS_MAX_SIZE))
+
+    def add_members(batch):
+        records = list()
+        hashes = list()
+        for class_id, class_name in batch:
+            class_body = read_class_body(source_dir, class_name)
+            records.append({
+                'MetadataContainerId': container['Id'],
+                'ContentEntityId': class_id,
+                'Body': class_body
+            })
+            hashes.append(hash_class_body(class_body))
+        if len(records) == 1:
+            results = [tooling.post('/sobjects/ApexClassMember/', records[0])]
+        else:
+            results = tooling.create_records('ApexClassMember', records)
+            if not isinstance(results, list) or len(results) != len(records):
+                raise Exception("Could not add classes to metadata container: %s" % results)
+        added = list()
+        for (class_id, class_name), class_hash, res in zip(batch, hashes, results):
+            if not isinstance(res, dict) or not res.get('success'):
+                raise Exception("Could not add class %s to metadata container: %s" % (class_name, res))
+            added.append((class_id, class_name, res['id'], class_hash))
+        return added
 
     members = dict()
-    log.inf("===> Adding %s Apex classes to metadata container" % len(classes))
+    hashes = dict()
+    log.inf("===> Adding %s Apex classes to metadata container %s" % (len(classes), container['Name']))
+    items = list(classes.items())
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
     count = len(classes)
     i = 1
-    for class_id, class_name in classes.items():
-        log.inf("  ({0}/{1}) Id: {2} Name: {3}".format(i, count, class_id, class_name))
-        class_body = read_class_body(source_dir, class_name)
-        res = tooling.post('/sobjects/ApexClassMember/', {
-            'MetadataContainerId': container['Id'],
-            'ContentEntityId': class_id,
-            'Body': class_body
-        })
-        members[res['id']] = class_name
-        i += 1
-
-    log.inf("===> Compiling metadata")
+    for added in run_concurrently(add_members, batches, max_workers):
+        for class_id, class_name, member_id, class_hash in added:
+            log.inf("  ({0}/{1}) Id: {2} Name: {3}".format(i, count, class_id, class_name))
+            members[member_id] = class_name
+            hashes[class_name] = class_hash
+            i += 1
+    return members, hashes
+
+
+def compile_metadata_container(log, tooling, container):
+    """ Submits check-only compilation of metadata container, returns ContainerAsyncRequest id """
+    log.inf("===> Compiling metadata container %s" % container['Name'])
     res = tooling.post('/sobjects/ContainerAsyncRequest/', {
         'MetadataContainerId': container['Id'],
         'IsCheckOnly': 'true'})
 
     if not res['success']:
         raise Exception("Tooling API call failed")
+    return res['id']
+
 
-    req_id = res['id']
-    while True:
+def wait_for_compilation_to_finish(log, tooling, req_id, poller):
+    """ Waits for ContainerAsyncRequest to finish, returns its state and error message """
+    result = dict()
+
+    def check():
         res = tooling.anon_query(
             "SELECT State,ErrorMsg FROM ContainerAsyncRequest WHERE Id='%s'" % req_id)
         log.inf(res['records'][0]['State'])
-        if res['records'][0]['State'] not in ['Queued', 'Pending', 'InProgress']:
-            break
-        time.sleep(5)
+        result.update(res['records'][0])
+        return result['State'] not in ['Queued', 'Pending', 'InProgress']
+
+    poller.wait(check, "compilation %s" % req_id)
+    return result['State'], result['ErrorMsg']
 
-    log.inf("===> Retrieving symbol tables")
+
+def retrieve_symbol_tables(log, tooling, container, members, hashes, api_version, record_unresolved=False):
+    """ Retrieves symbol tables of compiled container members, returns dependencies of classes
+    Members without symbol table are returned as unresolved when record_unresolved is True """
+    log.inf("===> Retrieving symbol tables from metadata container %s" % container['Name'])
 
     dependencies = dict()
-    for class_id, class_name in members.items():
-        log.inf("  Id: %s Name: %s" % (class_id, class_name))
-        res = tooling.get('/sobjects/ApexClassMember/%s/' % class_id)
-        # Skip classes without dependencies and managed code dependencies
-        if res['SymbolTable'] is None:
+    records = tooling.query_all(
+        "SELECT Id,SymbolTable FROM ApexClassMember WHERE MetadataContainerId='%s'" % container['Id'])
+    for record in records:
+        member_id = record['Id']
+        if member_id not in members:
+            continue
+        class_name = members[member_id]
+        log.inf("  Id: %s Name: %s" % (member_id, class_name))
+        if record['SymbolTable'] is None:
+            if record_unresolved:
+                dependencies[class_name] = unresolved_class_data(hashes[class_name], api_version)
             continue
-        refs = list()
-        for ref in res['SymbolTable']['externalReferences']:
-            # Skip managed code dependencies
-            if ref['namespace'] is None:
-                refs.append(ref['name'])
         dependencies[class_name] = {
-            'Id': class_id,
-            'References': refs
+            'Id': member_id,
+            'References': extract_class_references(record['SymbolTable']),
+            'Hash': hashes[class_name],
+            'ApiVersion': api_version
         }
+    return dependencies
+
 
-    log.inf("===> Deleting metadata container")
-    tooling.delete('/sobjects/MetadataContainer/%s' % container['Id'])
+def retrieve_class_dependencies(log, session, classes, source_dir, max_workers=1, batch_size=200,
+                                container_size=None, retries=1, poller=None, metrics=None):
+    """ Retrieves class dependencies from Salesforce.com
+    Classes are split into metadata containers of up to container_size classes. Containers are
+    compiled in a pipeline: next container is uploaded while previous one compiles. Containers
+    which fail to compile are retried up to retries times. """
+    if len(classes) == 0:
+        return dict()
+    tooling = ToolingApi(session)
+    if poller is None:
+        poller = Poller()
+    api_version = session.get_api_version()
+    items = list(classes.items())
+    if not container_size:
+        container_size = max(1, len(items))
+    chunks = deque()
+    for i in range(0, len(items), container_size):
+        chunks.append((len(chunks) + 1, dict(items[i:i + container_size]), 0))
+    chunk_count = len(chunks)
+
+    def start_chunk(chunk):
+        """ Uploads chunk into its own container and submits compilation """
+        chunk_no, chunk_classes, attempt = chunk
+        log.inf("Creating metadata container for chunk %s/%s" % (chunk_no, chunk_count))
+        container = None
+        try:
+            with measure(metrics, 'upload_members'):
+                container = create_metadata_container(tooling, 'MetamateMetadataContainer%s' % chunk_no)
+                members, hashes = add_class_members(
+                    log, tooling, container, chunk_classes, source_dir, max_workers, batch_size)
+                req_id = compile_metadata_container(log, tooling, container)
+        except Exception as ex:
+            log.err("Could not compile chunk %s/%s: %s" % (chunk_no, chunk_count, ex))
+            if container is not None:
+                tooling.delete('/sobjects/MetadataContainer/%s' % container['Id'])
+            return chunk, None
+        return chunk, (container, members, hashes, req_id)
+
+    def finish_chunk(started):
+        """ Waits for chunk compilation and collects symbol tables, failed chunks are queued again """
+        (chunk_no, chunk_classes, attempt), compilation = started
+        if compilation is None:
+            state, error = 'Failed', None
+        else:
+            container, members, hashes, req_id = compilation
+            with measure(metrics, 'compile_wait'):
+                state, error = wait_for_compilation_to_finish(log, tooling, req_id, poller)
+        if state != 'Completed' and attempt < retries:
+            log.wrn("Compilation of chunk %s/%s finished with state %s, retrying: %s" % (
+                chunk_no, chunk_count, state, error))
+            chunks.append((chunk_no, chunk_classes, attempt + 1))
+        elif compilation is not None:
+            if state != 'Completed':
+                log.err("Compilation of chunk %s/%s finished with state %s: %s" % (
+                    chunk_no, chunk_count, state, error))
+            with measure(metrics, 'symbol_tables'):
+                # Symbol tables are missing from all members of a failed container, only members of a
+                # compiled one are known not to have them
+                dependencies.update(retrieve_symbol_tables(
+                    log, tooling, container, members, hashes, api_version, record_unresolved=state == 'Completed'))
+            if metrics is not None:
+                metrics.count('classes_compiled', len(members))
+        if compilation is not None:
+            log.inf("===> Deleting metadata container %s" % container['Name'])
+            with measure(metrics, 'delete_container'):
+                tooling.delete('/sobjects/MetadataContainer/%s' % container['Id'])
+
+    dependencies = dict()
+    compiling = None
+    while len(chunks) > 0 or compiling is not None:
+        started = start_chunk(chunks.popleft()) if len(chunks) > 0 else None
+        if compiling is not None:
+            finish_chunk(compiling)
+        compiling = started
     return dependencies
 
 
 def read_class_body(source_dir, class_name):
-    with open(os.path.join(source_dir, *["classes", "{0}.cls".format(class_name)]), 'r') as file:
+    """ Reads class body from source directory or from class source object (i.e. DeployPackage) """
+    if hasattr(source_dir, 'read_class_body'):
+        return source_dir.read_class_body(class_name)
+    with open(os.path.join(source_dir, *["classes", "{0}.cls".format(class_name)]), 'r', encoding='utf-8') as file:
         return file.read(-1)
 
 
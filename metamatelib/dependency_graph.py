@@ -0,0 +1,66 @@
+""" Class dependency graph used to select tests """
+
+
+def build_dependants(dependencies):
+    """ Returns dictionary in format {'class_name': {'dependant_class_name_1', 'dependant_class_name_2'}} """
+    dependants = dict()
+    for class_name, data in dependencies.items():
+        dependants.setdefault(class_name, set())
+        for ref in data['References']:
+            if ref != class_name:
+                dependants.setdefault(ref, set()).add(class_name)
+    return dependants
+
+
+def build_reverse_index(dependencies, test_classes, max_depth=None, max_fanout=None):
+    """ Precomputes which test classes depend on each class directly or transitively
+    Consumes dictionary in find_test_class_dependencies format for test and non-test classes,
+    produces dictionary in format
+    {
+        'class_name_1': ['test_class_name_1', 'test_class_name_2'],
+        'class_name_2': ['test_class_name_1']
+    }
+    Dependency chains longer than max_depth are ignored (1 selects only tests referencing class
+    directly). Changes are not propagated through classes which have more than max_fanout
+    dependants, such classes still select tests which reference them directly. """
+    dependants = build_dependants(dependencies)
+    test_classes = sorted(set(test_classes))
+    test_bits = dict((class_name, 1 << i) for i, class_name in enumerate(test_classes))
+
+    def is_hub(class_name):
+        return max_fanout is not None and len(dependants[class_name]) > max_fanout
+
+    # Sets of test classes are kept as bit masks, each pass extends chains by one class
+    reach = dict((class_name, test_bits.get(class_name, 0)) for class_name in dependants)
+    depth = 0
+    while max_depth is None or depth < max_depth:
+        changed = False
+        next_reach = dict()
+        for class_name, class_dependants in dependants.items():
+            mask = reach[class_name]
+            if is_hub(class_name):
+                for dependant in class_dependants:
+                    mask |= test_bits.get(dependant, 0)
+            else:
+                for dependant in class_dependants:
+                    mask |= reach[dependant]
+            if mask != reach[class_name]:
+                changed = True
+            next_reach[class_name] = mask
+        reach = next_reach
+        depth += 1
+        if not changed:
+            break
+
+    reverse_index = dict()
+    for class_name, mask in reach.items():
+        mask &= ~test_bits.get(class_name, 0)
+        if mask == 0:
+            continue
+        dependant_tests = list()
+        while mask:
+            lowest_bit = mask & -mask
+            dependant_tests.append(test_classes[lowest_bit.bit_length() - 1])
+            mask ^= lowest_bit
+        reverse_index[class_name] = dependant_tests
+    return reverse_index
@@ -1,32 +1,90 @@
 """ Deploy command """
+import os
 import time
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from metamatelib.abstract_command import AbstractCommand
-from metamatelib.dependency_finder import find_test_class_dependencies
+from metamatelib.dependency_finder import \
+    find_test_class_dependencies, \
+    reverse_class_dependencies, \
+    select_unresolved_classes
+from metamatelib.dependency_graph import build_reverse_index
+from metamatelib.deploy_package import DeployPackage
+from metamatelib.git_diff import \
+    find_changed_class_objects, \
+    get_head_commit
+from metamatelib.junit_report import write_junit_report
+from metamatelib.local_dependency_finder import find_local_class_dependencies
+from metamatelib.metadata_api import MetadataApi
+from metamatelib.metadata_references import \
+    find_component_references, \
+    find_trigger_references, \
+    select_tests_touching
 from metamatelib.metamatecache import MetamateCache
+from metamatelib.metrics import Metrics
+from metamatelib.package_minimizer import \
+    DEPLOYED_HASHES_FILE_NAME, \
+    hash_components, \
+    minimized_zip_path, \
+    read_destructive_members, \
+    select_changed_components, \
+    select_unlisted_files, \
+    write_minimized_package
+from metamatelib.poller import Poller
+from metamatelib.session import \
+    MetamateSession, \
+    SessionCache
 from metamatelib.test_extractor import \
-    extract_class_objects, \
-    extract_test_objects, \
-    extract_class_names, \
-    find_test_objects
-from sfdclib import \
-    SfdcSession, \
-    SfdcMetadataApi
+    ScanIndex, \
+    scan_classes, \
+    scan_triggers, \
+    select_active_objects, \
+    select_active_test_objects, \
+    select_class_names, \
+    select_test_objects
+from metamatelib.test_sharding import \
+    SHARD_PLANS_FILE_NAME, \
+    TEST_RUNTIMES_FILE_NAME, \
+    find_shard_plan, \
+    merge_test_runtimes, \
+    record_shard_plan, \
+    shard_plan_key, \
+    split_into_shards, \
+    update_test_runtimes
 
 
 class DeployCommand(AbstractCommand):
     """ Deploy command """
-    def __init__(self, args, log):
+    GIT_STATE_FILE_NAME = "git-state.json"
+    VALIDATIONS_FILE_NAME = "validations.json"
+
+    def __init__(self, args, log, shared=None):
         super().__init__(args, log)
+        self._shared = shared
         self._check_only = self._args.check_only
         self._test_level = self._args.test_level
         self._cache = None
+        self._package = None
+        self._deploy_package = None
+        self._components = None
+        self._changed_components = None
+        self._unlisted_files = None
         self._session = None
         self._mapi = None
+        self._metrics = Metrics()
         self._deployment_id = None
         self._deployment_state = None
         self._deployment_detail = None
         self._unit_tests_to_run = None
         self._unit_test_detail = None
+        self._cancel_requested = False
+        # Failures already logged while polling are not logged again when deployment finishes
+        self._reported_failures = set()
+        # Test results and component failures of each deployment in format {'deployment_id': (tests, failures)}
+        self._deployment_results = dict()
+
+    @property
+    def unit_tests_to_run(self):
+        return self._unit_tests_to_run or list()
 
     def _compose_sf_connection_settings(self):
         """ Composes Salesforce connection settings """
@@ -42,106 +100,408 @@ class DeployCommand(AbstractCommand):
 
         return sf_kwargs
 
-    def _wait_for_deployment_to_finish(self):
-        while self._deployment_state in ['Queued', 'Pending', 'InProgress']:
-            time.sleep(5)
-            self._deployment_state, state_detail, self._deployment_detail, self._unit_test_detail =\
-                self._mapi.check_deploy_status(self._deployment_id)
-            if state_detail is None:
-                self._log.inf("  State: %s" % self._deployment_state)
+    def _create_poller(self):
+        return Poller(
+            initial_interval=self._args.poll_interval,
+            max_interval=self._args.poll_max_interval,
+            timeout=self._args.timeout)
+
+    def _check_deployment_status(self):
+        """ Retrieves deployment status, returns True when deployment is finished """
+        self._deployment_state, state_detail, self._deployment_detail, self._unit_test_detail =\
+            self._mapi.check_deploy_status(self._deployment_id)
+        if state_detail is None:
+            self._log.inf("  State: %s" % self._deployment_state)
+        else:
+            if int(self._deployment_detail['deployed_count']) + \
+               int(self._deployment_detail['failed_count']) < \
+               int(self._deployment_detail['total_count']):
+                progress = "(%s/%s) " % (
+                    int(self._deployment_detail['deployed_count']) +
+                    int(self._deployment_detail['failed_count']),
+                    self._deployment_detail['total_count']
+                    )
             else:
-                if int(self._deployment_detail['deployed_count']) + \
-                   int(self._deployment_detail['failed_count']) < \
-                   int(self._deployment_detail['total_count']):
-                    progress = "(%s/%s) " % (
-                        self._deployment_detail['deployed_count'] +
-                        self._deployment_detail['failed_count'],
-                        self._deployment_detail['total_count']
-                        )
-                else:
-                    progress = "(%s/%s) " % (
-                        self._unit_test_detail['completed_count'],
-                        self._unit_test_detail['total_count']
-                        )
+                progress = "(%s/%s) " % (
+                    self._unit_test_detail['completed_count'],
+                    self._unit_test_detail['total_count']
+                    )
+
+            self._log.inf("  State: %s - %s%s" % (
+                self._deployment_state,
+                progress,
+                state_detail))
+        self._stream_failures()
+        return self._deployment_state not in ['Queued', 'Pending', 'InProgress']
+
+    @staticmethod
+    def _unit_test_error_key(err):
+        return 'test', err['class'], err['method']
 
-                self._log.inf("  State: %s - %s%s" % (
-                    self._deployment_state,
-                    progress,
-                    state_detail))
+    @staticmethod
+    def _deployment_error_key(err):
+        return 'component', err['type'], err['file'], err['message']
+
+    def _stream_failures(self):
+        """ Logs failures reported since the last status check as soon as they appear, updates JUnit report
+        and cancels deployment once --fail-fast number of failures is reached """
+        test_results = self._mapi.get_test_results()
+        component_failures = self._mapi.get_component_failures()
+        self._deployment_results[self._deployment_id] = (test_results, component_failures)
+        for err in component_failures:
+            if self._deployment_error_key(err) not in self._reported_failures:
+                self._reported_failures.add(self._deployment_error_key(err))
+                self._log_deployment_error(err)
+        failed_tests = [result for result in test_results if result['failed']]
+        for err in failed_tests:
+            if self._unit_test_error_key(err) not in self._reported_failures:
+                self._reported_failures.add(self._unit_test_error_key(err))
+                self._log_unit_test_error(err)
+
+        if self._args.junit_file:
+            write_junit_report(
+                self._args.junit_file,
+                [result for tests, _ in self._deployment_results.values() for result in tests],
+                [failure for _, failures in self._deployment_results.values() for failure in failures])
+
+        failure_count = len(component_failures) + len(failed_tests)
+        if self._args.fail_fast and failure_count >= self._args.fail_fast and not self._cancel_requested and \
+                self._deployment_state in ['Queued', 'Pending', 'InProgress']:
+            self._log.err("%s failure(s) reported, canceling deployment %s" % (failure_count, self._deployment_id))
+            self._cancel_requested = True
+            try:
+                self._mapi.cancel_deploy(self._deployment_id)
+            except Exception as ex:
+                self._log.wrn("Could not cancel deployment: %s" % ex)
+
+    def _wait_for_deployment_to_finish(self):
+        if self._deployment_state not in ['Queued', 'Pending', 'InProgress']:
+            return
+        poller = self._create_poller()
+        with self._metrics.phase('deploy_wait'):
+            poller.wait(self._check_deployment_status, "deployment %s" % self._deployment_id)
+        self._log.inf("  Checked deployment status %s time(s), waited %.1f s" % (
+            poller.poll_count, poller.time_waited))
+        self._metrics.count('deploy_polls', poller.poll_count)
+
+    def _log_unit_test_error(self, err):
+        self._log.err("=====\nClass: %s\nMethod: %s\nError: %s\nStack trace: %s\n" % (
+            err['class'],
+            err['method'],
+            err['message'],
+            err['stack_trace']
+            ))
 
     def _log_unit_test_errors(self):
         for err in self._unit_test_detail['errors']:
-            self._log.err("=====\nClass: %s\nMethod: %s\nError: %s\nStack trace: %s\n" % (
-                err['class'],
-                err['method'],
-                err['message'],
-                err['stack_trace']
-                ))
+            if self._unit_test_error_key(err) not in self._reported_failures:
+                self._log_unit_test_error(err)
         self._log.err("===== %s test(s) failed out of %s" %
                       (len(self._unit_test_detail['errors']), self._unit_test_detail['total_count']))
 
+    def _log_deployment_error(self, err):
+        self._log.err("=====\nType: %s\nFile: %s\nStatus: %s\nMessage: %s\n" % (
+            err['type'],
+            err['file'],
+            err['status'],
+            err['message']
+            ))
+
     def _log_deployment_errors(self):
         for err in self._deployment_detail['errors']:
-            self._log.err("=====\nType: %s\nFile: %s\nStatus: %s\nMessage: %s\n" % (
-                err['type'],
-                err['file'],
-                err['status'],
-                err['message']
-                ))
+            if self._deployment_error_key(err) not in self._reported_failures:
+                self._log_deployment_error(err)
         self._log.err("===== %s Component(s) failed out of %s" %
                       (len(self._deployment_detail['errors']), self._deployment_detail['total_count']))
 
+    def _create_session(self, sf_kwargs):
+        return MetamateSession(**sf_kwargs)
+
+    def _prepare_session(self):
+        """ Creates session without logging in, Salesforce is contacted by _connect_to_salesforce """
+        self._session = self._create_session(self._compose_sf_connection_settings())
+        self._session.metrics = self._metrics
+        if self._args.api_workers > DEFAULT_POOLSIZE:
+            # Keep a connection open for each concurrent Tooling API request
+            self._session.mount('https://', HTTPAdapter(pool_maxsize=self._args.api_workers))
+
     def _connect_to_salesforce(self):
-        sf_kwargs = self._compose_sf_connection_settings()
+        """ Logs in unless already connected """
+        if self._mapi is not None:
+            return
+        if self._args.password is None:
+            raise Exception("Password is required to connect to Salesforce")
         self._log.inf("Connecting to Salesforce")
-        self._session = SfdcSession(**sf_kwargs)
+        with self._metrics.phase('login'):
+            self._login()
+        self._mapi = MetadataApi(self._session)
+
+    def _login(self):
+        if self._args.reuse_session:
+            if not SessionCache.is_available():
+                self._log.wrn("cryptography package is not installed, session will not be cached")
+            else:
+                self._session.session_cache = SessionCache(self._cache, self._args.password, self._args.token)
+                if self._session.session_cache.restore(self._session):
+                    self._log.inf("  Reusing session cached by previous run")
+                    return
         self._session.login()
 
+    def _git_base(self):
+        """ Returns git revision to compare source directory with or None to use deployment ZIP """
+        if self._args.git_base:
+            return self._args.git_base
+        if self._args.since_last_run:
+            commits = self._cache.load_json(self.GIT_STATE_FILE_NAME, dict())
+            base = commits.get(os.path.abspath(self._args.source_dir))
+            if base is None:
+                self._log.wrn("Last successful run is not recorded, using deployment ZIP to find changed classes")
+            return base
+        return None
+
+    def _record_last_run_commit(self):
+        commit = get_head_commit(self._args.source_dir)
+        if commit is None:
+            return
+        def update(commits):
+            commits[os.path.abspath(self._args.source_dir)] = commit
+            return commits
+        self._cache.update_json(self.GIT_STATE_FILE_NAME, update, dict())
+
+    def _minimize_package(self):
+        self._log.inf("Comparing components with last deployed versions")
+        self._components = hash_components(self._package)
+        deployed_hashes = self._cache.load_json(DEPLOYED_HASHES_FILE_NAME, dict())
+        self._changed_components = select_changed_components(self._components, deployed_hashes)
+        self._log.inf("  %s of %s component(s) changed" % (len(self._changed_components), len(self._components)))
+        self._unlisted_files = select_unlisted_files(self._package, self._components)
+        for name in self._unlisted_files:
+            self._log.inf("  %s is not a listed component, deploying it" % name)
+        if not self._has_changes():
+            return
+
+        zip_path = self._args.minimized_zip or minimized_zip_path(self._args.deploy_zip)
+        self._log.inf("Writing minimized deployment ZIP file to %s" % zip_path)
+        write_minimized_package(self._package, self._components, self._changed_components, zip_path)
+        self._deploy_package = DeployPackage(zip_path, self._args.source_dir)
+
+    def _has_changes(self):
+        return len(self._changed_components) > 0 or len(self._unlisted_files) > 0
+
+    def _record_deployed_hashes(self):
+        deleted = read_destructive_members(self._package)
+
+        def update(deployed_hashes):
+            # Deleted components are deployed again when they are added back
+            for key in deleted:
+                deployed_hashes.pop(key, None)
+            for key in self._changed_components:
+                if self._components[key]['Hash'] is not None:
+                    deployed_hashes[key] = self._components[key]['Hash']
+            return deployed_hashes
+        self._cache.update_json(DEPLOYED_HASHES_FILE_NAME, update, dict())
+
     def _find_unit_tests_to_run(self):
-        self._log.inf("Extracting names of objects containing classes from deployment ZIP")
-        class_objects = extract_class_objects(self._args.deploy_zip)
+        git_base = self._git_base()
+        scan_index = None
+        # Source directory scan shared with other targets does not use scan index of this org
+        if self._args.use_cache and self._args.source_dir is not None and (git_base is not None or not self._shared):
+            scan_index = ScanIndex(self._cache, self._args.source_dir)
+        class_source = self._args.source_dir
+        with self._metrics.phase('scan'):
+            if git_base is not None:
+                self._log.inf("Looking for classes changed since %s" % git_base)
+                class_objects, deleted_objects = find_changed_class_objects(self._args.source_dir, git_base)
+                for obj in deleted_objects:
+                    self._cache.delete_class_data(obj)
+
+                # Scan index may have been built from another checkout, so whole directory is listed and files
+                # whose modification time or size differ are scanned again, git diff only tells what changed
+                self._log.inf("Scanning source directory, %s object(s) changed" % len(class_objects))
+                all_classes = scan_classes(self._args.source_dir, workers=self._args.scan_workers, index=scan_index,
+                                           log=self._log)
+                scan = dict((obj, all_classes[obj]) for obj in class_objects if obj in all_classes)
+            else:
+                self._log.inf("Extracting names of objects containing classes from deployment ZIP")
+                if self._args.tests_from_minimized:
+                    class_objects = self._deploy_package.class_objects()
+                else:
+                    class_objects = self._package.class_objects()
+
+                self._log.inf("Scanning classes contained in deployment ZIP")
+                scan = self._shared.scan_package(self._package) if self._shared else self._package.scan_classes()
+                all_classes = dict()
+                if self._args.source_dir is not None:
+                    self._log.inf("Scanning source directory")
+                    if self._shared:
+                        all_classes.update(self._shared.scan_source_dir(
+                            self._args.source_dir, self._args.scan_workers, self._log))
+                    else:
+                        all_classes.update(scan_classes(self._args.source_dir, workers=self._args.scan_workers,
+                                                        index=scan_index, log=self._log))
+                # Classes being deployed take precedence over their copies in source directory
+                all_classes.update(scan)
+                class_source = self._package
+            triggers = dict()
+            if self._args.source_dir is not None:
+                triggers = scan_triggers(self._args.source_dir, self._log, scan_index)
+            if scan_index is not None:
+                self._log.inf("  %s file(s) unchanged, %s file(s) scanned" % (scan_index.hits, scan_index.misses))
+                self._metrics.count('scan_index_hits', scan_index.hits)
+                self._metrics.count('scan_index_misses', scan_index.misses)
+                scan_index.save()
 
         self._log.inf("Checking which objects contain test classes")
-        test_objects = extract_test_objects(class_objects, self._args.source_dir)
-        nontest_objects = class_objects
-        for test_object in test_objects:
-            nontest_objects.remove(test_object)
-            if self._args.use_cache:
-                self._cache.delete_class_data(test_object)
+        test_objects = select_test_objects(scan, class_objects)
+        nontest_objects = [obj for obj in class_objects if obj not in test_objects]
 
         self._log.inf("Extracting names of test classes")
-        self._unit_tests_to_run = extract_class_names(test_objects, self._args.source_dir)
+        self._unit_tests_to_run = select_class_names(scan, test_objects)
 
         self._log.inf("Extracting names of non-test classes")
-        changed_nontest_classes = extract_class_names(nontest_objects, self._args.source_dir)
+        changed_nontest_classes = select_class_names(scan, nontest_objects)
 
         self._log.inf("Searching for all objects containing Apex classes")
-        all_test_objects = find_test_objects(self._args.source_dir)
+        all_test_objects = select_active_test_objects(all_classes)
+        if self._args.transitive:
+            # Non-test classes are compiled as well to build full class dependency graph
+            dependency_objects = select_active_objects(all_classes)
+        else:
+            dependency_objects = all_test_objects
+        # Tests selected from the package run anyway, their dependencies are not needed
+        dependency_objects = [obj for obj in dependency_objects if obj not in test_objects]
+        class_hashes = dict()
+        for obj in dependency_objects:
+            class_hashes[obj] = all_classes[obj]['Hash']
 
-        test_class_dependencies, class_dependencies = find_test_class_dependencies(
-            self._log, self._session, all_test_objects, self._args.source_dir, self._args.use_cache, self._cache.data)
+        with self._metrics.phase('dependencies'):
+            if self._args.dependency_mode == 'local':
+                test_class_dependencies = find_local_class_dependencies(
+                    self._log, dependency_objects, class_source, all_classes)
+                class_dependencies = reverse_class_dependencies(test_class_dependencies)
+            else:
+                compile_poller = self._create_poller()
+                test_class_dependencies, class_dependencies = find_test_class_dependencies(
+                    self._log, self._session, dependency_objects, class_source, self._args.use_cache,
+                    self._cache,
+                    class_hashes,
+                    max_workers=self._args.api_workers,
+                    batch_size=self._args.member_batch_size,
+                    container_size=self._args.container_size,
+                    retries=self._args.container_retries,
+                    poller=compile_poller,
+                    metrics=self._metrics,
+                    connect=self._connect_to_salesforce)
+                self._log.inf("  Checked compilation status %s time(s), waited %.1f s" % (
+                    compile_poller.poll_count, compile_poller.time_waited))
+                self._metrics.count('compile_polls', compile_poller.poll_count)
+
+                # Save class_dependencies which are not cached yet, entries read before another process
+                # changed the cache are read again
+                self._cache.refresh()
+                changed_class_data = dict()
+                for class_name, data in test_class_dependencies.items():
+                    if self._cache.get_class_data(class_name) != data:
+                        changed_class_data[class_name] = data
+                self._cache.add_classes_data(changed_class_data)
 
-        # Save class_dependencies to cache
-        for class_name, data in test_class_dependencies.items():
-            self._cache.add_class_data(class_name, data)
+                unresolved = select_unresolved_classes(test_class_dependencies)
+                if len(unresolved) > 0:
+                    self._log.inf("  %s class(es) are missing from the org or have no symbol table, "
+                                  "using references found in local source" % len(unresolved))
+                    test_class_dependencies.update(
+                        find_local_class_dependencies(self._log, unresolved, class_source, all_classes))
+                    class_dependencies = reverse_class_dependencies(test_class_dependencies)
+
+            if self._args.transitive:
+                self._log.inf("Building transitive class dependency index")
+                class_dependencies = build_reverse_index(
+                    test_class_dependencies, all_test_objects, self._args.max_depth, self._args.max_fanout)
 
         # Find test classes that need to be executed based on non-test classes dependencies
         for class_name in changed_nontest_classes:
             if class_name in class_dependencies:
                 for dependant in class_dependencies[class_name]:
-                    self._unit_tests_to_run.append(dependant)
+                    if dependant not in self._unit_tests_to_run:
+                        self._unit_tests_to_run.append(dependant)
+
+        with self._metrics.phase('metadata_references'):
+            self._add_tests_touching_metadata(
+                all_classes, triggers, all_test_objects, changed_nontest_classes, class_dependencies)
 
         self._log.inf("Unit tests to be executed")
         for class_name in self._unit_tests_to_run:
             self._log.inf("  %s" % class_name)
 
+    def _add_tests_touching_metadata(self, scan, triggers, test_objects, changed_classes, class_dependencies):
+        """ Adds tests touching changed triggers, objects, fields and flows and sObjects of triggers calling
+        changed classes, directly or through classes they depend on """
+        package = self._deploy_package if self._args.tests_from_minimized else self._package
+        references = find_component_references(package, triggers)
+        references.update(find_trigger_references(triggers, changed_classes))
+        if len(references) == 0:
+            return
+        self._log.inf("Looking for tests touching %s changed trigger(s), object(s), field(s) or flow(s)" %
+                      len(references))
+        for test_class, components in sorted(select_tests_touching(
+                references, scan, test_objects, class_dependencies).items()):
+            if test_class not in self._unit_tests_to_run:
+                self._log.inf("  %s touches %s" % (test_class, ', '.join(components)))
+                self._unit_tests_to_run.append(test_class)
+
     def run(self):
         """ Gets called by Metamate """
-        self._cache = MetamateCache(self._args.username)
-        if self._args.use_cache:
-            self._cache.load()
+        succeeded = False
+        try:
+            succeeded = self._run()
+            return succeeded
+        finally:
+            self._write_reports(succeeded)
 
-        self._connect_to_salesforce()
+    def _write_reports(self, succeeded):
+        if not self._args.report and not self._args.prometheus_file:
+            return
+        details = {
+            'Username': self._args.username,
+            'Succeeded': succeeded,
+            'DeploymentId': self._deployment_id,
+            'DeploymentState': self._deployment_state,
+            'TestLevel': self._test_level,
+            'Tests': len(self.unit_tests_to_run)
+        }
+        if self._args.report:
+            self._metrics.write_json(self._args.report, **details)
+            self._log.inf("Run report written to %s" % self._args.report)
+        if self._args.prometheus_file:
+            self._metrics.write_prometheus(self._args.prometheus_file, {'username': self._args.username}, **details)
+
+    def _read_package(self):
+        self._cache = MetamateCache(self._args.username, self._args.cache_backend)
+        self._cache.load()
+
+        self._log.inf("Reading deployment ZIP file")
+        with self._metrics.phase('read_package'):
+            if self._shared:
+                self._package = self._shared.package(self._args.deploy_zip, self._args.source_dir)
+            else:
+                self._package = DeployPackage(self._args.deploy_zip, self._args.source_dir)
+        self._deploy_package = self._package
+
+    def _run(self):
+        self._read_package()
+        if self._args.minimize:
+            with self._metrics.phase('minimize'):
+                self._minimize_package()
+            if not self._has_changes():
+                self._log.inf("Deployment package does not contain changed components, nothing to deploy")
+                return True
+
+        self._prepare_session()
+        if self._args.quick_deploy and not self._check_only:
+            self._connect_to_salesforce()
+            succeeded = self._quick_deploy()
+            if succeeded is not None:
+                return self._finish_run() if succeeded else False
 
         if self._test_level == 'RunSpecifiedTests':
             self._find_unit_tests_to_run()
@@ -149,24 +509,139 @@ class DeployCommand(AbstractCommand):
                 self._log.inf("Could not find any tests to run, downgrading test level to NoTestRun")
                 self._test_level = 'NoTestRun'
 
-        self._mapi = SfdcMetadataApi(self._session)
+        # Test classes found in local cache are selected without logging in
+        self._connect_to_salesforce()
+        shards = [self._unit_tests_to_run]
+        if self._test_level == 'RunSpecifiedTests' and self._args.shards > 1:
+            shards = self._split_unit_tests_into_shards()
+        succeeded = True
+        for i, tests in enumerate(shards):
+            if len(shards) > 1:
+                self._log.inf("Running shard %s of %s" % (i + 1, len(shards)))
+            succeeded = self._deploy(tests) and succeeded
+            if not succeeded and self._args.fail_fast and i + 1 < len(shards):
+                self._log.err("Skipping remaining shards because of --fail-fast")
+                break
+        if not succeeded:
+            return False
+
+        # Validation which ran all selected tests can be deployed without running them again
+        if self._check_only and self._test_level != 'NoTestRun' and self._args.shards == 1:
+            self._record_validation()
+        return self._finish_run()
+
+    def _finish_run(self):
+        if self._args.use_cache:
+            self._record_last_run_commit()
+        if not self._check_only:
+            # Deployment invalidates all recent validations
+            self._cache.save_json(self.VALIDATIONS_FILE_NAME, dict())
+            if self._args.minimize:
+                self._record_deployed_hashes()
+        return True
+
+    def _record_validation(self):
+        def update(validations):
+            validations[self._deploy_package.hash] = {
+                'Id': self._deployment_id,
+                'Recorded': time.time(),
+                'TestLevel': self._test_level
+            }
+            return validations
+        self._cache.update_json(self.VALIDATIONS_FILE_NAME, update, dict())
+        self._log.inf("  Validation %s can be quick deployed" % self._deployment_id)
+
+    def _quick_deploy(self):
+        """ Deploys recent validation of the same package
+        Returns None if there is no such validation and package has to be deployed normally """
+        validation = self._cache.load_json(self.VALIDATIONS_FILE_NAME, dict()).get(self._deploy_package.hash)
+        if validation is None:
+            self._log.inf("Package has not been validated recently, deploying it normally")
+            return None
+        age = (time.time() - validation['Recorded']) / 3600
+        if age > self._args.quick_deploy_max_age:
+            self._log.inf("Validation %s is %.1f hours old, deploying package normally" % (validation['Id'], age))
+            return None
+        if validation.get('TestLevel') != self._test_level:
+            self._log.inf("Validation %s ran tests at level %s instead of %s, deploying package normally" % (
+                validation['Id'], validation.get('TestLevel'), self._test_level))
+            return None
 
-        self._log.inf("Deploying ZIP file. Test level: %s" % self._test_level)
+        self._log.inf("Quick deploying validation %s" % validation['Id'])
+        try:
+            with self._metrics.phase('deploy_submit'):
+                self._deployment_id = self._mapi.deploy_recent_validation(validation['Id'])
+        except Exception as ex:
+            self._log.wrn("%s, deploying package normally" % ex)
+            return None
+        self._log.inf("  Deployment id: %s" % self._deployment_id)
+        self._deployment_state = 'Queued'
+        self._wait_for_deployment_to_finish()
+        return self._check_deployment_result()
+
+    def _split_unit_tests_into_shards(self):
+        """ Returns tests of each shard to be run by this process """
+        def load():
+            return merge_test_runtimes(self._cache.load_json_from_all_orgs(TEST_RUNTIMES_FILE_NAME))
+
+        shards = None
+        key = shard_plan_key(self._unit_tests_to_run, self._args.shards)
+        if self._args.shard_index is not None:
+            # Run times change as soon as any shard finishes, shards started later reuse the recorded split
+            shards = find_shard_plan(self._cache.load_json_from_all_orgs(SHARD_PLANS_FILE_NAME), key)
+            if shards is not None:
+                self._log.inf("Reusing split of the same tests recorded by previous shard")
+        if shards is None:
+            # Targets of a batch share one snapshot of run times to select the same shards
+            runtimes = self._shared.test_runtimes(load) if self._shared else load()
+            shards = split_into_shards(self._unit_tests_to_run, runtimes, self._args.shards)
+            if self._args.shard_index is not None:
+                self._cache.update_json(
+                    SHARD_PLANS_FILE_NAME, lambda plans: record_shard_plan(plans, key, shards), dict())
+        self._log.inf("Split %s test class(es) into %s shards" % (len(self._unit_tests_to_run), len(shards)))
+        for i, shard in enumerate(shards):
+            self._log.inf("  Shard %s: %s test class(es), expected run time %.1f s" % (
+                i + 1, len(shard['Tests']), shard['Time'] / 1000))
+        if self._args.shard_index is not None:
+            return [shards[self._args.shard_index - 1]['Tests']]
+        return [shard['Tests'] for shard in shards]
+
+    def _record_test_runtimes(self):
+        class_times = self._mapi.get_test_class_times()
+        if len(class_times) == 0:
+            return
+        self._cache.update_json(
+            TEST_RUNTIMES_FILE_NAME, lambda runtimes: update_test_runtimes(runtimes, class_times), dict())
+
+    def _deploy(self, tests):
+        """ Deploys package running specified tests, returns True if deployment succeeded """
+        test_level = self._test_level
+        if test_level == 'RunSpecifiedTests' and len(tests) == 0:
+            self._log.inf("Shard does not contain any tests, skipping deployment")
+            return True
+
+        self._log.inf("Deploying ZIP file. Test level: %s" % test_level)
         deploy_kwargs = {
-            'zipfile': self._args.deploy_zip,
+            'zipfile': self._deploy_package.open(),
             'options': {
                 'checkonly': self._check_only,
-                'testlevel': self._test_level,
+                'testlevel': test_level,
             }
         }
-        if self._test_level == 'RunSpecifiedTests':
-            deploy_kwargs['options']['tests'] = self._unit_tests_to_run
+        if test_level == 'RunSpecifiedTests':
+            deploy_kwargs['options']['tests'] = tests
 
-        self._deployment_id, self._deployment_state = self._mapi.deploy(**deploy_kwargs)
+        with self._metrics.phase('deploy_submit'):
+            self._deployment_id, self._deployment_state = self._mapi.deploy(**deploy_kwargs)
+        self._cancel_requested = False
         self._log.inf("  Deployment id: %s" % self._deployment_id)
 
         self._wait_for_deployment_to_finish()
+        self._record_test_runtimes()
+        return self._check_deployment_result()
 
+    def _check_deployment_result(self):
+        """ Logs result of finished deployment, returns True if deployment succeeded """
         if self._deployment_state == 'Failed':
             self._log_unit_test_errors()
             self._log_deployment_errors()
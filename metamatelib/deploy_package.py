@@ -0,0 +1,95 @@
+""" Deployment package (ZIP file) """
+import hashlib
+import posixpath
+from io import BytesIO
+from zipfile import ZipFile
+
+from metamatelib.dependency_finder import read_class_body
+from metamatelib.test_extractor import \
+    parse_package_members, \
+    scan_class_source
+
+
+class DeployPackage:
+    """ Deployment package which is read from disk only once
+    package.xml is parsed incrementally and class bodies are read straight from the ZIP file,
+    classes missing from the package are read from source directory if it is given """
+    def __init__(self, zip_path, source_dir=None):
+        with open(zip_path, 'rb') as file:
+            self._data = file.read()
+        self._source_dir = source_dir
+        self._zip = ZipFile(BytesIO(self._data))
+        self._names = set(self._zip.namelist())
+        package_xml_path = self._find_package_xml()
+        self._root_dir = posixpath.dirname(package_xml_path)
+        with self._zip.open(package_xml_path) as package_xml:
+            self.members = parse_package_members(package_xml)
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def hash(self):
+        """ SHA-1 of the ZIP file """
+        return hashlib.sha1(self._data).hexdigest()
+
+    def open(self):
+        """ Returns file object with ZIP file contents which can be passed to SfdcMetadataApi.deploy """
+        return BytesIO(self._data)
+
+    def _find_package_xml(self):
+        candidates = [name for name in self._names if posixpath.basename(name) == 'package.xml']
+        if len(candidates) == 0:
+            raise Exception("Deployment package does not contain package.xml")
+        return min(candidates, key=lambda name: name.count('/'))
+
+    def _path(self, file_path):
+        return posixpath.join(self._root_dir, file_path) if self._root_dir else file_path
+
+    def has_file(self, file_path):
+        """ Checks whether file (path relative to package.xml) is in the package """
+        return self._path(file_path) in self._names
+
+    def file_names(self):
+        """ Returns paths (relative to package.xml) of all files in the package """
+        prefix = self._path('')
+        return sorted(name[len(prefix):] for name in self._names
+                      if name.startswith(prefix) and not name.endswith('/'))
+
+    def read_bytes(self, file_path):
+        """ Reads contents of file (path relative to package.xml) from the package """
+        return self._zip.read(self._path(file_path))
+
+    def read_file(self, file_path):
+        """ Reads file (path relative to package.xml) from the package, returns None if there is no such file """
+        if not self.has_file(file_path):
+            return None
+        return self.read_bytes(file_path).decode('utf-8')
+
+    def class_objects(self):
+        """ Returns names of objects containing classes listed in package.xml """
+        objects = self.members.get('ApexClass', list())
+        if '*' in objects:
+            prefix = self._path('classes/')
+            objects = sorted(name[len(prefix):-4] for name in self._names
+                             if name.startswith(prefix) and name.endswith('.cls'))
+        return objects
+
+    def read_class_body(self, class_name):
+        """ Reads class body from the package or from source directory if the package does not contain it """
+        body = self.read_file("classes/%s.cls" % class_name)
+        if body is None:
+            if self._source_dir is None:
+                raise Exception("Deployment package does not contain class %s" % class_name)
+            body = read_class_body(self._source_dir, class_name)
+        return body
+
+    def scan_classes(self):
+        """ Scans classes contained in the package, returns dictionary in scan_classes format """
+        scan = dict()
+        for obj in self.class_objects():
+            body = self.read_file("classes/%s.cls" % obj)
+            if body is not None:
+                scan[obj] = scan_class_source(body, self.read_file("classes/%s.cls-meta.xml" % obj))
+        return scan
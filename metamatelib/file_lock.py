@@ -0,0 +1,73 @@
+""" Cross-process file locks and atomic file writes used by local cache """
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class FileLock:
+    """ Readers/writer lock held on a lock file so that it is respected by other processes
+    Any number of shared holders are allowed at once, exclusive holder waits for all of them.
+    Each acquisition opens the lock file again, so threads of one process are serialized the same way.
+    Locks are not reentrant. On Windows every lock is exclusive. """
+    WINDOWS_RETRY_INTERVAL = 0.05
+
+    def __init__(self, path):
+        self._path = path
+
+    @contextmanager
+    def shared(self):
+        with self._acquire(exclusive=False):
+            yield
+
+    @contextmanager
+    def exclusive(self):
+        with self._acquire(exclusive=True):
+            yield
+
+    @contextmanager
+    def _acquire(self, exclusive):
+        file = open(self._path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            elif msvcrt is not None:
+                file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(self.WINDOWS_RETRY_INTERVAL)
+            yield
+        finally:
+            # Lock is released when the file is closed
+            file.close()
+
+
+def write_file_atomically(path, content):
+    """ Writes text or bytes next to destination file and renames it, readers never see partially written file """
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp', dir=directory or '.')
+    try:
+        if isinstance(content, bytes):
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,50 @@
+""" Finds classes changed since a git revision """
+import subprocess
+
+CLASSES_DIR_NAME = "classes"
+
+
+def run_git(source_dir, *args, **kwargs):
+    return subprocess.check_output(['git', '-C', source_dir] + list(args), universal_newlines=True, **kwargs)
+
+
+def get_head_commit(source_dir):
+    """ Returns commit checked out in source directory or None if it is not a git repository """
+    try:
+        return run_git(source_dir, 'rev-parse', 'HEAD', stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def class_object_name(file_path):
+    """ Returns name of object for a path relative to source directory or None if it is not a class file """
+    parts = file_path.split('/')
+    if len(parts) != 2 or parts[0] != CLASSES_DIR_NAME:
+        return None
+    for suffix in ['.cls', '.cls-meta.xml']:
+        if parts[1].endswith(suffix):
+            return parts[1][:-len(suffix)]
+    return None
+
+
+def find_changed_class_objects(source_dir, base):
+    """ Compares working tree of source directory with base revision
+    Returns lists of changed (added or modified) and deleted objects containing classes """
+    changed = set()
+    deleted = set()
+    diff = run_git(source_dir, 'diff', '--name-status', '--no-renames', '--relative', base, '--', CLASSES_DIR_NAME)
+    for line in diff.splitlines():
+        status, file_path = line.split('\t', 1)
+        obj = class_object_name(file_path)
+        if obj is None:
+            continue
+        if status == 'D' and file_path.endswith('.cls'):
+            deleted.add(obj)
+        else:
+            changed.add(obj)
+    untracked = run_git(source_dir, 'ls-files', '--others', '--exclude-standard', '--', CLASSES_DIR_NAME)
+    for file_path in untracked.splitlines():
+        obj = class_object_name(file_path)
+        if obj is not None:
+            changed.add(obj)
+    return sorted(changed - deleted), sorted(deleted)
@@ -0,0 +1,52 @@
+""" JUnit XML report of deployment test results and component failures, understood by CI servers """
+from xml.etree import ElementTree as ET
+
+from metamatelib.file_lock import write_file_atomically
+
+COMPONENT_SUITE_NAME = 'Deployment'
+
+
+def _add_suite(root, name, cases):
+    """ cases is list of tuples (case name, class name, time in milliseconds, failure message, details) """
+    suite = ET.SubElement(root, 'testsuite', {
+        'name': name,
+        'tests': str(len(cases)),
+        'failures': str(sum(1 for case in cases if case[3] is not None)),
+        'errors': '0',
+        'time': "%.3f" % (sum(case[2] for case in cases) / 1000)
+    })
+    for case_name, class_name, time, message, details in cases:
+        case = ET.SubElement(suite, 'testcase', {
+            'name': case_name or '',
+            'classname': class_name or '',
+            'time': "%.3f" % (time / 1000)
+        })
+        if message is not None:
+            failure = ET.SubElement(case, 'failure', {'message': message})
+            failure.text = details or message
+
+
+def build_junit_xml(test_results, component_failures):
+    """ Returns JUnit XML document with test suite per test class and one suite for components which failed to
+    deploy. Takes MetadataApi.get_test_results and get_component_failures results """
+    root = ET.Element('testsuites')
+    suites = dict()
+    for result in test_results:
+        message = (result['message'] or 'Test failed') if result['failed'] else None
+        suites.setdefault(result['class'], list()).append(
+            (result['method'], result['class'], result['time'], message, result['stack_trace']))
+    for class_name in sorted(suites, key=lambda name: name or ''):
+        _add_suite(root, class_name or '', sorted(suites[class_name], key=lambda case: case[0] or ''))
+    if len(component_failures) > 0:
+        _add_suite(root, COMPONENT_SUITE_NAME, [
+            (failure['file'], failure['type'], 0.0, failure['message'] or failure['status'],
+             "%s: %s" % (failure['status'], failure['message'])) for failure in component_failures])
+    root.set('tests', str(sum(int(suite.get('tests')) for suite in root)))
+    root.set('failures', str(sum(int(suite.get('failures')) for suite in root)))
+    return ET.tostring(root, encoding='unicode')
+
+
+def write_junit_report(path, test_results, component_failures):
+    """ Replaces report atomically so that CI server never reads partially written file """
+    write_file_atomically(path, '<?xml version="1.0" encoding="UTF-8"?>\n%s\n' % build_junit_xml(
+        test_results, component_failures))
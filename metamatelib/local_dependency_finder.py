@@ -0,0 +1,86 @@
+""" Offline class dependency finder which tokenizes Apex source instead of compiling it in Salesforce """
+import re
+
+from metamatelib.dependency_finder import read_class_body
+
+COMMENT_AND_STRING_REG_OBJ = re.compile(r"//[^\n]*|/\*.*?\*/|'(?:\\.|[^'\\\n])*'", re.DOTALL | re.UNICODE)
+IDENTIFIER_REG_OBJ = re.compile(r'[A-Za-z_][A-Za-z0-9_]*', re.UNICODE)
+LOCAL_API_VERSION = 'local'
+
+
+def strip_comments_and_strings(body):
+    """ Replaces comments and string literals with spaces """
+    return COMMENT_AND_STRING_REG_OBJ.sub(' ', body)
+
+
+def extract_identifiers(body):
+    """ Returns set of lower case identifiers used in Apex source, Apex identifiers are case insensitive """
+    return set(identifier.lower() for identifier in IDENTIFIER_REG_OBJ.findall(strip_comments_and_strings(body)))
+
+
+def build_class_name_index(scan):
+    """ Maps lower case names of all classes declared in scanned objects (including inner classes)
+    to names of objects declaring them """
+    index = dict()
+    for obj, result in scan.items():
+        for class_name in result['ClassNames']:
+            index.setdefault(class_name.lower(), obj)
+        index[obj.lower()] = obj
+    return index
+
+
+def extract_local_references(body, obj, class_name_index):
+    """ Returns sorted names of local objects referenced in class body """
+    refs = set()
+    for identifier in extract_identifiers(body):
+        ref = class_name_index.get(identifier)
+        if ref is not None and ref != obj:
+            refs.add(ref)
+    return sorted(refs)
+
+
+def find_local_class_dependencies(log, classes, source_dir, scan):
+    """ Finds class dependencies by resolving identifiers used in local source against names of
+    local classes, produces dictionary in the same format as retrieve_class_dependencies """
+    log.inf("===> Extracting references from %s Apex classes" % len(classes))
+    class_name_index = build_class_name_index(scan)
+    dependencies = dict()
+    for obj in classes:
+        dependencies[obj] = {
+            'Id': None,
+            'References': extract_local_references(read_class_body(source_dir, obj), obj, class_name_index),
+            'Hash': scan[obj]['Hash'],
+            'ApiVersion': LOCAL_API_VERSION
+        }
+    return dependencies
+
+
+def compare_dependencies(reference, candidate, known_classes):
+    """ Compares dependencies found locally (candidate) with ones retrieved using Tooling API (reference)
+    Only references to known local classes are compared. Returns dictionary in format
+    {
+        'Classes': {'class_name_1': {'Missing': ['class_name_2'], 'Extra': ['class_name_3']}},
+        'Matched': 10,
+        'Missing': 1,
+        'Extra': 1,
+        'Precision': 0.909,
+        'Recall': 0.909
+    } """
+    known_classes = set(known_classes)
+    report = {'Classes': dict(), 'Matched': 0, 'Missing': 0, 'Extra': 0}
+    for class_name in sorted(set(reference.keys()) & set(candidate.keys())):
+        expected = set(reference[class_name]['References']) & known_classes
+        expected.discard(class_name)
+        found = set(candidate[class_name]['References'])
+        missing = sorted(expected - found)
+        extra = sorted(found - expected)
+        report['Matched'] += len(expected & found)
+        report['Missing'] += len(missing)
+        report['Extra'] += len(extra)
+        if missing or extra:
+            report['Classes'][class_name] = {'Missing': missing, 'Extra': extra}
+    found_count = report['Matched'] + report['Extra']
+    expected_count = report['Matched'] + report['Missing']
+    report['Precision'] = report['Matched'] / found_count if found_count else 1.0
+    report['Recall'] = report['Matched'] / expected_count if expected_count else 1.0
+    return report
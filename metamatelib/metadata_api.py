@@ -0,0 +1,144 @@
+""" Metadata API client extending sfdclib with calls Metamate needs """
+from xml.etree import ElementTree as ET
+
+from sfdclib import SfdcMetadataApi
+
+DEPLOY_RECENT_VALIDATION_MSG = """<soapenv:Envelope
+xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+xmlns:met="http://soap.sforce.com/2006/04/metadata">
+   <soapenv:Header>
+      <met:CallOptions>
+         <met:client>{client}</met:client>
+      </met:CallOptions>
+      <met:SessionHeader>
+         <met:sessionId>{sessionId}</met:sessionId>
+      </met:SessionHeader>
+   </soapenv:Header>
+   <soapenv:Body>
+      <met:deployRecentValidation>
+         <met:validationId>{validationId}</met:validationId>
+      </met:deployRecentValidation>
+   </soapenv:Body>
+</soapenv:Envelope>"""
+
+CANCEL_DEPLOY_MSG = """<soapenv:Envelope
+xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+xmlns:met="http://soap.sforce.com/2006/04/metadata">
+   <soapenv:Header>
+      <met:CallOptions>
+         <met:client>{client}</met:client>
+      </met:CallOptions>
+      <met:SessionHeader>
+         <met:sessionId>{sessionId}</met:sessionId>
+      </met:SessionHeader>
+   </soapenv:Header>
+   <soapenv:Body>
+      <met:cancelDeploy>
+         <met:String>{asyncProcessId}</met:String>
+      </met:cancelDeploy>
+   </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class MetadataApi(SfdcMetadataApi):
+    """ Keeps result of the last checkDeployStatus call so that details not returned by
+    check_deploy_status (i.e. test run times, failures of deployment in progress) can be extracted from it,
+    supports quick deploy and cancellation """
+    def __init__(self, session):
+        super().__init__(session)
+        self.last_deploy_result = None
+
+    def _retrieve_deploy_result(self, async_process_id):
+        self.last_deploy_result = super()._retrieve_deploy_result(async_process_id)
+        return self.last_deploy_result
+
+    def get_test_class_times(self):
+        """ Sums run times (in milliseconds) of test methods executed by the last checked deployment
+        Returns dictionary in format {'test_class_name_1': 1520.0} """
+        times = dict()
+        if self.last_deploy_result is None:
+            return times
+        for tag in ('successes', 'failures'):
+            for test in self.last_deploy_result.findall(
+                    'mt:details/mt:runTestResult/mt:%s' % tag, self._XML_NAMESPACES):
+                name = test.find('mt:name', self._XML_NAMESPACES)
+                time = test.find('mt:time', self._XML_NAMESPACES)
+                if name is None or time is None or not time.text:
+                    continue
+                times[name.text] = times.get(name.text, 0.0) + float(time.text)
+        return times
+
+    def _find_text(self, node, tag):
+        child = node.find('mt:%s' % tag, self._XML_NAMESPACES)
+        return None if child is None else child.text
+
+    def get_test_results(self):
+        """ Returns results of test methods reported by the last checked deployment so far in format
+        [{'class': 'test_class_name_1', 'method': 'test_method_1', 'time': 152.0, 'message': None,
+          'stack_trace': None, 'failed': False}] """
+        results = list()
+        if self.last_deploy_result is None:
+            return results
+        for tag in ('successes', 'failures'):
+            for test in self.last_deploy_result.findall(
+                    'mt:details/mt:runTestResult/mt:%s' % tag, self._XML_NAMESPACES):
+                time = self._find_text(test, 'time')
+                results.append({
+                    'class': self._find_text(test, 'name'),
+                    'method': self._find_text(test, 'methodName'),
+                    'time': float(time) if time else 0.0,
+                    'message': self._find_text(test, 'message'),
+                    'stack_trace': self._find_text(test, 'stackTrace'),
+                    'failed': tag == 'failures'
+                })
+        return results
+
+    def get_component_failures(self):
+        """ Returns components which failed to deploy reported by the last checked deployment so far in the
+        same format as check_deploy_status """
+        failures = list()
+        if self.last_deploy_result is None:
+            return failures
+        for failure in self.last_deploy_result.findall('mt:details/mt:componentFailures', self._XML_NAMESPACES):
+            failures.append({
+                'type': self._find_text(failure, 'componentType'),
+                'file': self._find_text(failure, 'fileName'),
+                'status': self._find_text(failure, 'problemType'),
+                'message': self._find_text(failure, 'problem')
+            })
+        return failures
+
+    def cancel_deploy(self, async_process_id):
+        """ Requests cancellation of deployment, deployment reaches Canceled state asynchronously """
+        attributes = {
+            'client': 'Metahelper',
+            'sessionId': self._session.get_session_id(),
+            'asyncProcessId': async_process_id
+        }
+        request = CANCEL_DEPLOY_MSG.format(**attributes)
+        headers = {'Content-type': 'text/xml', 'SOAPAction': 'cancelDeploy'}
+        res = self._session.post(self._get_api_url(), headers=headers, data=request)
+        fault = ET.fromstring(res.text).find('soapenv:Body/soapenv:Fault/faultstring', self._XML_NAMESPACES)
+        if fault is not None:
+            raise Exception("Cancellation of deployment %s was rejected: %s" % (async_process_id, fault.text))
+        if res.status_code != 200:
+            raise Exception("Request failed with %d code and error [%s]" % (res.status_code, res.text))
+
+    def deploy_recent_validation(self, validation_id):
+        """ Deploys package validated by check-only deployment without running tests again (quick deploy)
+        Returns id of the new deployment """
+        attributes = {
+            'client': 'Metahelper',
+            'sessionId': self._session.get_session_id(),
+            'validationId': validation_id
+        }
+        request = DEPLOY_RECENT_VALIDATION_MSG.format(**attributes)
+        headers = {'Content-type': 'text/xml', 'SOAPAction': 'deployRecentValidation'}
+        res = self._session.post(self._get_api_url(), headers=headers, data=request)
+        root = ET.fromstring(res.text)
+        fault = root.find('soapenv:Body/soapenv:Fault/faultstring', self._XML_NAMESPACES)
+        if fault is not None:
+            raise Exception("Quick deploy of validation %s was rejected: %s" % (validation_id, fault.text))
+        if res.status_code != 200:
+            raise Exception("Request failed with %d code and error [%s]" % (res.status_code, res.text))
+        return root.find('soapenv:Body/mt:deployRecentValidationResponse/mt:result', self._XML_NAMESPACES).text
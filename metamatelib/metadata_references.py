@@ -0,0 +1,113 @@
+""" Finds tests touching changed metadata other than Apex classes (triggers, objects, fields, flows)
+Tests do not reference triggers and flows directly, they fire when test or a class it depends on inserts or updates
+records of their sObject, so each changed component is mapped to names such code would use when touching it """
+from xml.etree import ElementTree as ET
+
+from metamatelib.package_minimizer import \
+    CHILD_TYPES, \
+    expand_members
+from metamatelib.test_extractor import \
+    XML_NAMESPACES, \
+    scan_trigger_source
+
+
+def read_flow_sobject(flow_xml):
+    """ Returns sObject record-triggered flow starts on or None """
+    try:
+        root = ET.fromstring(flow_xml)
+    except ET.ParseError:
+        return None
+    sobject = root.find('mt:start/mt:object', XML_NAMESPACES)
+    return None if sobject is None else sobject.text
+
+
+def find_component_references(package, triggers=None):
+    """ Maps changed non-class components in package to lower case names used by tests touching them
+    triggers ({'trigger_name_1': scan_trigger_source() result}) are used for triggers missing from package
+    Names of standard fields are qualified by their sObject, code has to use both names to touch them
+    Returns dictionary in format {'ApexTrigger/AccountTrigger': ['account'], 'CustomField/Account.Code__c':
+    ['code__c'], 'CustomField/Contact.Email': ['contact.email']} """
+    triggers = triggers or dict()
+    file_names = package.file_names()
+    references = dict()
+    for metadata_type, members in package.members.items():
+        for member in expand_members(file_names, metadata_type, members):
+            names = set()
+            if metadata_type == 'ApexTrigger':
+                body = package.read_file("triggers/%s.trigger" % member)
+                trigger = scan_trigger_source(body) if body is not None else triggers.get(member)
+                if trigger is not None:
+                    names.add(trigger['SObject'])
+            elif metadata_type == 'CustomObject':
+                names.add(member)
+            elif metadata_type == 'CustomMetadata':
+                # Records are named <type>.<record>, Apex uses <type>__mdt
+                names.add("%s__mdt" % member.split('.')[0])
+            elif metadata_type == 'CustomField' and '.' in member:
+                sobject, field = member.split('.', 1)
+                # Names of standard fields (i.e. Name) are too common to select tests by them alone
+                names.add(field if field.endswith('__c') else "%s.%s" % (sobject, field))
+            elif CHILD_TYPES.get(metadata_type) == 'CustomObject':
+                # Validation rules, record types etc. apply to records of their object
+                names.add(member.split('.')[0])
+            elif metadata_type == 'Flow':
+                # Flows are started from Apex as Flow.Interview.<name>
+                names.add(member)
+                flow_xml = package.read_file("flows/%s.flow" % member)
+                sobject = None if flow_xml is None else read_flow_sobject(flow_xml)
+                if sobject is not None:
+                    names.add(sobject)
+            if len(names) > 0:
+                references["%s/%s" % (metadata_type, member)] = sorted(name.lower() for name in names)
+    return references
+
+
+def find_trigger_references(triggers, changed_classes):
+    """ Triggers calling changed classes run them whenever test touches trigger's sObject
+    Returns dictionary in format {'ApexTrigger/AccountTrigger': ['account']} """
+    changed = set(class_name.lower() for class_name in changed_classes)
+    references = dict()
+    for trigger_name, trigger in triggers.items():
+        if len(changed.intersection(trigger['Identifiers'])) > 0:
+            references["ApexTrigger/%s" % trigger_name] = [trigger['SObject'].lower()]
+    return references
+
+
+def select_touched_components(identifiers, components_by_name):
+    """ Returns components whose names are used in code with given identifiers, qualified name (sObject.field)
+    requires both of its parts """
+    touched = set()
+    for name, components in components_by_name.items():
+        if all(part in identifiers for part in name.split('.')):
+            touched.update(components)
+    return touched
+
+
+def select_tests_touching(references, scan, test_objects, class_dependencies):
+    """ Returns tests using any of the names in references (find_component_references format) or depending on
+    non-test classes which use them, together with components each of them touches
+    Names are matched against identifiers kept in scan (scan_classes format), tests depending on non-test classes
+    are looked up in class_dependencies (reverse_class_dependencies or build_reverse_index format)
+    Returns dictionary in format {'test_class_1': ['ApexTrigger/AccountTrigger']} """
+    components_by_name = dict()
+    for component, names in references.items():
+        for name in names:
+            components_by_name.setdefault(name, set()).add(component)
+    selected = dict()
+    if len(components_by_name) == 0:
+        return selected
+    test_objects = set(test_objects)
+    for obj, result in scan.items():
+        is_test = obj in test_objects
+        if not is_test and (result['IsTest'] or not result['IsActive']):
+            continue
+        touched = select_touched_components(set(result['Identifiers']), components_by_name)
+        if len(touched) == 0:
+            continue
+        if is_test:
+            selected.setdefault(obj, set()).update(touched)
+            continue
+        for class_name in result['ClassNames']:
+            for test_class in class_dependencies.get(class_name, list()):
+                selected.setdefault(test_class, set()).update(touched)
+    return dict((test_class, sorted(components)) for test_class, components in selected.items())
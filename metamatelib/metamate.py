@@ -4,11 +4,89 @@
 import argparse
 import sys
 
+from metamatelib.batch import BatchCommand
+from metamatelib.cache_command import CacheCommand
+from metamatelib.compare_dependencies import CompareDependenciesCommand
 from metamatelib.deploy import DeployCommand
 from metamatelib.metamatecache import MetamateCache
+from metamatelib.select_tests import SelectTestsCommand
 from sfdclib import SfdcLogger
 
 
+def add_connection_arguments(parser, password_required=True, password_help='password'):
+    """ Declares switches used to connect to Salesforce """
+    parser.add_argument('--sandbox', action='store_true',
+                        help='use this switch when connecting deploying to a sandbox')
+    parser.add_argument('-u', '--username', type=str, required=True,
+                        help='Salesforce user name')
+    parser.add_argument('-p', '--password', type=str, required=password_required,
+                        help=password_help)
+    parser.add_argument('-t', '--token', type=str,
+                        help='security token')
+    parser.add_argument('--reuse-session', action='store_true',
+                        help='keep session in local cache encrypted with password and reuse it until it '
+                             'expires (requires cryptography package)')
+    parser.add_argument('-v', '--version', type=str,
+                        help='API version (i.e. 32.0, 33.0, etc)')
+
+
+def add_test_selection_arguments(parser):
+    """ Declares switches used to read deployment package and select tests """
+    parser.add_argument('-d', '--deploy-zip', type=str, required=True,
+                        help='path to deployment package')
+    parser.add_argument('-s', '--source-dir', type=str,
+                        help='path to directory containing metadata (classes which are not in deployment '
+                             'ZIP are read from here, required by --git-base and --since-last-run)')
+    parser.add_argument('-uc', '--use-cache', action='store_true',
+                        help='use local cache to store symbol tables')
+    parser.add_argument('--cache-backend', type=str, default='sqlite',
+                        choices=['sqlite', 'yaml'],
+                        help='local cache storage: sqlite (single file per org) or yaml (file per class)')
+    parser.add_argument('--scan-workers', type=int,
+                        help='number of threads used to scan source directory (1 disables threading)')
+    parser.add_argument('--api-workers', type=int, default=1,
+                        help='maximum number of concurrent Tooling API requests')
+    parser.add_argument('--member-batch-size', type=int, default=200,
+                        help='number of classes added to metadata container per Tooling API request '
+                             '(up to 200, requires API v42.0 or later)')
+    parser.add_argument('--container-size', type=int,
+                        help='maximum number of classes compiled in one metadata container '
+                             '(all classes are compiled in one container by default)')
+    parser.add_argument('--container-retries', type=int, default=1,
+                        help='number of times compilation of a metadata container is retried')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='seconds to wait before first deployment or compilation status check')
+    parser.add_argument('--poll-max-interval', type=float, default=30.0,
+                        help='maximum number of seconds between status checks')
+    parser.add_argument('--timeout', type=float,
+                        help='maximum number of seconds to wait for deployment or compilation to finish')
+    parser.add_argument('--transitive', action='store_true',
+                        help='compile non-test classes as well and select tests which depend on '
+                             'changed classes indirectly')
+    parser.add_argument('--max-depth', type=int,
+                        help='maximum length of dependency chain between changed class and selected test '
+                             '(requires --transitive)')
+    parser.add_argument('--max-fanout', type=int,
+                        help='do not follow dependencies through classes used by more than this number '
+                             'of classes (requires --transitive)')
+    parser.add_argument('--dependency-mode', type=str, default='tooling',
+                        choices=['tooling', 'local'],
+                        help='find class dependencies by compiling classes using Tooling API (tooling) '
+                             'or by parsing local source (local)')
+    parser.add_argument('--git-base', type=str,
+                        help='select tests for classes changed in source directory since this git revision '
+                             'instead of classes in deployment ZIP (requires --use-cache)')
+    parser.add_argument('--since-last-run', action='store_true',
+                        help='select tests for classes changed in source directory since last successful '
+                             'run (requires --use-cache)')
+    parser.add_argument('--report', type=str,
+                        help='path to JSON file to write time spent in each phase, API calls, '
+                             'transferred bytes and cache statistics to')
+    parser.add_argument('--prometheus-file', type=str,
+                        help='path to file to write the same metrics to in Prometheus text format '
+                             '(i.e. for node exporter textfile collector)')
+
+
 def parse_command_line_args(argv):
     """ Parses command line arguments """
     # Declare command line arguments and switches
@@ -23,29 +101,117 @@ def parse_command_line_args(argv):
 
     deploy_parser = subparsers.add_parser('deploy', help='Deploy deployment package')
     deploy_parser.set_defaults(which='deploy')
-    deploy_parser.add_argument('--sandbox', action='store_true',
-                               help='use this switch when connecting deploying to a sandbox')
-    deploy_parser.add_argument('-u', '--username', type=str, required=True,
-                               help='Salesforce user name')
-    deploy_parser.add_argument('-p', '--password', type=str, required=True,
-                               help='password')
-    deploy_parser.add_argument('-t', '--token', type=str,
-                               help='security token')
-    deploy_parser.add_argument('-d', '--deploy-zip', type=str, required=True,
-                               help='path to deployment package')
-    deploy_parser.add_argument('-s', '--source-dir', type=str, required=True,
-                               help='path to directory containing metadata')
+    add_connection_arguments(deploy_parser)
+    add_test_selection_arguments(deploy_parser)
     deploy_parser.add_argument('-c', '--check-only', action='store_true',
                                help='use this switch to validate deployment package')
-    deploy_parser.add_argument('-uc', '--use-cache', action='store_true',
-                               help='use local cache to store symbol tables')
+    deploy_parser.add_argument('--minimize', action='store_true',
+                               help='deploy only components which changed since last successful deployment '
+                                    'to this org')
+    deploy_parser.add_argument('--minimized-zip', type=str,
+                               help='path to write minimized deployment package to '
+                                    '(<deploy-zip>-minimized.zip by default)')
+    deploy_parser.add_argument('--tests-from-minimized', action='store_true',
+                               help='select tests for classes in minimized deployment package only '
+                                    '(requires --minimize)')
+    deploy_parser.add_argument('--shards', type=int, default=1,
+                               help='split selected tests into this number of shards with similar expected run '
+                                    'time and run each shard in a separate check-only deployment')
+    deploy_parser.add_argument('--shard-index', type=int,
+                               help='run only this shard (1 to --shards), other shards can be run against '
+                                    'other orgs')
+    deploy_parser.add_argument('--quick-deploy', action='store_true',
+                               help='deploy recent successful validation of the same package without running '
+                                    'tests again, package is deployed normally if there is no such validation')
+    deploy_parser.add_argument('--quick-deploy-max-age', type=float, default=240.0,
+                               help='maximum age of validation in hours which can be quick deployed '
+                                    '(240 by default)')
     deploy_parser.add_argument('-tl', '--test-level', type=str, default='NoTestRun',
                                choices=['NoTestRun', 'RunSpecifiedTests', 'RunLocalTests'],
                                help='test level: NoTestRun, RunSpecifiedTests, RunLocalTests')
-    deploy_parser.add_argument('-v', '--version', type=str,
-                               help='API version (i.e. 32.0, 33.0, etc)')
+    deploy_parser.add_argument('--junit-file', type=str,
+                               help='path to JUnit XML file with test results and component failures, '
+                                    'updated after each deployment status check')
+    deploy_parser.add_argument('--fail-fast', type=int,
+                               help='cancel deployment (and skip remaining shards) once this number of tests '
+                                    'or components failed')
+
+    select_parser = subparsers.add_parser(
+        'select-tests', help='Select tests for deployment package without deploying it')
+    select_parser.set_defaults(which='select-tests', check_only=True, test_level='RunSpecifiedTests',
+                               minimize=False, tests_from_minimized=False, shards=1, shard_index=None,
+                               quick_deploy=False)
+    add_connection_arguments(select_parser, password_required=False,
+                             password_help='password (required only when test classes are not cached)')
+    add_test_selection_arguments(select_parser)
+    select_parser.add_argument('-o', '--output', type=str,
+                               help='path to file to write names of selected test classes to, one per line')
+
+    batch_parser = subparsers.add_parser('batch', help='Deploy deployment packages to several orgs concurrently')
+    batch_parser.set_defaults(which='batch')
+    batch_parser.add_argument('-m', '--manifest', type=str, required=True,
+                              help='path to YAML or JSON file listing targets and their deploy options')
+    batch_parser.add_argument('-w', '--workers', type=int,
+                              help='maximum number of targets processed concurrently (all targets by default)')
 
-    return parser.parse_args(argv)
+    cache_parser = subparsers.add_parser('cache', help='Export local cache into a bundle or import it')
+    cache_parser.set_defaults(which='cache')
+    cache_subparsers = cache_parser.add_subparsers(title='cache commands', dest='cache_command')
+    cache_subparsers.required = True
+    cache_export_parser = cache_subparsers.add_parser('export', help='Export local cache of an org into a bundle')
+    cache_export_parser.add_argument('-o', '--output', type=str, required=True,
+                                     help='path to write compressed cache bundle to')
+    cache_import_parser = cache_subparsers.add_parser('import', help='Merge cache bundle into local cache')
+    cache_import_parser.add_argument('-i', '--input', type=str, required=True,
+                                     help='path to cache bundle written by cache export command')
+    for cache_subparser in [cache_export_parser, cache_import_parser]:
+        cache_subparser.add_argument('-u', '--username', type=str, required=True,
+                                     help='Salesforce user name')
+        cache_subparser.add_argument('-s', '--source-dir', type=str,
+                                     help='path to directory containing metadata, only symbol tables of classes '
+                                          'matching it are exported or imported')
+        cache_subparser.add_argument('--cache-backend', type=str, default='sqlite',
+                                     choices=['sqlite', 'yaml'],
+                                     help='local cache storage: sqlite (single file per org) or yaml '
+                                          '(file per class)')
+        cache_subparser.add_argument('--scan-workers', type=int,
+                                     help='number of threads used to scan source directory '
+                                          '(1 disables threading)')
+
+    compare_parser = subparsers.add_parser(
+        'compare-dependencies', help='Compare dependencies found in local source with cached symbol tables')
+    compare_parser.set_defaults(which='compare-dependencies')
+    compare_parser.add_argument('-u', '--username', type=str, required=True,
+                                help='Salesforce user name')
+    compare_parser.add_argument('-s', '--source-dir', type=str, required=True,
+                                help='path to directory containing metadata')
+    compare_parser.add_argument('--cache-backend', type=str, default='sqlite',
+                                choices=['sqlite', 'yaml'],
+                                help='local cache storage: sqlite (single file per org) or yaml (file per class)')
+    compare_parser.add_argument('--scan-workers', type=int,
+                                help='number of threads used to scan source directory (1 disables threading)')
+    compare_parser.add_argument('-o', '--output', type=str,
+                                help='path to JSON file to write comparison report to')
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'which', None) in ('deploy', 'select-tests') and (args.git_base or args.since_last_run) and \
+            not args.use_cache:
+        parser.error('--git-base and --since-last-run require --use-cache')
+    if getattr(args, 'which', None) in ('deploy', 'select-tests') and (args.git_base or args.since_last_run) and \
+            not args.source_dir:
+        parser.error('--git-base and --since-last-run require --source-dir')
+    if getattr(args, 'which', None) == 'deploy' and args.tests_from_minimized and not args.minimize:
+        parser.error('--tests-from-minimized requires --minimize')
+    if getattr(args, 'which', None) == 'deploy' and args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if getattr(args, 'which', None) == 'deploy' and args.shards > 1 and not args.check_only:
+        parser.error('--shards requires --check-only')
+    if getattr(args, 'which', None) == 'deploy' and args.fail_fast is not None and args.fail_fast < 1:
+        parser.error('--fail-fast must be at least 1')
+    if getattr(args, 'which', None) == 'deploy' and args.shard_index is not None and \
+            not 1 <= args.shard_index <= args.shards:
+        parser.error('--shard-index must be between 1 and --shards')
+    return args
 
 
 def main(argv):
@@ -57,6 +223,18 @@ def main(argv):
     if args.command.lower() == 'deploy':
         cmd = DeployCommand(args, log)
         ret = cmd.run()
+    elif args.command.lower() == 'select-tests':
+        cmd = SelectTestsCommand(args, log)
+        ret = cmd.run()
+    elif args.command.lower() == 'batch':
+        cmd = BatchCommand(args, log, parse_command_line_args)
+        ret = cmd.run()
+    elif args.command.lower() == 'cache':
+        cmd = CacheCommand(args, log)
+        ret = cmd.run()
+    elif args.command.lower() == 'compare-dependencies':
+        cmd = CompareDependenciesCommand(args, log)
+        ret = cmd.run()
     elif args.command.lower() == 'clear-cache':
         cache = MetamateCache(args.username)
         cache.clear()
@@ -1,59 +1,310 @@
 import glob
+import json
 import os
+import sqlite3
 import yaml
 
+from metamatelib.file_lock import \
+    FileLock, \
+    write_file_atomically
+
+LOCK_FILE_NAME = "cache.lock"
+INFO_FILE_NAME = "cache-info.json"
+# Incremented when format of cached data changes incompatibly
+CACHE_FORMAT_VERSION = 1
+
+
+class YamlCacheStore:
+    """ Stores data for each class in a separate YAML file, files are replaced atomically """
+    def __init__(self, org_root_dir):
+        self._org_root_dir = org_root_dir
+
+    def keys(self):
+        """ Returns names of all cached classes """
+        return [os.path.split(path)[1][:-5] for path in self._class_files()]
+
+    def get(self, class_name):
+        """ Returns data cached for a class or None """
+        try:
+            with open(self._class_data_file_name(class_name), 'r') as file:
+                return yaml.safe_load(file)
+        except FileNotFoundError:
+            return None
+
+    def put_many(self, items):
+        """ Stores data for several classes """
+        for class_name, data in items.items():
+            write_file_atomically(self._class_data_file_name(class_name), yaml.dump(data, default_flow_style=False))
+
+    def delete(self, class_name):
+        """ Removes data cached for a class """
+        remove_file(self._class_data_file_name(class_name))
+
+    def clear(self):
+        """ Removes data cached for all classes """
+        for path in self._class_files():
+            remove_file(path)
+
+    def close(self):
+        pass
+
+    def _class_files(self):
+        return glob.glob('{0}/*.yaml'.format(self._org_root_dir))
+
+    def _class_data_file_name(self, class_name):
+        return os.path.join(self._org_root_dir, "{0}.yaml".format(class_name))
+
+
+class SqliteCacheStore:
+    """ Stores data for all classes in a single indexed SQLite database
+    Write-ahead log lets readers see a consistent snapshot while another process writes """
+    FILE_NAME = "cache.db"
+    # Seconds to wait for a write transaction of another process to finish
+    BUSY_TIMEOUT = 60.0
+
+    def __init__(self, org_root_dir):
+        self._conn = sqlite3.connect(os.path.join(org_root_dir, self.FILE_NAME), timeout=self.BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS class_data (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.commit()
+
+    def keys(self):
+        """ Returns names of all cached classes """
+        return [row[0] for row in self._conn.execute("SELECT name FROM class_data")]
+
+    def get(self, class_name):
+        """ Returns data cached for a class or None """
+        row = self._conn.execute(
+            "SELECT data FROM class_data WHERE name=?", (class_name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_many(self, items):
+        """ Stores data for several classes in one transaction """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO class_data (name, data) VALUES (?, ?)",
+                [(class_name, json.dumps(data, separators=(',', ':')))
+                 for class_name, data in items.items()])
+
+    def delete(self, class_name):
+        """ Removes data cached for a class """
+        with self._conn:
+            self._conn.execute("DELETE FROM class_data WHERE name=?", (class_name,))
+
+    def clear(self):
+        """ Removes data cached for all classes """
+        with self._conn:
+            self._conn.execute("DELETE FROM class_data")
+
+    def close(self):
+        self._conn.close()
+
+
+def remove_file(path):
+    """ Removes file which may have been removed by another process already """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+CACHE_BACKENDS = {
+    'sqlite': SqliteCacheStore,
+    'yaml': YamlCacheStore
+}
+
 
 class MetamateCache:
-    """ Class to manage local cache """
+    """ Class to manage local cache
+    Several processes can use cache of the same org at once. Files are replaced atomically, so class data can be
+    read without locking. Opening the cache and merging class data take a shared lock, clearing the cache and
+    updating JSON files take an exclusive one.
+    Generation is incremented every time cached data changes. """
     ROOT_DIR_NAME = ".metamate"
 
-    def __init__(self, username):
+    def __init__(self, username, backend='sqlite'):
+        if backend not in CACHE_BACKENDS:
+            raise Exception("Unknown cache backend: {0}".format(backend))
         self._username = username
+        self._backend = backend
         self._root_dir = os.path.join(os.path.expanduser("~"), self.ROOT_DIR_NAME)
         self._org_root_dir = os.path.join(self._root_dir, self._username)
+        self._lock = FileLock(os.path.join(self._org_root_dir, LOCK_FILE_NAME))
+        self._store = None
         self._data = dict()
+        self._generation = None
 
     @property
-    def data(self):
-        return self._data
+    def org_root_dir(self):
+        return self._org_root_dir
 
     def load(self):
-        """ Loads data for all classes stored in local cache """
+        """ Opens local cache, class data is read lazily when requested """
         # Check whether org directory exists in the local cache
         if os.path.exists(self._org_root_dir):
             if not os.path.isdir(self._org_root_dir):
-                raise Exception("Please delete {0} file, Metamate needs to create a directory with this name")
+                raise Exception("Please delete {0} file, Metamate needs to create a directory with this name".format(
+                    self._org_root_dir))
         else:
-            os.makedirs(self._org_root_dir)
-        # Find existing files
-        for path in glob.glob('{0}/*.yaml'.format(self._org_root_dir)):
-            file_name = os.path.split(path)[1]
-            class_name = file_name[:-5]
-            with open(path, 'r') as file:
-                self._data[class_name] = yaml.load(file)
+            os.makedirs(self._org_root_dir, exist_ok=True)
+        info = self._load_info()
+        if info['Version'] > CACHE_FORMAT_VERSION:
+            raise Exception("Local cache {0} was created by newer version of Metamate (format {1}), "
+                            "please upgrade or run clear-cache command".format(self._org_root_dir, info['Version']))
+        self._generation = info['Generation']
+        # Cache is not cleared while it is being opened and migrated
+        with self._lock.shared():
+            self._open_store()
+
+    @property
+    def generation(self):
+        """ Generation of cached data seen when the cache was loaded or last changed by this instance """
+        return self._generation
+
+    def is_changed(self):
+        """ Checks whether another process changed cached data since it was loaded """
+        return self._load_info()['Generation'] != self._generation
+
+    def refresh(self):
+        """ Forgets class data read so far if another process changed cached data """
+        generation = self._load_info()['Generation']
+        if generation != self._generation:
+            self._data = dict()
+            self._generation = generation
+
+    def _load_info(self, lock=True):
+        return self.load_json(INFO_FILE_NAME, {'Version': CACHE_FORMAT_VERSION, 'Generation': 0}, lock)
+
+    def _increment_generation(self):
+        def increment(info):
+            # Changes made by other processes in the meantime stay visible to is_changed
+            if info['Generation'] == self._generation:
+                self._generation += 1
+            info['Generation'] += 1
+            return info
+        self.update_json(INFO_FILE_NAME, increment, {'Version': CACHE_FORMAT_VERSION, 'Generation': 0})
+
+    def close(self):
+        """ Closes local cache """
+        if self._store is not None:
+            self._store.close()
+            self._store = None
 
     def clear(self):
         """ Clears local cache """
         if not os.path.exists(self._org_root_dir):
             return
-        for path in glob.glob('{0}/*.yaml'.format(self._org_root_dir)):
-            os.remove(path)
+        with self._lock.exclusive():
+            info = self._load_info(lock=False)
+            self._open_store().clear()
+            self._data = dict()
+            # Remove class files left behind by YAML cache
+            YamlCacheStore(self._org_root_dir).clear()
+            # Remove auxiliary data, generation keeps growing so that other processes notice the change
+            for path in glob.glob('{0}/*.json'.format(self._org_root_dir)):
+                remove_file(path)
+            self._generation = info['Generation'] + 1
+            self.save_json(INFO_FILE_NAME, {'Version': CACHE_FORMAT_VERSION, 'Generation': self._generation},
+                           lock=False)
+
+    def class_names(self):
+        """ Returns names of all classes stored in local cache """
+        return self._open_store().keys()
+
+    def get_class_data(self, class_name):
+        """ Returns data cached for a class or None """
+        # Class files and database rows are replaced atomically, no lock is needed to read them
+        if class_name not in self._data:
+            data = self._open_store().get(class_name)
+            if data is None:
+                return None
+            self._data[class_name] = data
+        return self._data[class_name]
 
     def add_class_data(self, class_name, data):
         """ Stores data for a class in the local cache """
-        # Save as YAML into local cache
-        with open(self._class_data_file_name(class_name), 'w+') as file:
-            file.write(yaml.dump(data, default_flow_style=False))
-        self._data[class_name] = data
+        self.add_classes_data({class_name: data})
+
+    def add_classes_data(self, items):
+        """ Stores data for several classes in the local cache at once, data of other classes cached by
+        concurrent processes is kept """
+        if len(items) == 0:
+            return
+        with self._lock.shared():
+            self._open_store().put_many(items)
+        self._data.update(items)
+        self._increment_generation()
 
     def delete_class_data(self, class_name):
         """ Remove data cached for a class """
-        if class_name not in self._data:
+        self._data.pop(class_name, None)
+        with self._lock.shared():
+            self._open_store().delete(class_name)
+        self._increment_generation()
+
+    def load_json(self, file_name, default=None, lock=True):
+        """ Loads auxiliary data stored in a JSON file next to class data """
+        if not lock:
+            return read_json_file(os.path.join(self._org_root_dir, file_name), default)
+        with self._lock.shared():
+            return read_json_file(os.path.join(self._org_root_dir, file_name), default)
+
+    def save_json(self, file_name, data, lock=True):
+        """ Saves auxiliary data into a JSON file next to class data """
+        content = json.dumps(data, separators=(',', ':'))
+        if not lock:
+            write_file_atomically(os.path.join(self._org_root_dir, file_name), content)
             return
-        del self._data[class_name]
-        class_file = self._class_data_file_name(class_name)
-        if os.path.isfile(class_file):
-            os.remove(class_file)
+        with self._lock.exclusive():
+            write_file_atomically(os.path.join(self._org_root_dir, file_name), content)
 
-    def _class_data_file_name(self, class_name):
-        return os.path.join(self._org_root_dir, "{0}.yaml".format(class_name))
+    def update_json(self, file_name, update, default=None):
+        """ Reads auxiliary data, passes it to update function and saves returned data while holding
+        exclusive lock, so that concurrent updates are not lost. Returns saved data """
+        with self._lock.exclusive():
+            data = update(self.load_json(file_name, default, lock=False))
+            self.save_json(file_name, data, lock=False)
+        return data
+
+    def load_json_from_all_orgs(self, file_name):
+        """ Loads auxiliary data stored in JSON files with given name by all orgs in local cache """
+        data = list()
+        for path in sorted(glob.glob(os.path.join(self._root_dir, '*', file_name))):
+            with FileLock(os.path.join(os.path.dirname(path), LOCK_FILE_NAME)).shared():
+                org_data = read_json_file(path, None)
+            if org_data is not None:
+                data.append(org_data)
+        return data
+
+    def _open_store(self):
+        if self._store is None:
+            self._store = CACHE_BACKENDS[self._backend](self._org_root_dir)
+            if self._backend != 'yaml':
+                self._migrate_yaml_cache()
+        return self._store
+
+    def _migrate_yaml_cache(self):
+        """ Moves class data stored by YAML cache into current store """
+        yaml_store = YamlCacheStore(self._org_root_dir)
+        if len(yaml_store.keys()) == 0:
+            return
+        items = dict()
+        for class_name in yaml_store.keys():
+            data = yaml_store.get(class_name)
+            # Another process may be migrating the same files
+            if data is not None:
+                items[class_name] = data
+        self._store.put_many(items)
+        for class_name in items:
+            yaml_store.delete(class_name)
+
+
+def read_json_file(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
@@ -0,0 +1,157 @@
+""" Run metrics: time spent in each phase, API calls, transferred bytes and counters """
+import copy
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from metamatelib.file_lock import write_file_atomically
+
+TOOLING_PATH_REG_OBJ = re.compile(r'^/services/data/v[0-9.]+/tooling(/.*)?$')
+DATA_PATH_REG_OBJ = re.compile(r'^/services/data/v[0-9.]+(/.*)?$')
+SOAP_PATH_REG_OBJ = re.compile(r'^/services/Soap/([a-z])/')
+METRIC_NAME_REG_OBJ = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def request_endpoint(method, url, headers=None):
+    """ Groups requests by API endpoint dropping API versions, record ids and query cursors, i.e.
+    'POST tooling/sobjects/ApexClassMember', 'GET tooling/query', 'POST soap/m/checkDeployStatus' """
+    path = urlparse(url).path
+    match = SOAP_PATH_REG_OBJ.match(path)
+    if match:
+        return "%s soap/%s/%s" % (method, match.group(1), (headers or dict()).get('SOAPAction', 'unknown'))
+    match = TOOLING_PATH_REG_OBJ.match(path)
+    prefix = 'tooling'
+    if match is None:
+        match = DATA_PATH_REG_OBJ.match(path)
+        prefix = 'data'
+    if match is None:
+        return "%s %s" % (method, path)
+    segments = [segment for segment in (match.group(1) or '').split('/') if segment]
+    if len(segments) > 0 and segments[0] == 'query':
+        segments = segments[:1]
+    elif len(segments) > 0 and segments[0] == 'sobjects':
+        segments = segments[:2]
+    return "%s %s" % (method, '/'.join([prefix] + segments))
+
+
+def payload_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    if isinstance(data, bytes):
+        return len(data)
+    return len(json.dumps(data).encode('utf-8'))
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, escape_label_value(value)) for name, value in sorted(labels.items()))
+
+
+@contextmanager
+def measure(metrics, name):
+    """ Measures phase if metrics are collected """
+    if metrics is None:
+        yield
+    else:
+        with metrics.phase(name):
+            yield
+
+
+class Metrics:
+    """ Collects metrics of one run, can be shared by threads """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._phases = dict()
+        self._counters = dict()
+        self._requests = dict()
+
+    @contextmanager
+    def phase(self, name):
+        """ Adds time spent in the block to the phase, phases running concurrently are measured separately """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.time() - started)
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            phase = self._phases.setdefault(name, {'Time': 0.0, 'Count': 0})
+            phase['Time'] += seconds
+            phase['Count'] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record_request(self, method, url, headers, data, response, seconds):
+        endpoint = request_endpoint(method, url, headers)
+        with self._lock:
+            stats = self._requests.setdefault(
+                endpoint, {'Count': 0, 'Errors': 0, 'BytesSent': 0, 'BytesReceived': 0, 'Time': 0.0})
+            stats['Count'] += 1
+            stats['BytesSent'] += payload_size(data)
+            stats['BytesReceived'] += len(response.content)
+            stats['Time'] += seconds
+            if response.status_code >= 400:
+                stats['Errors'] += 1
+
+    def report(self, **details):
+        """ Returns dictionary in format
+        {
+            'Time': 65.2,
+            'Phases': {'scan': {'Time': 1.2, 'Count': 1}},
+            'Requests': {'GET tooling/query': {'Count': 3, 'Errors': 0, 'BytesSent': 0,
+                                               'BytesReceived': 2048, 'Time': 0.9}},
+            'Counters': {'dependency_cache_hits': 120}
+        }
+        with details added """
+        with self._lock:
+            report = {
+                'Started': self._started,
+                'Time': time.time() - self._started,
+                'Phases': copy.deepcopy(self._phases),
+                'Requests': copy.deepcopy(self._requests),
+                'Counters': dict(self._counters)
+            }
+        report.update(details)
+        return report
+
+    def write_json(self, path, **details):
+        write_file_atomically(path, json.dumps(self.report(**details), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path, labels, **details):
+        """ Writes metrics in Prometheus text format, i.e. for node exporter textfile collector """
+        report = self.report(**details)
+        lines = list()
+
+        def add(name, help_text, metric_type, samples):
+            lines.append("# HELP metamate_%s %s" % (name, help_text))
+            lines.append("# TYPE metamate_%s %s" % (name, metric_type))
+            for sample_labels, value in samples:
+                lines.append("metamate_%s{%s} %s" % (name, format_labels(dict(labels, **sample_labels)), value))
+
+        add('run_seconds', 'Duration of the run', 'gauge', [({}, report['Time'])])
+        add('run_success', 'Whether the run succeeded', 'gauge', [({}, 1 if report.get('Succeeded') else 0)])
+        add('phase_seconds', 'Time spent in phase', 'gauge',
+            [({'phase': name}, phase['Time']) for name, phase in sorted(report['Phases'].items())])
+        for key, name, help_text in [('Count', 'api_requests', 'API requests sent'),
+                                     ('Errors', 'api_errors', 'API requests which failed'),
+                                     ('BytesSent', 'api_bytes_sent', 'Bytes sent to API'),
+                                     ('BytesReceived', 'api_bytes_received', 'Bytes received from API'),
+                                     ('Time', 'api_seconds', 'Time spent waiting for API responses')]:
+            add(name, help_text, 'gauge',
+                [({'endpoint': endpoint}, stats[key]) for endpoint, stats in sorted(report['Requests'].items())])
+        for name, value in sorted(report['Counters'].items()):
+            add(METRIC_NAME_REG_OBJ.sub('_', name), name.replace('_', ' ').capitalize(), 'gauge', [({}, value)])
+        write_file_atomically(path, '\n'.join(lines) + '\n')
+
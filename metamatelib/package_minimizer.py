@@ -0,0 +1,207 @@
+""" Removes components which have not changed since last deployment from deployment package """
+import hashlib
+import io
+import os
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+from metamatelib.test_extractor import \
+    XML_NAMESPACES, \
+    parse_package_members
+
+# Directories of metadata types whose components are stored in their own files
+METADATA_FOLDERS = {
+    'ApexClass': 'classes',
+    'ApexComponent': 'components',
+    'ApexPage': 'pages',
+    'ApexTrigger': 'triggers',
+    'ApprovalProcess': 'approvalProcesses',
+    'AuraDefinitionBundle': 'aura',
+    'CustomApplication': 'applications',
+    'CustomLabels': 'labels',
+    'CustomMetadata': 'customMetadata',
+    'CustomObject': 'objects',
+    'CustomPermission': 'customPermissions',
+    'CustomTab': 'tabs',
+    'Document': 'documents',
+    'EmailTemplate': 'email',
+    'FlexiPage': 'flexipages',
+    'Flow': 'flows',
+    'Layout': 'layouts',
+    'LightningComponentBundle': 'lwc',
+    'PermissionSet': 'permissionsets',
+    'Profile': 'profiles',
+    'QuickAction': 'quickActions',
+    'RemoteSiteSetting': 'remoteSiteSettings',
+    'Report': 'reports',
+    'StaticResource': 'staticresources',
+    'Workflow': 'workflows'
+}
+# Types whose components are stored inside files of their parent component
+CHILD_TYPES = {
+    'BusinessProcess': 'CustomObject',
+    'CompactLayout': 'CustomObject',
+    'CustomField': 'CustomObject',
+    'CustomLabel': 'CustomLabels',
+    'FieldSet': 'CustomObject',
+    'ListView': 'CustomObject',
+    'RecordType': 'CustomObject',
+    'SharingReason': 'CustomObject',
+    'ValidationRule': 'CustomObject',
+    'WebLink': 'CustomObject',
+    'WorkflowAlert': 'Workflow',
+    'WorkflowFieldUpdate': 'Workflow',
+    'WorkflowRule': 'Workflow'
+}
+DESTRUCTIVE_MANIFESTS = ['destructiveChanges.xml', 'destructiveChangesPre.xml', 'destructiveChangesPost.xml']
+DEPLOYED_HASHES_FILE_NAME = 'deployed-hashes.json'
+# Fixed timestamp makes minimized packages with the same contents identical
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+PACKAGE_XML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+{types}    <version>{version}</version>
+</Package>
+"""
+
+
+def component_key(metadata_type, member):
+    return "%s/%s" % (metadata_type, member)
+
+
+def find_component_files(file_names, metadata_type, member):
+    """ Returns files which store component, components of child types are stored in files of parent component
+    Files of component 'Account' in folder 'objects' are 'objects/Account.object', 'objects/Account-meta.xml',
+    'objects/Account/...' """
+    if metadata_type in CHILD_TYPES:
+        if metadata_type == 'CustomLabel':
+            return find_component_files(file_names, CHILD_TYPES[metadata_type], 'CustomLabels')
+        return find_component_files(file_names, CHILD_TYPES[metadata_type], member.split('.')[0])
+    folder = METADATA_FOLDERS.get(metadata_type)
+    if folder is None:
+        return list()
+    prefix = "%s/%s" % (folder, member)
+    return [name for name in file_names
+            if name == prefix or name.startswith(prefix + '.') or name.startswith(prefix + '/')
+            or name == prefix + '-meta.xml']
+
+
+def expand_members(file_names, metadata_type, members):
+    """ Replaces wildcard with names of components found in type's folder """
+    if '*' not in members or metadata_type not in METADATA_FOLDERS:
+        return members
+    prefix = METADATA_FOLDERS[metadata_type] + '/'
+    expanded = set()
+    for name in file_names:
+        if name.startswith(prefix) and not name.endswith('-meta.xml'):
+            expanded.add(name[len(prefix):].split('/')[0].split('.')[0])
+    return sorted(expanded)
+
+
+def hash_components(package):
+    """ Hashes files of each component listed in package.xml
+    Returns dictionary in format
+    {
+        'ApexClass/class_name_1': {'Type': 'ApexClass', 'Member': 'class_name_1',
+                                   'Files': ['classes/class_name_1.cls', 'classes/class_name_1.cls-meta.xml'],
+                                   'Hash': '2fd4e1c67a2d28fced849ee1bb76e7391b93eb12'}
+    }
+    Components whose files cannot be found get None hash and are always deployed """
+    file_names = package.file_names()
+    file_hashes = dict()
+    components = dict()
+    for metadata_type, members in package.members.items():
+        for member in expand_members(file_names, metadata_type, members):
+            files = find_component_files(file_names, metadata_type, member)
+            component_hash = None
+            if len(files) > 0:
+                sha1 = hashlib.sha1()
+                for name in files:
+                    if name not in file_hashes:
+                        file_hashes[name] = hashlib.sha1(package.read_bytes(name)).hexdigest()
+                    sha1.update(("%s:%s\n" % (name, file_hashes[name])).encode('utf-8'))
+                component_hash = sha1.hexdigest()
+            components[component_key(metadata_type, member)] = {
+                'Type': metadata_type,
+                'Member': member,
+                'Files': files,
+                'Hash': component_hash
+            }
+    return components
+
+
+def read_package_version(package):
+    root = ET.fromstring(package.read_bytes('package.xml'))
+    version = root.find('mt:version', XML_NAMESPACES)
+    return None if version is None else version.text
+
+
+def build_package_xml(members, version):
+    """ Produces package.xml listing members in format {'ApexClass': ['class_name_1']} """
+    types = ''
+    for metadata_type in sorted(members.keys()):
+        types += "    <types>\n"
+        for member in sorted(members[metadata_type]):
+            types += "        <members>%s</members>\n" % escape(member)
+        types += "        <name>%s</name>\n    </types>\n" % metadata_type
+    return PACKAGE_XML_TEMPLATE.format(types=types, version=version)
+
+
+def select_changed_components(components, deployed_hashes):
+    """ Returns keys of components which are new, changed or cannot be hashed """
+    changed = list()
+    for key, component in sorted(components.items()):
+        if component['Hash'] is None or deployed_hashes.get(key) != component['Hash']:
+            changed.append(key)
+    return changed
+
+
+def select_unlisted_files(package, components):
+    """ Returns files not belonging to any listed component (i.e. destructiveChanges.xml), package has to be
+    deployed whenever it contains any of them """
+    component_files = set()
+    for component in components.values():
+        component_files.update(component['Files'])
+    return [name for name in package.file_names() if name != 'package.xml' and name not in component_files]
+
+
+def read_destructive_members(package):
+    """ Returns keys of components deleted by destructive manifests contained in package """
+    file_names = package.file_names()
+    keys = list()
+    for name in DESTRUCTIVE_MANIFESTS:
+        if name not in file_names:
+            continue
+        for metadata_type, members in parse_package_members(io.BytesIO(package.read_bytes(name))).items():
+            keys.extend(component_key(metadata_type, member) for member in members)
+    return sorted(set(keys))
+
+
+def write_minimized_package(package, components, changed, zip_path):
+    """ Writes ZIP file containing only changed components and matching package.xml (without any types
+    when no component changed). Files not belonging to any listed component (i.e. destructiveChanges.xml)
+    are copied as well """
+    members = dict()
+    changed_files = set()
+    for key in changed:
+        component = components[key]
+        members.setdefault(component['Type'], list()).append(component['Member'])
+        changed_files.update(component['Files'])
+    component_files = set()
+    for component in components.values():
+        component_files.update(component['Files'])
+
+    with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zipfile:
+        zipfile.writestr(ZipInfo('package.xml', ZIP_DATE_TIME),
+                         build_package_xml(members, read_package_version(package)), ZIP_DEFLATED)
+        for name in package.file_names():
+            if name == 'package.xml':
+                continue
+            if name in changed_files or name not in component_files:
+                zipfile.writestr(ZipInfo(name, ZIP_DATE_TIME), package.read_bytes(name), ZIP_DEFLATED)
+    return members
+
+
+def minimized_zip_path(deploy_zip):
+    root, ext = os.path.splitext(deploy_zip)
+    return "%s-minimized%s" % (root, ext or '.zip')
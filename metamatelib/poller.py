@@ -0,0 +1,33 @@
+""" Status polling with exponential backoff """
+import time
+
+
+class Poller:
+    """ Calls status check with short intervals first, intervals grow exponentially up to a cap
+    Keeps number of checks and time spent waiting across all waits """
+    def __init__(self, initial_interval=1.0, max_interval=30.0, factor=2.0, timeout=None):
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._factor = factor
+        self._timeout = timeout
+        self.poll_count = 0
+        self.time_waited = 0.0
+
+    def wait(self, check, description='operation'):
+        """ Sleeps and calls check() until it returns True
+        Raises exception if timeout (in seconds) expires first """
+        started = time.time()
+        interval = self._initial_interval
+        while True:
+            if self._timeout is not None:
+                remaining = started + self._timeout - time.time()
+                if remaining <= 0:
+                    raise Exception("Timed out after %s seconds waiting for %s to finish" % (
+                        self._timeout, description))
+                interval = min(interval, remaining)
+            time.sleep(interval)
+            self.time_waited += interval
+            self.poll_count += 1
+            if check():
+                return
+            interval = min(interval * self._factor, self._max_interval)
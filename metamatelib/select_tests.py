@@ -0,0 +1,20 @@
+""" Select tests command """
+from metamatelib.deploy import DeployCommand
+
+
+class SelectTestsCommand(DeployCommand):
+    """ Selects tests for deployment package the same way deploy command does without deploying it
+    Salesforce is contacted only when symbol tables of some test classes are not in local cache """
+    def _run(self):
+        self._read_package()
+        self._prepare_session()
+        self._find_unit_tests_to_run()
+        if not self._session.is_connected():
+            self._log.inf("All test classes were found in local cache, Salesforce was not contacted")
+
+        if self._args.output:
+            with open(self._args.output, 'w', encoding='utf-8') as file:
+                file.write(''.join("%s\n" % class_name for class_name in self._unit_tests_to_run))
+            self._log.inf("Names of %s test class(es) written to %s" % (
+                len(self._unit_tests_to_run), self._args.output))
+        return True
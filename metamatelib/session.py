@@ -0,0 +1,154 @@
+""" Salesforce session which is reused across runs and refreshed when it expires """
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from sfdclib import SfdcSession
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = None
+
+SESSION_FILE_NAME = 'session.json'
+SECONDS_VALID_REG_OBJ = re.compile(r'<sessionSecondsValid>([0-9]+)</sessionSecondsValid>', re.UNICODE)
+DEFAULT_SECONDS_VALID = 7200
+KEY_DERIVATION_ITERATIONS = 100000
+
+
+def is_invalid_session_response(response):
+    """ Checks whether REST (401) or SOAP (500) request was rejected because session expired """
+    return response.status_code in (401, 500) and 'INVALID_SESSION_ID' in response.text
+
+
+class MetamateSession(SfdcSession):
+    """ Salesforce session which logs in again and repeats the request when Salesforce rejects session id
+    Sessions obtained by logging in are saved to session cache if one is attached """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_cache = None
+        self.metrics = None
+        self.seconds_valid = DEFAULT_SECONDS_VALID
+        self.login_count = 0
+        self._login_lock = threading.Lock()
+
+    def login(self):
+        super().login()
+        self.login_count += 1
+        if self.session_cache is not None:
+            self.session_cache.save(self)
+
+    def restore(self, session_id, instance):
+        """ Uses session id obtained earlier instead of logging in """
+        self._session_id = session_id
+        self._instance = instance
+
+    def get_username(self):
+        return self._username
+
+    def get_instance(self):
+        return self._instance
+
+    def is_sandbox(self):
+        return self._is_sandbox
+
+    def _refresh(self, expired_session_id):
+        with self._login_lock:
+            # Another thread may have logged in already
+            if self._session_id == expired_session_id:
+                self.login()
+            return self._session_id
+
+    def _send(self, method, url, *args, **kwargs):
+        started = time.time()
+        response = super().request(method, url, *args, **kwargs)
+        if self.metrics is not None:
+            self.metrics.record_request(method, url, kwargs.get('headers'), kwargs.get('data'), response,
+                                        time.time() - started)
+        return response
+
+    def request(self, method, url, *args, **kwargs):
+        headers = kwargs.get('headers') or dict()
+        is_login = headers.get('SOAPAction') == 'login'
+        session_id = self._session_id
+        response = self._send(method, url, *args, **kwargs)
+        if is_login:
+            match = SECONDS_VALID_REG_OBJ.search(response.text)
+            if match:
+                self.seconds_valid = int(match.group(1))
+            return response
+        if session_id is None or self._password is None or not is_invalid_session_response(response):
+            return response
+
+        new_session_id = self._refresh(session_id)
+        # Session id is sent in Authorization header (REST) or in request body (SOAP)
+        if 'Authorization' in headers:
+            kwargs['headers'] = dict(headers, Authorization=headers['Authorization'].replace(
+                session_id, new_session_id))
+        data = kwargs.get('data')
+        if isinstance(data, str):
+            kwargs['data'] = data.replace(session_id, new_session_id)
+        elif isinstance(data, bytes):
+            kwargs['data'] = data.replace(session_id.encode('utf-8'), new_session_id.encode('utf-8'))
+        return self._send(method, url, *args, **kwargs)
+
+
+class SessionCache:
+    """ Keeps session id and instance in org cache directory encrypted with a key derived from user's password
+    Requires cryptography package """
+    def __init__(self, cache, password, token=None):
+        self._cache = cache
+        self._secret = (password + (token or '')).encode('utf-8')
+
+    @staticmethod
+    def is_available():
+        return Fernet is not None
+
+    def _fernet(self, salt):
+        key = hashlib.pbkdf2_hmac('sha256', self._secret, salt, KEY_DERIVATION_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def load(self, username, is_sandbox):
+        """ Returns cached session in format {'SessionId': '00D...', 'Instance': 'cs1', 'Expires': 1466501224.0}
+        or None if there is no valid session """
+        data = self._cache.load_json(SESSION_FILE_NAME)
+        if data is None:
+            return None
+        try:
+            session = json.loads(self._fernet(base64.b64decode(data['Salt'])).decrypt(
+                data['Token'].encode('ascii')).decode('utf-8'))
+        except (InvalidToken, KeyError, ValueError):
+            # Password changed or file is corrupt
+            return None
+        if session['Username'] != username or session['IsSandbox'] != is_sandbox:
+            return None
+        if session['Expires'] <= time.time():
+            return None
+        return session
+
+    def save(self, session):
+        salt = os.urandom(16)
+        data = json.dumps({
+            'Username': session.get_username(),
+            'IsSandbox': session.is_sandbox(),
+            'SessionId': session.get_session_id(),
+            'Instance': session.get_instance(),
+            'Expires': time.time() + session.seconds_valid
+        })
+        self._cache.save_json(SESSION_FILE_NAME, {
+            'Salt': base64.b64encode(salt).decode('ascii'),
+            'Token': self._fernet(salt).encrypt(data.encode('utf-8')).decode('ascii')
+        })
+
+    def restore(self, session):
+        """ Restores cached session, returns False if there is no valid session """
+        cached = self.load(session.get_username(), session.is_sandbox())
+        if cached is None:
+            return False
+        session.restore(cached['SessionId'], cached['Instance'])
+        return True
@@ -1,77 +1,280 @@
 import re
-from os import path, listdir
+from concurrent.futures import ThreadPoolExecutor
+from os import path, scandir
 from xml.etree import ElementTree as ET
 from zipfile import ZipFile
 
+from metamatelib.dependency_finder import hash_class_body
+from metamatelib.local_dependency_finder import extract_identifiers, strip_comments_and_strings
+
 XML_NAMESPACES = {'mt': 'http://soap.sforce.com/2006/04/metadata'}
+TEST_REG_OBJ = re.compile(r'@isTest', re.UNICODE)
+ACTIVE_REG_OBJ = re.compile(r'Active', re.UNICODE)
+CLASS_NAME_REG_OBJ = re.compile(r'(private|public)\s+.*class\s+([a-zA-Z0-9_]+)\s*', re.UNICODE)
+TRIGGER_REG_OBJ = re.compile(r'\btrigger\s+([a-zA-Z0-9_]+)\s+on\s+([a-zA-Z0-9_]+)', re.IGNORECASE | re.UNICODE)
+# Keywords are left out of identifiers kept in scan results, none of them names an sObject, field or class
+APEX_KEYWORDS = frozenset([
+    'abstract', 'after', 'and', 'as', 'asc', 'before', 'boolean', 'break', 'by', 'catch', 'class', 'continue',
+    'decimal', 'delete', 'desc', 'do', 'double', 'else', 'enum', 'extends', 'false', 'final', 'finally', 'for',
+    'from', 'global', 'if', 'implements', 'in', 'insert', 'instanceof', 'integer', 'interface', 'istest', 'limit',
+    'list', 'long', 'map', 'merge', 'new', 'not', 'null', 'object', 'on', 'or', 'override', 'private',
+    'protected', 'public', 'return', 'select', 'set', 'sharing', 'static', 'string', 'super', 'system', 'testmethod',
+    'this', 'throw', 'transient', 'trigger', 'true', 'try', 'undelete', 'update', 'upsert', 'virtual', 'void',
+    'where', 'while', 'with', 'without'
+])
 
 
-def grep_file(filename, reg_obj):
-    try:
-        with open(filename, mode='r', encoding='utf-8') as file:
-            if reg_obj.search(file.read()):
-                return True
-    except Exception as ex:
-        print("Could not process file %s: %s" % (filename, ex))
-    return False
+def parse_package_members(package_xml):
+    """ Parses package.xml file object incrementally
+    Returns dictionary in format {'ApexClass': ['class_name_1'], 'ApexTrigger': ['trigger_name_1']} """
+    members = dict()
+    types_tag = '{%s}types' % XML_NAMESPACES['mt']
+    for _, node in ET.iterparse(package_xml, events=('end',)):
+        if node.tag != types_tag:
+            continue
+        name = node.find('mt:name', XML_NAMESPACES)
+        if name is not None:
+            members.setdefault(name.text, list()).extend(
+                member.text for member in node.findall('mt:members', XML_NAMESPACES))
+        node.clear()
+    return members
 
 
-def extract_package_xml(zipfile):
+def extract_class_objects(zipfile):
     with ZipFile(zipfile) as zf:
         with zf.open('package.xml') as package_xml:
-            return ET.fromstring(package_xml.read().decode("utf-8"))
+            return parse_package_members(package_xml).get('ApexClass', list())
+
 
+def read_file(filename, log=None):
+    """ Returns file contents or None if file cannot be read, failure is logged as warning when log is given
+    and raised otherwise """
+    try:
+        with open(filename, mode='r', encoding='utf-8') as file:
+            return file.read()
+    except (OSError, UnicodeDecodeError) as ex:
+        if log is None:
+            raise Exception("Could not process file %s: %s" % (filename, ex))
+        log.wrn("Could not process file %s: %s" % (filename, ex))
+    return None
 
-def extract_members(root, object_type):
-    items = list()
-    for node in root.findall("mt:types/[mt:name='%s']" % object_type, XML_NAMESPACES):
-        for member in node.findall("mt:members", XML_NAMESPACES):
-            items.append(member.text)
-    return items
 
+def scan_class_file(classes_path, obj, log=None):
+    """ Reads class body and its meta XML once and extracts everything needed to select tests
+    Returns dictionary in format
+    {
+        'Stat': [1466501224000000000, 2048, 1466501224000000000, 180],
+        'IsTest': True,
+        'IsActive': True,
+        'ClassNames': ['class_name_1', 'inner_class_name_1'],
+        'Hash': '2fd4e1c67a2d28fced849ee1bb76e7391b93eb12',
+        'Identifiers': ['account', 'code__c', 'class_name_2']
+    } """
+    body = read_file(path.join(classes_path, "%s.cls" % obj), log)
+    if body is None:
+        return None
+    meta_path = path.join(classes_path, "%s.cls-meta.xml" % obj)
+    meta = read_file(meta_path, log) if path.isfile(meta_path) else None
+    return scan_class_source(body, meta)
 
-def extract_class_objects(zipfile):
-    root = extract_package_xml(zipfile)
-    return extract_members(root, 'ApexClass')
 
+def extract_referenced_names(body):
+    """ Returns sorted lower case names of sObjects, fields, classes etc. used in Apex source """
+    return sorted(extract_identifiers(body) - APEX_KEYWORDS)
 
-def extract_test_objects(classes, source_dir):
-    objects = list()
-    reg_obj = re.compile(r'@isTest', re.UNICODE)
-    for c in classes:
-        file_path = path.join(source_dir, "classes", "%s.cls" % c)
-        if not path.isfile(file_path):
+
+def scan_class_source(body, meta):
+    """ Extracts everything needed to select tests from class body and its meta XML """
+    return {
+        'IsTest': TEST_REG_OBJ.search(body) is not None,
+        'IsActive': meta is not None and ACTIVE_REG_OBJ.search(meta) is not None,
+        'ClassNames': [match.group(2) for match in CLASS_NAME_REG_OBJ.finditer(body)],
+        'Hash': hash_class_body(body),
+        'Identifiers': extract_referenced_names(body)
+    }
+
+
+def scan_trigger_source(body):
+    """ Extracts name of sObject trigger fires on and names it references, returns None if body does not declare
+    a trigger """
+    match = TRIGGER_REG_OBJ.search(strip_comments_and_strings(body))
+    if match is None:
+        return None
+    return {'SObject': match.group(2), 'Identifiers': extract_referenced_names(body)}
+
+
+def scan_triggers(source_dir, log=None, index=None):
+    """ Scans triggers directory, returns dictionary in format {'trigger_name_1': scan_trigger_source() result}
+    When ScanIndex is given only triggers which changed since previous scan are read """
+    triggers_path = path.join(source_dir, "triggers")
+    triggers = dict()
+    stats = dict()
+    if path.isdir(triggers_path):
+        with scandir(triggers_path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.trigger'):
+                    file_stat = entry.stat()
+                    stats[entry.name[:-8]] = (entry.path, [file_stat.st_mtime_ns, file_stat.st_size])
+
+    scanned = 0
+    for trigger_name, (file_path, stat) in stats.items():
+        entry = index.trigger_entries.get(trigger_name) if index is not None else None
+        if entry is not None and entry['Stat'] == stat:
+            triggers[trigger_name] = entry
             continue
-        if grep_file(file_path, reg_obj):
-            objects.append(c)
-    
-    return objects
+        scanned += 1
+        body = read_file(file_path, log)
+        result = None if body is None else scan_trigger_source(body)
+        if result is not None:
+            result['Stat'] = stat
+            triggers[trigger_name] = result
 
+    if index is not None:
+        index.hits += len(stats) - scanned
+        index.misses += scanned
+        # Forget triggers which were deleted or could not be scanned
+        removed = [name for name in index.trigger_entries if name not in triggers]
+        for trigger_name in removed:
+            del index.trigger_entries[trigger_name]
+        index.trigger_entries.update(triggers)
+        if scanned > 0 or len(removed) > 0:
+            index.changed = True
+    return triggers
 
-def find_test_objects(source_dir):
-    objects = list()
-    reg_obj_test = re.compile(r'@isTest', re.UNICODE)
-    reg_obj_active = re.compile(r'Active', re.UNICODE)
+
+class ScanIndex:
+    """ Scan results of classes and triggers kept in local cache between runs, keyed by file modification time
+    and size """
+    FILE_NAME = "scan-index.json"
+    # Index written in other format (i.e. by older version) is discarded and files are scanned again
+    FORMAT_VERSION = 2
+
+    def __init__(self, cache, source_dir):
+        self._cache = cache
+        self._source_dir = path.abspath(source_dir)
+        index = cache.load_json(self.FILE_NAME, dict()).get(self._source_dir, dict())
+        if index.get('Version') != self.FORMAT_VERSION:
+            index = dict()
+        self.entries = index.get('Classes', dict())
+        self.trigger_entries = index.get('Triggers', dict())
+        self.hits = 0
+        self.misses = 0
+        self.changed = False
+
+    def save(self):
+        """ Stores scan results in local cache, indexes of other source directories saved meanwhile are kept
+        Nothing is written (and cache is not locked) when no entry changed """
+        if not self.changed:
+            return
+
+        def update(indexes):
+            indexes[self._source_dir] = {
+                'Version': self.FORMAT_VERSION,
+                'Classes': self.entries,
+                'Triggers': self.trigger_entries
+            }
+            return indexes
+        self._cache.update_json(self.FILE_NAME, update, dict())
+
+
+def stat_class_files(classes_path):
+    """ Lists classes directory without reading any file
+    Returns dictionary in format {'object_name': [mtime, size, meta_mtime, meta_size]} """
+    stats = dict()
+    with scandir(classes_path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.cls'):
+                offset, obj = 0, entry.name[:-4]
+            elif entry.name.endswith('.cls-meta.xml'):
+                offset, obj = 2, entry.name[:-13]
+            else:
+                continue
+            file_stat = entry.stat()
+            stats.setdefault(obj, [None, None, None, None])[offset:offset + 2] = \
+                [file_stat.st_mtime_ns, file_stat.st_size]
+    return stats
+
+
+def scan_classes(source_dir, objects=None, workers=None, index=None, log=None):
+    """ Scans classes directory, returns dictionary in format {'object_name': scan_class_file() result}
+    All classes are scanned unless list of objects is given, files are read by a pool of
+    workers threads (1 disables the pool). When ScanIndex is given only files which changed
+    since previous scan are read. Files which cannot be read are skipped and logged when log is given """
     classes_path = path.join(source_dir, "classes")
-    for entry in listdir(classes_path):
-        if '-meta.xml' in entry:
-            cfname = entry.replace('-meta.xml', '')
-            cfpath = path.join(classes_path, cfname)
-            if path.isfile(cfpath):
-                if grep_file(cfpath, reg_obj_test) and grep_file(path.join(classes_path, entry), reg_obj_active):
-                    objects.append(cfname.replace(".cls", ""))
-    return objects
+    stats = stat_class_files(classes_path)
+    if objects is None:
+        objects = [obj for obj, stat in stats.items() if stat[0] is not None]
+    else:
+        objects = [obj for obj in dict.fromkeys(objects) if obj in stats and stats[obj][0] is not None]
+
+    scan = dict()
+    objects_to_scan = list()
+    for obj in objects:
+        entry = index.entries.get(obj) if index is not None else None
+        if entry is not None and entry['Stat'] == stats[obj]:
+            scan[obj] = entry
+        else:
+            objects_to_scan.append(obj)
 
+    if workers == 1:
+        results = [scan_class_file(classes_path, obj, log) for obj in objects_to_scan]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda obj: scan_class_file(classes_path, obj, log), objects_to_scan))
 
-def extract_class_names(objects, source_dir):
+    for obj, result in zip(objects_to_scan, results):
+        if result is not None:
+            result['Stat'] = stats[obj]
+            scan[obj] = result
+
+    if index is not None:
+        index.hits += len(objects) - len(objects_to_scan)
+        index.misses += len(objects_to_scan)
+        for obj in objects_to_scan:
+            if obj in scan:
+                index.entries[obj] = scan[obj]
+            else:
+                index.entries.pop(obj, None)
+        # Forget files which were deleted
+        deleted = [obj for obj in index.entries if obj not in stats or stats[obj][0] is None]
+        for obj in deleted:
+            del index.entries[obj]
+        if len(objects_to_scan) > 0 or len(deleted) > 0:
+            index.changed = True
+    return scan
+
+
+def select_test_objects(scan, objects):
+    """ Returns objects which contain test classes """
+    return [obj for obj in objects if obj in scan and scan[obj]['IsTest']]
+
+
+def select_active_test_objects(scan):
+    """ Returns all active objects which contain test classes """
+    return [obj for obj, result in scan.items() if result['IsTest'] and result['IsActive']]
+
+
+def select_active_objects(scan):
+    """ Returns all active objects """
+    return [obj for obj, result in scan.items() if result['IsActive']]
+
+
+def select_class_names(scan, objects):
+    """ Returns names of classes declared in objects """
     class_names = list()
-    reg_obj = re.compile(r'(private|public)\s+.*class\s+([a-zA-Z0-9_]+)\s*', re.UNICODE)
     for obj in objects:
-        filename = path.join(source_dir, "classes", "%s.cls" % obj)
-        try:
-            with open(filename, mode='r', encoding='utf-8') as file:
-                for match in reg_obj.finditer(file.read()):
-                    class_names.append(match.group(2))
-        except Exception as err:
-            print("Could not process file {0}. Error: {1}".format(filename, err))
+        if obj in scan:
+            class_names.extend(scan[obj]['ClassNames'])
     return class_names
+
+
+def extract_test_objects(classes, source_dir):
+    return select_test_objects(scan_classes(source_dir, classes), classes)
+
+
+def find_test_objects(source_dir):
+    return select_active_test_objects(scan_classes(source_dir))
+
+
+def extract_class_names(objects, source_dir):
+    return select_class_names(scan_classes(source_dir, objects), objects)
@@ -0,0 +1,85 @@
+""" Splits tests into shards with similar expected run time """
+import hashlib
+import heapq
+import time
+
+TEST_RUNTIMES_FILE_NAME = 'test-runtimes.json'
+SHARD_PLANS_FILE_NAME = 'shard-plans.json'
+DEFAULT_TEST_RUNTIME = 1000.0
+# Shards of one validation are expected to start within this number of seconds
+SHARD_PLAN_MAX_AGE = 24 * 3600
+
+
+def update_test_runtimes(runtimes, class_times, recorded=None):
+    """ Adds run times observed by a deployment to dictionary in format
+    {'test_class_name_1': {'Time': 1520.0, 'Recorded': 1466501224.0}} """
+    recorded = time.time() if recorded is None else recorded
+    for class_name, class_time in class_times.items():
+        runtimes[class_name] = {'Time': class_time, 'Recorded': recorded}
+    return runtimes
+
+
+def merge_test_runtimes(runtimes_list):
+    """ Merges run times recorded in several orgs, the latest recorded time of each class wins
+    Returns dictionary in format {'test_class_name_1': 1520.0} """
+    merged = dict()
+    for runtimes in runtimes_list:
+        for class_name, data in runtimes.items():
+            if class_name not in merged or merged[class_name]['Recorded'] < data['Recorded']:
+                merged[class_name] = data
+    return dict((class_name, data['Time']) for class_name, data in merged.items())
+
+
+def estimate_runtime(runtimes):
+    """ Median of known run times is expected for tests which have not been run yet """
+    if len(runtimes) == 0:
+        return DEFAULT_TEST_RUNTIME
+    times = sorted(runtimes.values())
+    return times[len(times) // 2]
+
+
+def split_into_shards(tests, runtimes, shard_count):
+    """ Assigns each test to the shard with the lowest expected run time, longest tests first
+    Returns list of shards in format [{'Tests': ['test_class_name_1'], 'Time': 1520.0}]
+    Result depends only on tests and run times, so every shard can be selected by a separate process """
+    default_runtime = estimate_runtime(runtimes)
+    expected = dict((test, runtimes.get(test, default_runtime)) for test in set(tests))
+    shards = [{'Tests': list(), 'Time': 0.0} for _ in range(shard_count)]
+    heap = [(0.0, i) for i in range(shard_count)]
+    for test in sorted(expected.keys(), key=lambda name: (-expected[name], name)):
+        total, i = heapq.heappop(heap)
+        shards[i]['Tests'].append(test)
+        shards[i]['Time'] = total + expected[test]
+        heapq.heappush(heap, (shards[i]['Time'], i))
+    for shard in shards:
+        shard['Tests'].sort()
+    return shards
+
+
+def shard_plan_key(tests, shard_count):
+    """ Identifies the split of the same tests into the same number of shards """
+    return hashlib.sha1(("%s\n%s" % (shard_count, '\n'.join(sorted(set(tests))))).encode('utf-8')).hexdigest()
+
+
+def find_shard_plan(plans_list, key, now=None):
+    """ Returns shards of the earliest plan recorded under key by any org within SHARD_PLAN_MAX_AGE or None
+    plans_list contains dictionaries in format {'key': {'Shards': [...], 'Recorded': 1466501224.0}} """
+    now = time.time() if now is None else now
+    found = None
+    for plans in plans_list:
+        plan = plans.get(key)
+        if plan is None or now - plan['Recorded'] > SHARD_PLAN_MAX_AGE:
+            continue
+        if found is None or plan['Recorded'] < found['Recorded']:
+            found = plan
+    return None if found is None else found['Shards']
+
+
+def record_shard_plan(plans, key, shards, recorded=None):
+    """ Adds plan unless it is recorded already and drops expired plans """
+    recorded = time.time() if recorded is None else recorded
+    for plan_key in [plan_key for plan_key, plan in plans.items()
+                     if recorded - plan['Recorded'] > SHARD_PLAN_MAX_AGE]:
+        del plans[plan_key]
+    plans.setdefault(key, {'Shards': shards, 'Recorded': recorded})
+    return plans
@@ -0,0 +1,75 @@
+""" Tooling API client used by Metamate """
+import json
+import time
+
+from sfdclib import SfdcToolingApi
+
+
+class ToolingApi(SfdcToolingApi):
+    """ Tooling API client which backs off and retries when org request limit is exceeded """
+    REQUEST_LIMIT_EXCEEDED = 'REQUEST_LIMIT_EXCEEDED'
+    # sObject Collections are available starting with API v42.0 and accept up to 200 records
+    COLLECTIONS_MIN_API_VERSION = 42.0
+    COLLECTIONS_MAX_SIZE = 200
+
+    def __init__(self, session, max_retries=5, backoff=2.0):
+        super().__init__(session)
+        self._max_retries = max_retries
+        self._backoff = backoff
+
+    def get(self, uri):
+        return self._call(super().get, uri)
+
+    def post(self, uri, data):
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return self._call(super().post, uri, data)
+
+    def delete(self, uri):
+        return self._call(super().delete, uri)
+
+    def supports_collections(self):
+        """ Checks whether sObject Collections can be used with session API version """
+        return float(self._session.get_api_version()) >= self.COLLECTIONS_MIN_API_VERSION
+
+    def create_records(self, sobject_type, records):
+        """ Creates up to 200 records with a single sObject Collections request
+        Returns list of results in format [{'id': '...', 'success': True, 'errors': []}] """
+        return self.post('/composite/sobjects', {
+            'allOrNone': False,
+            'records': [dict(record, attributes={'type': sobject_type}) for record in records]
+        })
+
+    def query_all(self, query):
+        """ Runs query and follows nextRecordsUrl until all records are retrieved """
+        res = self.anon_query(query)
+        records = list(res['records'])
+        while not res.get('done', True):
+            res = self._call(self._get_url, res['nextRecordsUrl'])
+            records.extend(res['records'])
+        return records
+
+    def _get_url(self, uri):
+        """ HTTP GET request to URI which already includes Tooling API base URI """
+        response = self._session.get(self._session.construct_url(uri), headers=self._get_headers())
+        return self._parse_get_post_response(response)
+
+    @classmethod
+    def is_request_limit_exceeded(cls, res):
+        """ Checks whether Tooling API response is REQUEST_LIMIT_EXCEEDED error """
+        return isinstance(res, list) and \
+            any(isinstance(err, dict) and err.get('errorCode') == cls.REQUEST_LIMIT_EXCEEDED for err in res)
+
+    def _call(self, method, *args):
+        delay = self._backoff
+        for attempt in range(self._max_retries + 1):
+            try:
+                res = method(*args)
+            except Exception as ex:
+                if self.REQUEST_LIMIT_EXCEEDED not in str(ex) or attempt == self._max_retries:
+                    raise
+            else:
+                if not self.is_request_limit_exceeded(res) or attempt == self._max_retries:
+                    return res
+            time.sleep(delay)
+            delay *= 2
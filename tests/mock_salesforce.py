@@ -0,0 +1,359 @@
+""" In-process mock of Salesforce Tooling and Metadata APIs used by tests and benchmarks, together with
+helpers pointing commands and local cache at it """
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree as ET
+
+from sfdclib import SfdcSession
+
+from metamatelib.session import MetamateSession
+
+IDENTIFIER_REG_OBJ = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+TOOLING_URI_REG_OBJ = re.compile(r'^/services/data/v[0-9.]+/tooling(/.*)$')
+SOAP_URI_REG_OBJ = re.compile(r'^/services/Soap/([cm])/[0-9.]+$')
+XML_NAMESPACES = {
+    'soapenv': 'http://schemas.xmlsoap.org/soap/envelope/',
+    'met': 'http://soap.sforce.com/2006/04/metadata'
+}
+SOAP_ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns="{namespace}">
+<soapenv:Body>{body}</soapenv:Body></soapenv:Envelope>"""
+LOGIN_RESULT = """<loginResponse><result>
+<serverUrl>https://mock.salesforce.com/services/Soap/c/37.0/00DMOCK</serverUrl>
+<sessionId>00DMOCKSESSION</sessionId>
+<userInfo><sessionSecondsValid>7200</sessionSecondsValid></userInfo>
+</result></loginResponse>"""
+
+
+def home_directory(home_dir):
+    """ Points local cache (~/.metamate) to home_dir, returns patch usable as context manager """
+    return mock.patch.dict(os.environ, {'HOME': home_dir, 'USERPROFILE': home_dir})
+
+
+def use_temporary_home(test_case):
+    """ Points local cache to a temporary directory for the duration of the test, returns its path """
+    home = tempfile.TemporaryDirectory()
+    test_case.addCleanup(home.cleanup)
+    patch = home_directory(home.name)
+    patch.start()
+    test_case.addCleanup(patch.stop)
+    return home.name
+
+
+def mock_command(command_class, args, log, mock_salesforce, **kwargs):
+    """ Creates command (DeployCommand or its subclass) which connects to mock_salesforce instead of Salesforce """
+    class MockCommand(command_class):
+        def _create_session(self, sf_kwargs):
+            return mock_salesforce.metamate_session(**sf_kwargs)
+    return MockCommand(args, log, **kwargs)
+
+
+class MockSession(SfdcSession):
+    """ Session connected to mock server """
+    def __init__(self, server_url, api_version='37.0'):
+        super().__init__(username='user@example.com', password='password', api_version=api_version,
+                         session_id='00DMOCKSESSION', instance='mock')
+        self._server_url = server_url
+
+    def get_server_url(self):
+        return self._server_url
+
+
+class MockMetamateSession(MetamateSession):
+    """ Metamate session connected to mock server, logs in using mock SOAP API """
+    def __init__(self, server_url, **kwargs):
+        super().__init__(**kwargs)
+        self._server_url = server_url
+
+    def get_server_url(self):
+        return self._server_url
+
+
+class MockSalesforce:
+    """ Mock Salesforce org serving Tooling API and Metadata API requests used by Metamate
+    Symbol tables reference every org class whose name appears in class body. Each request is delayed
+    by latency seconds, deployments finish after deploy_checks status checks, each check reports results
+    of the next part of tests. Tests named in failing_tests fail """
+    def __init__(self, classes, query_batch_size=2000, failed_compilations=0, latency=0.0, deploy_checks=1,
+                 test_time=100.0, failing_tests=None):
+        self.requests = Counter()
+        self.deployments = dict()
+        self._failed_compilations = failed_compilations
+        self._latency = latency
+        self._deploy_checks = deploy_checks
+        self._test_time = test_time
+        self._failing_tests = set(failing_tests or list())
+        self._classes = dict()
+        self._class_names = dict()
+        for i, (name, body) in enumerate(sorted(classes.items())):
+            self._classes[name] = {'Id': '01p%012d' % i, 'Body': body}
+            self._class_names[self._classes[name]['Id']] = name
+        self._query_batch_size = query_batch_size
+        self._lock = threading.RLock()
+        self._next_id = 0
+        self._containers = dict()
+        self._members = dict()
+        self._async_requests = dict()
+        self._cursors = dict()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def session(self, api_version='37.0'):
+        return MockSession(self.url, api_version)
+
+    def metamate_session(self, **kwargs):
+        return MockMetamateSession(self.url, **kwargs)
+
+    def _new_id(self, prefix):
+        with self._lock:
+            self._next_id += 1
+            return '%s%012d' % (prefix, self._next_id)
+
+    def _symbol_table(self, class_name, body):
+        refs = list()
+        for name in sorted(set(IDENTIFIER_REG_OBJ.findall(body))):
+            if name != class_name and name in self._classes:
+                refs.append({'name': name, 'namespace': None})
+        return {'name': class_name, 'externalReferences': refs}
+
+    def _query_result(self, records):
+        if len(records) <= self._query_batch_size:
+            return {'size': len(records), 'done': True, 'records': records}
+        cursor = self._new_id('01g')
+        self._cursors[cursor] = records
+        return self._next_page(cursor, 0)
+
+    def _next_page(self, cursor, offset):
+        records = self._cursors[cursor]
+        end = offset + self._query_batch_size
+        res = {'size': len(records), 'done': end >= len(records), 'records': records[offset:end]}
+        if not res['done']:
+            res['nextRecordsUrl'] = '/services/data/v37.0/tooling/query/%s-%s' % (cursor, end)
+        return res
+
+    def _query(self, soql):
+        match = re.match(r"SELECT Id,Name FROM ApexClass(?: WHERE Name IN \((.*)\))?$", soql)
+        if match:
+            names = self._classes.keys()
+            if match.group(1) is not None:
+                names = [name for name in re.findall(r"'([^']*)'", match.group(1)) if name in self._classes]
+            return self._query_result([{'Id': self._classes[name]['Id'], 'Name': name} for name in names])
+        match = re.match(r"SELECT Id,Name FROM MetadataContainer WHERE Name='(.*)'$", soql)
+        if match:
+            return self._query_result([{'Id': container_id, 'Name': name}
+                                       for container_id, name in self._containers.items()
+                                       if name == match.group(1)])
+        match = re.match(r"SELECT State,ErrorMsg FROM ContainerAsyncRequest WHERE Id='(.*)'$", soql)
+        if match:
+            return self._query_result([{
+                'Id': match.group(1),
+                'State': self._async_requests[match.group(1)]['State'],
+                'ErrorMsg': self._async_requests[match.group(1)]['ErrorMsg']
+            }])
+        match = re.match(r"SELECT Id,SymbolTable FROM ApexClassMember WHERE MetadataContainerId='(.*)'$", soql)
+        if match:
+            records = list()
+            for member_id, member in self._members.items():
+                if member['MetadataContainerId'] == match.group(1):
+                    records.append({'Id': member_id, 'SymbolTable': member['SymbolTable']})
+            return self._query_result(records)
+        raise Exception("Unsupported query: %s" % soql)
+
+    def _create(self, sobject_type, record):
+        if sobject_type == 'MetadataContainer':
+            container_id = self._new_id('1dc')
+            self._containers[container_id] = record['Name']
+            return {'id': container_id, 'success': True, 'errors': []}
+        if sobject_type == 'ApexClassMember':
+            if record['MetadataContainerId'] not in self._containers:
+                return {'success': False, 'errors': [{'message': 'Container does not exist'}]}
+            class_name = self._class_names[record['ContentEntityId']]
+            member_id = self._new_id('400')
+            self._members[member_id] = {
+                'MetadataContainerId': record['MetadataContainerId'],
+                'SymbolTable': None,
+                'ClassName': class_name,
+                'Body': record['Body']
+            }
+            return {'id': member_id, 'success': True, 'errors': []}
+        if sobject_type == 'ContainerAsyncRequest':
+            request_id = self._new_id('1dr')
+            if self._failed_compilations > 0:
+                self._failed_compilations -= 1
+                self._async_requests[request_id] = {'State': 'Failed', 'ErrorMsg': 'Internal error'}
+                return {'id': request_id, 'success': True, 'errors': []}
+            for member in self._members.values():
+                if member['MetadataContainerId'] == record['MetadataContainerId']:
+                    member['SymbolTable'] = self._symbol_table(member['ClassName'], member['Body'])
+            self._async_requests[request_id] = {'State': 'Completed', 'ErrorMsg': None}
+            return {'id': request_id, 'success': True, 'errors': []}
+        raise Exception("Unsupported sObject: %s" % sobject_type)
+
+    def _delete(self, sobject_type, record_id):
+        if sobject_type == 'MetadataContainer':
+            del self._containers[record_id]
+            for member_id in [key for key, member in self._members.items()
+                              if member['MetadataContainerId'] == record_id]:
+                del self._members[member_id]
+            return
+        raise Exception("Unsupported sObject: %s" % sobject_type)
+
+    def handle(self, method, path, body):
+        """ Handles Tooling API request, returns HTTP status and response """
+        url = urlparse(path)
+        match = TOOLING_URI_REG_OBJ.match(url.path)
+        if match is None:
+            return 404, [{'errorCode': 'NOT_FOUND', 'message': path}]
+        uri = match.group(1).rstrip('/')
+        with self._lock:
+            if method == 'GET' and uri == '/query':
+                self.requests['GET query'] += 1
+                return 200, self._query(parse_qs(url.query)['q'][0])
+            if method == 'GET' and uri.startswith('/query/'):
+                self.requests['GET query'] += 1
+                cursor, offset = uri[len('/query/'):].split('-')
+                return 200, self._next_page(cursor, int(offset))
+            if method == 'POST' and uri == '/composite/sobjects':
+                self.requests['POST composite/sobjects'] += 1
+                return 200, [self._create(record['attributes']['type'], record) for record in body['records']]
+            if method == 'POST' and uri.startswith('/sobjects/'):
+                sobject_type = uri.split('/')[2]
+                self.requests['POST sobjects/%s' % sobject_type] += 1
+                return 201, self._create(sobject_type, body)
+            if method == 'DELETE' and uri.startswith('/sobjects/'):
+                sobject_type, record_id = uri.split('/')[2:4]
+                self.requests['DELETE sobjects/%s' % sobject_type] += 1
+                self._delete(sobject_type, record_id)
+                return 204, None
+        return 404, [{'errorCode': 'NOT_FOUND', 'message': path}]
+
+    def _deploy_result(self, deployment_id):
+        deployment = self.deployments[deployment_id]
+        canceled = deployment.get('Canceled', False)
+        if not canceled:
+            deployment['Checks'] += 1
+        checks = min(deployment['Checks'], self._deploy_checks)
+        done = canceled or checks == self._deploy_checks
+        tests = deployment['Tests'][:len(deployment['Tests']) * checks // self._deploy_checks]
+        failed = [test for test in tests if test in self._failing_tests]
+        if canceled:
+            status = 'Canceled'
+        elif not done:
+            status = 'InProgress'
+        else:
+            status = 'Failed' if len(failed) > 0 else 'Succeeded'
+        results = ''.join(
+            "<successes><name>%s</name><methodName>test</methodName><time>%s</time></successes>" % (
+                test, self._test_time) for test in tests if test not in self._failing_tests)
+        results += ''.join(
+            "<failures><name>{test}</name><methodName>test</methodName><time>{time}</time>"
+            "<message>System.AssertException: Assertion Failed</message>"
+            "<stackTrace>Class.{test}.test: line 5, column 1</stackTrace></failures>".format(
+                test=test, time=self._test_time) for test in failed)
+        return """<checkDeployStatusResponse><result>
+<id>{id}</id><status>{status}</status><done>{done}</done><checkOnly>{check_only}</checkOnly>
+<numberComponentsTotal>{components}</numberComponentsTotal><numberComponentErrors>0</numberComponentErrors>
+<numberComponentsDeployed>{deployed}</numberComponentsDeployed>
+<numberTestsTotal>{tests}</numberTestsTotal><numberTestErrors>{failed}</numberTestErrors>
+<numberTestsCompleted>{completed}</numberTestsCompleted>
+<details><runTestResult>{results}</runTestResult></details>
+</result></checkDeployStatusResponse>""".format(
+            id=deployment_id, status=status, done='true' if done else 'false',
+            check_only='true' if deployment['CheckOnly'] else 'false', components=1, deployed=1 if done else 0,
+            tests=len(deployment['Tests']), failed=len(failed), completed=len(tests), results=results)
+
+    def handle_soap(self, api, action, body):
+        """ Handles SOAP API request, returns HTTP status and response """
+        if api == 'c' and action == 'login':
+            self.requests['POST soap/login'] += 1
+            return 200, SOAP_ENVELOPE.format(namespace='urn:enterprise.soap.sforce.com', body=LOGIN_RESULT)
+        root = ET.fromstring(body)
+        with self._lock:
+            self.requests['POST soap/%s' % action] += 1
+            if action == 'deploy':
+                deployment_id = self._new_id('0Af')
+                self.deployments[deployment_id] = {
+                    'Tests': [test.text for test in root.iter('{%s}runTests' % XML_NAMESPACES['met'])],
+                    'CheckOnly': root.find('.//met:checkOnly', XML_NAMESPACES) is not None and
+                    root.find('.//met:checkOnly', XML_NAMESPACES).text == 'True',
+                    'Checks': 0
+                }
+                result = "<deployResponse><result><id>%s</id><state>Queued</state></result></deployResponse>" % (
+                    deployment_id)
+            elif action == 'deployRecentValidation':
+                validation_id = root.find('.//met:validationId', XML_NAMESPACES).text
+                deployment_id = self._new_id('0Af')
+                self.deployments[deployment_id] = dict(self.deployments[validation_id], Tests=list(), Checks=0,
+                                                       CheckOnly=False)
+                result = "<deployRecentValidationResponse><result>%s</result></deployRecentValidationResponse>" % (
+                    deployment_id)
+            elif action == 'cancelDeploy':
+                deployment_id = root.find('.//met:String', XML_NAMESPACES).text
+                self.deployments[deployment_id]['Canceled'] = True
+                result = "<cancelDeployResponse><result><done>false</done><id>%s</id></result>" \
+                         "</cancelDeployResponse>" % deployment_id
+            elif action == 'checkDeployStatus':
+                result = self._deploy_result(root.find('.//met:asyncProcessId', XML_NAMESPACES).text)
+            else:
+                return 500, SOAP_ENVELOPE.format(namespace=XML_NAMESPACES['met'], body=(
+                    "<soapenv:Fault><faultcode>sf:UNKNOWN</faultcode>"
+                    "<faultstring>Unsupported action %s</faultstring></soapenv:Fault>" % action))
+        return 200, SOAP_ENVELOPE.format(namespace=XML_NAMESPACES['met'], body=result)
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length).decode('utf-8') if length else None
+                if mock._latency:
+                    time.sleep(mock._latency)
+                match = SOAP_URI_REG_OBJ.match(urlparse(self.path).path)
+                if match:
+                    status, res = mock.handle_soap(match.group(1), self.headers.get('SOAPAction'), raw)
+                    self._send(status, 'text/xml', res.encode('utf-8'))
+                    return
+                status, res = mock.handle(method, self.path, json.loads(raw) if raw else None)
+                self._send(status, 'application/json', b'' if res is None else json.dumps(res).encode('utf-8'))
+
+            def _send(self, status, content_type, data):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def do_DELETE(self):
+                self._respond('DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,130 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from metamatelib import batch
+from metamatelib.metamate import parse_command_line_args
+
+MANIFEST_YAML = """
+defaults:
+  deploy-zip: deploy.zip
+  check-only: true
+  test-level: RunSpecifiedTests
+  minimize: true
+targets:
+  - name: qa
+    username: user@example.com.qa
+    password: Password
+    sandbox: true
+  - username: user@example.com.uat
+    password: Password
+    check-only: false
+"""
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write_manifest(self, file_name, content):
+        manifest_path = os.path.join(self._dir.name, file_name)
+        with open(manifest_path, 'w') as file:
+            file.write(content)
+        return manifest_path
+
+    def test_load_manifest(self):
+        targets = batch.load_manifest(self._write_manifest('batch.yaml', MANIFEST_YAML))
+        self.assertEqual(['qa', 'user@example.com.uat'], [target['name'] for target in targets])
+        self.assertTrue(targets[0]['check-only'])
+        self.assertFalse(targets[1]['check-only'])
+
+        targets = batch.load_manifest(self._write_manifest('batch.json', json.dumps({
+            'targets': [{'username': 'user@example.com.qa', 'password': 'Password'}]
+        })))
+        self.assertEqual('user@example.com.qa', targets[0]['name'])
+
+    def test_load_manifest_duplicate_username(self):
+        manifest_path = self._write_manifest('batch.json', json.dumps({
+            'targets': [{'name': 'qa1', 'username': 'user@example.com.qa'},
+                        {'name': 'qa2', 'username': 'user@example.com.qa'}]
+        }))
+        with self.assertRaises(Exception):
+            batch.load_manifest(manifest_path)
+
+    def test_target_args(self):
+        targets = batch.load_manifest(self._write_manifest('batch.yaml', MANIFEST_YAML))
+        cmd = batch.BatchCommand(argparse.Namespace(), None, parse_command_line_args)
+        args = [cmd._target_args(target) for target in targets]
+        self.assertEqual('user@example.com.qa', args[0].username)
+        self.assertTrue(args[0].sandbox)
+        self.assertTrue(args[0].check_only)
+        self.assertFalse(args[1].check_only)
+        self.assertEqual('RunSpecifiedTests', args[1].test_level)
+        self.assertEqual(['deploy-qa-minimized.zip', 'deploy-user@example.com.uat-minimized.zip'],
+                         [target_args.minimized_zip for target_args in args])
+
+    def test_shared_sources(self):
+        shared = batch.SharedSources()
+        calls = list()
+        barrier = threading.Barrier(4)
+
+        def scan(source_dir, workers=None, log=None):
+            calls.append(source_dir)
+            return {'Service': {'IsTest': False}}
+
+        def run():
+            barrier.wait()
+            results.append(shared.scan_source_dir('src'))
+
+        results = list()
+        with mock.patch('metamatelib.batch.scan_classes', scan):
+            threads = [threading.Thread(target=run) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(['src'], calls)
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_run(self):
+        manifest_path = self._write_manifest('batch.yaml', MANIFEST_YAML)
+        states = {'user@example.com.qa': True, 'user@example.com.uat': False}
+
+        class FakeDeployCommand:
+            def __init__(self, args, log, shared):
+                self._args = args
+                self._log = log
+                self.unit_tests_to_run = ['ServiceTest']
+
+            def run(self):
+                self._log.inf("Deploying")
+                return states[self._args.username]
+
+        out = io.StringIO()
+        with mock.patch('metamatelib.batch.DeployCommand', FakeDeployCommand), redirect_stdout(out):
+            cmd = batch.BatchCommand(argparse.Namespace(manifest=manifest_path, workers=None),
+                                     batch.PrefixedLogger('batch'), parse_command_line_args)
+            self.assertFalse(cmd.run())
+        output = out.getvalue()
+        self.assertIn('[qa] Deploying', output)
+        self.assertIn('[user@example.com.uat] Deploying', output)
+        self.assertIn('1 of 2 target(s) failed', output)
+
+        states['user@example.com.uat'] = True
+        with mock.patch('metamatelib.batch.DeployCommand', FakeDeployCommand), redirect_stdout(io.StringIO()):
+            self.assertTrue(cmd.run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import copy
+import unittest
+
+from benchmarks import run_benchmarks
+from benchmarks.synthetic_org import changed_class_names, generate_classes
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def test_generate_classes(self):
+        classes = generate_classes(5)
+        self.assertEqual(['Service00000', 'Service00000Test', 'Service00001', 'Service00001Test'],
+                         sorted(classes.keys())[:4])
+        self.assertEqual(4, len(classes))
+        self.assertIn('new Service00001()', classes['Service00000'])
+        self.assertEqual(['Service00000'], changed_class_names(classes, 0.01))
+
+    def test_run_size(self):
+        args = run_benchmarks.parse_args(['--sizes', '20', '--repeat', '2'])
+        results = run_benchmarks.run_size(args, 20)
+        self.assertEqual(['cold', 'warm'], sorted(results.keys()))
+        self.assertEqual(1, results['cold']['Tests'])
+        self.assertIn('upload_members', results['cold']['Phases'])
+        # Warm run takes symbol tables from local cache
+        self.assertNotIn('upload_members', results['warm']['Phases'])
+        self.assertLess(results['warm']['Requests'], results['cold']['Requests'])
+
+    def test_find_regressions(self):
+        baseline = {'Results': {'1000': {'cold': {'Time': 2.0, 'Phases': {'scan': 1.0, 'login': 0.01},
+                                                  'Requests': 14}}}}
+        results = copy.deepcopy(baseline)
+        results['Results']['1000']['cold']['Phases']['login'] = 0.1
+        # Phases added after baseline was recorded are not compared
+        results['Results']['1000']['cold']['Phases']['metadata_references'] = 0.5
+        self.assertEqual([], run_benchmarks.find_regressions(results, baseline, 0.25))
+
+        results['Results']['1000']['cold']['Phases']['scan'] = 1.5
+        results['Results']['1000']['cold']['Requests'] = 15
+        self.assertEqual([
+            '1000 classes, cold run: scan took 1.50 s, baseline 1.00 s',
+            '1000 classes, cold run: 15 requests sent, baseline 14'
+        ], run_benchmarks.find_regressions(results, baseline, 0.25))
+
+        # Baseline recorded on a machine twice as fast is scaled, request counts are still compared
+        baseline['Calibration'] = 0.5
+        results['Calibration'] = 1.0
+        self.assertEqual(['1000 classes, cold run: 15 requests sent, baseline 14'],
+                         run_benchmarks.find_regressions(results, baseline, 0.25))
+
+    def test_combine_runs(self):
+        runs = [{'Time': time, 'Phases': {'scan': time / 2}, 'Requests': requests, 'Throughput': {'scan': 10 / time},
+                 'Tests': 1} for time, requests in [(1.0, 12), (5.0, 12), (2.0, 13)]]
+        self.assertEqual({'Time': 2.0, 'Phases': {'scan': 1.0}, 'Requests': 13, 'Throughput': {'scan': 5.0},
+                          'Tests': 1}, run_benchmarks.combine_runs(runs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import gzip
+import os
+import unittest
+
+from sfdclib import SfdcLogger
+
+from metamatelib import cache_bundle
+from metamatelib.cache_command import CacheCommand
+from metamatelib.dependency_finder import hash_class_body
+from metamatelib.metamate import parse_command_line_args
+from metamatelib.metamatecache import MetamateCache
+from metamatelib.test_sharding import TEST_RUNTIMES_FILE_NAME
+from tests.mock_salesforce import use_temporary_home
+
+CLASSES = {
+    'RealClassTest': '@isTest\nprivate class RealClassTest {\n    RealClass c;\n}',
+    'TestableClassTest': '@isTest\nprivate class TestableClassTest {\n    TestableClass c;\n}'
+}
+
+
+def class_data(class_name, body, references):
+    return {'Id': '01p%s' % class_name, 'References': references, 'Hash': hash_class_body(body),
+            'ApiVersion': '45.0'}
+
+
+class CacheBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self._home = use_temporary_home(self)
+        self._source_dir = os.path.join(self._home, 'src')
+        os.makedirs(os.path.join(self._source_dir, 'classes'))
+        for name, body in CLASSES.items():
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+        self._bundle_path = os.path.join(self._home, 'cache.json.gz')
+
+    def _cache(self, username):
+        cache = MetamateCache(username)
+        cache.load()
+        self.addCleanup(cache.close)
+        return cache
+
+    def _run(self, *argv):
+        self.assertTrue(CacheCommand(parse_command_line_args(['cache'] + list(argv)), SfdcLogger(0)).run())
+
+    def test_export_and_import(self):
+        cache = self._cache('main@example.com')
+        cache.add_classes_data({
+            'RealClassTest': class_data('RealClassTest', CLASSES['RealClassTest'], ['RealClass']),
+            # Cached for older version of the class
+            'TestableClassTest': class_data('TestableClassTest', '@isTest class TestableClassTest {}', []),
+            'LegacyTest': {'Id': '01pLegacyTest', 'References': []}
+        })
+        cache.save_json(TEST_RUNTIMES_FILE_NAME, {'RealClassTest': {'Time': 100.0, 'Recorded': 2.0}})
+        self._run('export', '--username', 'main@example.com', '--output', self._bundle_path)
+        bundle = cache_bundle.read_bundle(self._bundle_path)
+        self.assertEqual(['RealClassTest', 'TestableClassTest'], sorted(bundle['Classes']))
+        self.assertEqual(['45.0'], bundle['ApiVersions'])
+
+        self._run('export', '--username', 'main@example.com', '--output', self._bundle_path,
+                  '--source-dir', self._source_dir)
+        self.assertEqual(['RealClassTest'], sorted(cache_bundle.read_bundle(self._bundle_path)['Classes']))
+
+        local = self._cache('pr@example.com')
+        local.add_class_data('TestableClassTest', class_data(
+            'TestableClassTest', CLASSES['TestableClassTest'], ['TestableClass']))
+        local.save_json(TEST_RUNTIMES_FILE_NAME, {'RealClassTest': {'Time': 300.0, 'Recorded': 1.0},
+                                                  'TestableClassTest': {'Time': 50.0, 'Recorded': 1.0}})
+        self._run('import', '--username', 'pr@example.com', '--input', self._bundle_path)
+
+        local = self._cache('pr@example.com')
+        self.assertEqual(['RealClassTest', 'TestableClassTest'], sorted(local.class_names()))
+        self.assertEqual(['RealClass'], local.get_class_data('RealClassTest')['References'])
+        self.assertEqual(['TestableClass'], local.get_class_data('TestableClassTest')['References'])
+        self.assertEqual({'RealClassTest': {'Time': 100.0, 'Recorded': 2.0},
+                          'TestableClassTest': {'Time': 50.0, 'Recorded': 1.0}},
+                         local.load_json(TEST_RUNTIMES_FILE_NAME))
+
+    def test_select_imported_classes(self):
+        source_hashes = dict((name, hash_class_body(body)) for name, body in CLASSES.items())
+        current = class_data('RealClassTest', CLASSES['RealClassTest'], ['RealClass'])
+        stale = class_data('RealClassTest', '@isTest class RealClassTest {}', [])
+        bundle = {'Classes': {'RealClassTest': current}}
+
+        cache = self._cache('pr@example.com')
+        cache.add_class_data('RealClassTest', stale)
+        # Local entries win unless source shows they are stale
+        self.assertEqual({}, cache_bundle.select_imported_classes(bundle, cache))
+        self.assertEqual({'RealClassTest': current},
+                         cache_bundle.select_imported_classes(bundle, cache, source_hashes))
+        self.assertEqual({}, cache_bundle.select_imported_classes(
+            {'Classes': {'RealClassTest': stale}}, cache, source_hashes))
+
+    def test_invalid_bundle(self):
+        with open(self._bundle_path, 'wb') as file:
+            file.write(b'not a bundle')
+        with self.assertRaisesRegex(Exception, 'Could not read cache bundle'):
+            cache_bundle.read_bundle(self._bundle_path)
+        with open(self._bundle_path, 'wb') as file:
+            file.write(gzip.compress(b'{"Format": "metamate-cache-bundle", "Version": 2, "Classes": {}}'))
+        with self.assertRaisesRegex(Exception, 'newer version'):
+            cache_bundle.read_bundle(self._bundle_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,22 @@
+import os
+import tempfile
 import unittest
+
+from sfdclib import SfdcLogger
+
 from metamatelib import dependency_finder
+from metamatelib.metrics import Metrics
+from metamatelib.poller import Poller
+from tests.mock_salesforce import MockSalesforce
+
+CLASSES = {
+    'RealClass': 'public class RealClass {}',
+    'RealClassTest': '@isTest\nprivate class RealClassTest {\n    RealClass c = new RealClass();\n}',
+    'TestableClass': 'public class TestableClass {}',
+    'TestableClassTest': '@isTest\nprivate class TestableClassTest {\n    TestableClass c;\n}',
+    'UnrealClass': 'public class UnrealClass {}',
+    'UnrealClassTest': '@isTest\nprivate class UnrealClassTest {\n    UnrealClass c;\n    RealClass r;\n}'
+}
 
 
 class DependencyFinderTest(unittest.TestCase):
@@ -24,5 +41,110 @@ class DependencyFinderTest(unittest.TestCase):
             dependency_finder.reverse_class_dependencies(dependencies)
         )
 
+    def test_is_cache_entry_valid(self):
+        class_hash = dependency_finder.hash_class_body('@isTest class RealClassTest {}')
+        data = {
+            'Id': '01pU00000026druIAA',
+            'References': ['RealClass'],
+            'Hash': class_hash,
+            'ApiVersion': '37.0'
+        }
+        self.assertTrue(dependency_finder.is_cache_entry_valid(data, class_hash, '37.0'))
+        self.assertFalse(dependency_finder.is_cache_entry_valid(data, class_hash, '38.0'))
+        self.assertFalse(dependency_finder.is_cache_entry_valid(
+            data, dependency_finder.hash_class_body('@isTest class RealClassTest { }'), '37.0'))
+        # Entries cached before hashes were introduced are always stale
+        self.assertFalse(dependency_finder.is_cache_entry_valid(
+            {'Id': '01pU00000026druIAA', 'References': []}, class_hash, '37.0'))
+        self.assertFalse(dependency_finder.is_cache_entry_valid(None, class_hash, '37.0'))
+
+    def test_run_concurrently_keeps_order(self):
+        for max_workers in [1, 4]:
+            self.assertEqual(
+                [1, 4, 9, 16],
+                list(dependency_finder.run_concurrently(lambda x: x * x, [1, 2, 3, 4], max_workers)))
+
+    def test_split_names_into_queries(self):
+        query = "SELECT Id FROM ApexClass WHERE Name IN ('{0}')"
+        self.assertEqual([query.format('LongName'), query.format("B','C")],
+                         dependency_finder.split_names_into_queries(query, ['LongName', 'B', 'C'], len(query) + 11))
+        names = ['Class%05d' % i for i in range(5000)]
+        queries = dependency_finder.split_names_into_queries(query, names)
+        self.assertTrue(all(len(q) <= dependency_finder.QUERY_MAX_LENGTH for q in queries))
+        self.assertEqual(names, [name for q in queries for name in q[q.index('(') + 2:-2].split("','")])
+
+    def _retrieve_test_class_dependencies(self, api_version, max_workers, failed_compilations=0, **kwargs):
+        source_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(source_dir.cleanup)
+        os.makedirs(os.path.join(source_dir.name, 'classes'))
+        for name, body in CLASSES.items():
+            with open(os.path.join(source_dir.name, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+        mock = MockSalesforce(CLASSES, query_batch_size=2, failed_compilations=failed_compilations).start()
+        self.addCleanup(mock.stop)
+        session = mock.session(api_version)
+        apex_classes = dependency_finder.retrieve_apex_classes(
+            session, ['RealClassTest', 'TestableClassTest', 'UnrealClassTest'])
+        classes = dict((class_id, class_name) for class_name, class_id in apex_classes.items())
+        dependencies = dependency_finder.retrieve_class_dependencies(
+            SfdcLogger(0), session, classes, source_dir.name, max_workers, poller=Poller(0), **kwargs)
+        self.assertEqual(
+            {
+                'RealClass': ['RealClassTest', 'UnrealClassTest'],
+                'TestableClass': ['TestableClassTest'],
+                'UnrealClass': ['UnrealClassTest']
+            },
+            dependency_finder.reverse_class_dependencies(dependencies))
+        self.assertEqual(dependency_finder.hash_class_body(CLASSES['RealClassTest']),
+                         dependencies['RealClassTest']['Hash'])
+        self.assertEqual(api_version, dependencies['RealClassTest']['ApiVersion'])
+        return mock.requests
+
+    def test_retrieve_class_dependencies(self):
+        requests = self._retrieve_test_class_dependencies('37.0', 2)
+        self.assertEqual(3, requests['POST sobjects/ApexClassMember'])
+        self.assertEqual(0, requests['POST composite/sobjects'])
+
+    def test_retrieve_class_dependencies_with_collections(self):
+        requests = self._retrieve_test_class_dependencies('45.0', 1)
+        self.assertEqual(0, requests['POST sobjects/ApexClassMember'])
+        self.assertEqual(1, requests['POST composite/sobjects'])
+
+    def test_retrieve_class_dependencies_in_chunks(self):
+        requests = self._retrieve_test_class_dependencies(
+            '45.0', 1, failed_compilations=1, container_size=2, retries=1)
+        # First chunk fails once and is compiled again on its own
+        self.assertEqual(3, requests['POST sobjects/ContainerAsyncRequest'])
+        self.assertEqual(3, requests['DELETE sobjects/MetadataContainer'])
+
+    def test_failed_compilation_is_not_recorded_as_unresolved(self):
+        source_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(source_dir.cleanup)
+        os.makedirs(os.path.join(source_dir.name, 'classes'))
+        with open(os.path.join(source_dir.name, 'classes', 'RealClassTest.cls'), 'w') as file:
+            file.write(CLASSES['RealClassTest'])
+        mock = MockSalesforce(CLASSES, failed_compilations=1).start()
+        self.addCleanup(mock.stop)
+        session = mock.session('45.0')
+        apex_classes = dependency_finder.retrieve_apex_classes(session, ['RealClassTest'])
+        dependencies = dependency_finder.retrieve_class_dependencies(
+            SfdcLogger(0), session, {apex_classes['RealClassTest']: 'RealClassTest'}, source_dir.name,
+            poller=Poller(0), retries=0)
+        # Class is compiled again by the next run
+        self.assertEqual({}, dependencies)
+        self.assertEqual(['ATest'], dependency_finder.select_unresolved_classes({
+            'ATest': dependency_finder.unresolved_class_data('hash', '45.0'),
+            'BTest': {'Id': '01p', 'References': [], 'Hash': 'hash', 'ApiVersion': '45.0'}}))
+
+    def test_retrieve_class_dependencies_metrics(self):
+        metrics = Metrics()
+        self._retrieve_test_class_dependencies('45.0', 1, container_size=2, metrics=metrics)
+        report = metrics.report()
+        self.assertEqual(3, report['Counters']['classes_compiled'])
+        self.assertEqual(2, report['Phases']['upload_members']['Count'])
+        self.assertEqual(2, report['Phases']['compile_wait']['Count'])
+        self.assertEqual(2, report['Phases']['symbol_tables']['Count'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from metamatelib import dependency_finder
+from metamatelib.dependency_graph import build_reverse_index
+
+DEPENDENCIES = {
+    'FacadeTest': {'References': ['ServiceFacade']},
+    'ServiceFacade': {'References': ['ServiceImpl', 'Utils']},
+    'ServiceImpl': {'References': ['Utils']},
+    'RealClassTest': {'References': ['RealClass', 'Utils']},
+    'RealClass': {'References': ['Utils']},
+    'UtilsTest': {'References': ['Utils']},
+    'Utils': {'References': []}
+}
+TEST_CLASSES = ['FacadeTest', 'RealClassTest', 'UtilsTest']
+
+
+class DependencyGraphTest(unittest.TestCase):
+
+    def test_transitive_dependants(self):
+        reverse_index = build_reverse_index(DEPENDENCIES, TEST_CLASSES)
+        self.assertEqual(['FacadeTest'], reverse_index['ServiceImpl'])
+        self.assertEqual(['FacadeTest'], reverse_index['ServiceFacade'])
+        self.assertEqual(['FacadeTest', 'RealClassTest', 'UtilsTest'], reverse_index['Utils'])
+        self.assertNotIn('FacadeTest', reverse_index)
+
+    def test_depth_one_matches_direct_dependants(self):
+        test_dependencies = dict((name, DEPENDENCIES[name]) for name in TEST_CLASSES)
+        self.assertEqual(
+            dependency_finder.reverse_class_dependencies(test_dependencies),
+            build_reverse_index(DEPENDENCIES, TEST_CLASSES, max_depth=1))
+
+    def test_changes_are_not_propagated_through_hubs(self):
+        reverse_index = build_reverse_index(DEPENDENCIES, TEST_CLASSES, max_fanout=2)
+        # Utils has four dependants, only tests referencing it directly are selected
+        self.assertEqual(['RealClassTest', 'UtilsTest'], reverse_index['Utils'])
+        self.assertEqual(['FacadeTest'], reverse_index['ServiceImpl'])
+
+    def test_cycles(self):
+        dependencies = {
+            'ATest': {'References': ['A']},
+            'A': {'References': ['B']},
+            'B': {'References': ['A']}
+        }
+        self.assertEqual({'A': ['ATest'], 'B': ['ATest']}, build_reverse_index(dependencies, ['ATest']))
+
+
+if __name__ == '__main__':
+    unittest.main()
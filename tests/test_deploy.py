@@ -0,0 +1,212 @@
+import argparse
+import os
+import time
+import unittest
+from unittest import mock
+from xml.etree import ElementTree as ET
+from zipfile import ZipFile
+
+from benchmarks.synthetic_org import generate_org
+from metamatelib.deploy import DeployCommand
+from metamatelib.deploy_package import DeployPackage
+from metamatelib.metamate import parse_command_line_args
+from metamatelib.metamatecache import MetamateCache
+from metamatelib.package_minimizer import DEPLOYED_HASHES_FILE_NAME
+from metamatelib.test_sharding import \
+    TEST_RUNTIMES_FILE_NAME, \
+    update_test_runtimes
+from sfdclib import SfdcLogger
+from tests.mock_salesforce import MockSalesforce, mock_command, use_temporary_home
+
+
+class FakeMetadataApi:
+    def __init__(self, rejected=False):
+        self.rejected = rejected
+        self.validation_ids = list()
+
+    def deploy_recent_validation(self, validation_id):
+        self.validation_ids.append(validation_id)
+        if self.rejected:
+            raise Exception("Validation is not eligible for quick deploy")
+        return '0Af000000000002'
+
+
+class DeployCommandQuickDeployTest(unittest.TestCase):
+
+    def setUp(self):
+        zip_path = os.path.join(use_temporary_home(self), 'deploy.zip')
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('package.xml', '<Package xmlns="http://soap.sforce.com/2006/04/metadata"/>')
+        self._cmd = DeployCommand(argparse.Namespace(
+            check_only=False, test_level='RunSpecifiedTests', quick_deploy_max_age=240.0), SfdcLogger(0))
+        self._cmd._cache = MetamateCache('user@example.com')
+        self._cmd._cache.load()
+        self._cmd._deploy_package = DeployPackage(zip_path)
+
+    def tearDown(self):
+        self._cmd._cache.close()
+
+    def _record_validation(self, package_hash, recorded, test_level='RunSpecifiedTests'):
+        self._cmd._cache.save_json(DeployCommand.VALIDATIONS_FILE_NAME, {
+            package_hash: {'Id': '0Af000000000001', 'Recorded': recorded, 'TestLevel': test_level}
+        })
+
+    def test_quick_deploy(self):
+        self._record_validation(self._cmd._deploy_package.hash, time.time())
+        self._cmd._mapi = FakeMetadataApi()
+        with mock.patch.object(DeployCommand, '_wait_for_deployment_to_finish') as wait:
+            def finish():
+                self._cmd._deployment_state = 'Succeeded'
+            wait.side_effect = finish
+            self.assertTrue(self._cmd._quick_deploy())
+        self.assertEqual(['0Af000000000001'], self._cmd._mapi.validation_ids)
+        self.assertEqual('0Af000000000002', self._cmd._deployment_id)
+
+    def test_fall_back_to_normal_deploy(self):
+        self._cmd._mapi = FakeMetadataApi()
+        self._record_validation('other-package-hash', time.time())
+        self.assertIsNone(self._cmd._quick_deploy())
+
+        self._record_validation(self._cmd._deploy_package.hash, time.time() - 241 * 3600)
+        self.assertIsNone(self._cmd._quick_deploy())
+        self.assertEqual([], self._cmd._mapi.validation_ids)
+
+        # Validation which ran fewer tests than requested cannot be quick deployed
+        self._record_validation(self._cmd._deploy_package.hash, time.time())
+        self._cmd._test_level = 'RunLocalTests'
+        self.assertIsNone(self._cmd._quick_deploy())
+        self.assertEqual([], self._cmd._mapi.validation_ids)
+        self._cmd._test_level = 'RunSpecifiedTests'
+
+        self._record_validation(self._cmd._deploy_package.hash, time.time())
+        self._cmd._mapi = FakeMetadataApi(rejected=True)
+        self.assertIsNone(self._cmd._quick_deploy())
+        self.assertEqual(['0Af000000000001'], self._cmd._mapi.validation_ids)
+
+
+class DeployCommandShardingTest(unittest.TestCase):
+    TESTS = ['ATest', 'BTest', 'CTest', 'DTest']
+
+    def setUp(self):
+        use_temporary_home(self)
+
+    def _shard(self, username, shard_index):
+        cmd = DeployCommand(argparse.Namespace(
+            check_only=True, test_level='RunSpecifiedTests', shards=2, shard_index=shard_index), SfdcLogger(0))
+        cmd._cache = MetamateCache(username)
+        cmd._cache.load()
+        self.addCleanup(cmd._cache.close)
+        cmd._unit_tests_to_run = list(self.TESTS)
+        return cmd
+
+    def test_shards_run_by_separate_processes_cover_all_tests(self):
+        first = self._shard('user@example.com.qa1', 1)
+        first_tests = first._split_unit_tests_into_shards()[0]
+        self.assertEqual(['ATest', 'CTest'], first_tests)
+        # Run times recorded by the first shard would change the split
+        first._cache.update_json(TEST_RUNTIMES_FILE_NAME, lambda runtimes: update_test_runtimes(
+            runtimes, {'ATest': 5000.0, 'CTest': 100.0}), dict())
+
+        second_tests = self._shard('user@example.com.qa2', 2)._split_unit_tests_into_shards()[0]
+        self.assertEqual(self.TESTS, sorted(first_tests + second_tests))
+
+
+class DeployCommandStreamingTest(unittest.TestCase):
+    TESTS = ['Service00000Test', 'Service00001Test', 'Service00002Test']
+
+    def setUp(self):
+        self._home = use_temporary_home(self)
+        self._classes, self._source_dir, self._deploy_zip = generate_org(self._home, 6, changed_ratio=1.0)
+        self._junit_file = os.path.join(self._home, 'junit.xml')
+
+    def _deploy(self, failing_tests, *argv):
+        self._mock = MockSalesforce(self._classes, deploy_checks=3, failing_tests=failing_tests).start()
+        self.addCleanup(self._mock.stop)
+        args = parse_command_line_args([
+            'deploy', '--username', 'user@example.com', '--password', 'Password', '--check-only',
+            '--deploy-zip', self._deploy_zip, '--source-dir', self._source_dir, '--test-level', 'RunSpecifiedTests',
+            '--version', '45.0', '--poll-interval', '0', '--poll-max-interval', '0',
+            '--junit-file', self._junit_file] + list(argv))
+        cmd = mock_command(DeployCommand, args, SfdcLogger(0), self._mock)
+        return cmd, cmd.run()
+
+    def _read_junit(self):
+        root = ET.parse(self._junit_file).getroot()
+        return int(root.get('tests')), int(root.get('failures'))
+
+    def test_stream_failures(self):
+        cmd, succeeded = self._deploy(self.TESTS[:2])
+        self.assertFalse(succeeded)
+        self.assertEqual('Failed', cmd._deployment_state)
+        self.assertEqual(set(('test', test, 'test') for test in self.TESTS[:2]), cmd._reported_failures)
+        self.assertEqual((3, 2), self._read_junit())
+        self.assertEqual(0, self._mock.requests['POST soap/cancelDeploy'])
+
+    def test_fail_fast(self):
+        cmd, succeeded = self._deploy(self.TESTS, '--fail-fast', '1')
+        self.assertFalse(succeeded)
+        self.assertEqual('Canceled', cmd._deployment_state)
+        self.assertEqual(1, self._mock.requests['POST soap/cancelDeploy'])
+        self.assertTrue(self._mock.deployments[cmd._deployment_id]['Canceled'])
+        # Only the first of three status checks ran a test
+        self.assertEqual((1, 1), self._read_junit())
+
+    def test_passing_tests(self):
+        cmd, succeeded = self._deploy(list(), '--fail-fast', '1')
+        self.assertTrue(succeeded)
+        self.assertEqual((3, 0), self._read_junit())
+        self.assertEqual(0, self._mock.requests['POST soap/cancelDeploy'])
+
+
+class DeployCommandMinimizeTest(unittest.TestCase):
+    PACKAGE_XML = """<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+{types}<version>45.0</version></Package>"""
+
+    def setUp(self):
+        self._home = use_temporary_home(self)
+        self._mock = MockSalesforce(dict()).start()
+        self.addCleanup(self._mock.stop)
+
+    def _deploy(self, classes, destructive=None):
+        zip_path = os.path.join(self._home, 'deploy.zip')
+        types = ''.join('<types><members>%s</members><name>ApexClass</name></types>' % name for name in classes)
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('package.xml', self.PACKAGE_XML.format(types=types))
+            for name in classes:
+                zipfile.writestr('classes/%s.cls' % name, 'public class %s {}' % name)
+                zipfile.writestr('classes/%s.cls-meta.xml' % name, '<ApexClass/>')
+            if destructive is not None:
+                zipfile.writestr('destructiveChanges.xml', self.PACKAGE_XML.format(
+                    types='<types><members>%s</members><name>ApexClass</name></types>' % destructive))
+        args = parse_command_line_args([
+            'deploy', '--username', 'user@example.com', '--password', 'Password', '--deploy-zip', zip_path,
+            '--minimize', '--version', '45.0', '--poll-interval', '0', '--poll-max-interval', '0'])
+        cmd = mock_command(DeployCommand, args, SfdcLogger(0), self._mock)
+        self.assertTrue(cmd.run())
+        return cmd
+
+    def test_destructive_changes_are_deployed(self):
+        self._deploy(['Service', 'Legacy'])
+        self._deploy(['Service', 'Legacy'])
+        self.assertEqual(1, self._mock.requests['POST soap/deploy'])
+
+        # Destructive manifest is deployed even when no listed component changed
+        cmd = self._deploy(['Service'], destructive='Legacy')
+        self.assertEqual(2, self._mock.requests['POST soap/deploy'])
+        self.assertEqual(['destructiveChanges.xml', 'package.xml'], cmd._deploy_package.file_names())
+        self.assertEqual({}, cmd._deploy_package.members)
+        deployed_hashes = cmd._cache.load_json(DEPLOYED_HASHES_FILE_NAME, dict())
+        self.assertEqual(['ApexClass/Service'], sorted(deployed_hashes.keys()))
+
+        # Deleted class is deployed again when it is added back
+        self._deploy(['Service', 'Legacy'])
+        self.assertEqual(3, self._mock.requests['POST soap/deploy'])
+
+        # Package containing only destructive manifest
+        cmd = self._deploy([], destructive='Service')
+        self.assertEqual(4, self._mock.requests['POST soap/deploy'])
+        self.assertEqual(['destructiveChanges.xml', 'package.xml'], cmd._deploy_package.file_names())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from metamatelib.deploy_package import DeployPackage
+
+CLASS_META_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ApexClass xmlns="http://soap.sforce.com/2006/04/metadata">
+    <apiVersion>37.0</apiVersion>
+    <status>Active</status>
+</ApexClass>"""
+
+PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <types>
+        <members>%s</members>
+        <name>ApexClass</name>
+    </types>
+    <types>
+        <members>Account</members>
+        <name>CustomObject</name>
+    </types>
+    <version>37.0</version>
+</Package>"""
+
+
+class DeployPackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._source_dir = os.path.join(self._dir.name, 'src')
+        os.makedirs(os.path.join(self._source_dir, 'classes'))
+        with open(os.path.join(self._source_dir, 'classes', 'ServiceTest.cls'), 'w') as file:
+            file.write('@isTest\nprivate class ServiceTest {}')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write_zip(self, members):
+        zip_path = os.path.join(self._dir.name, 'deploy.zip')
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('deploy/package.xml', PACKAGE_XML % members)
+            zipfile.writestr('deploy/classes/Service.cls', 'public class Service {}')
+            zipfile.writestr('deploy/classes/Service.cls-meta.xml', CLASS_META_XML)
+            zipfile.writestr('deploy/classes/NewServiceTest.cls', '@isTest\nprivate class NewServiceTest {}')
+            zipfile.writestr('deploy/classes/NewServiceTest.cls-meta.xml', CLASS_META_XML)
+        return zip_path
+
+    def test_members(self):
+        package = DeployPackage(self._write_zip('Service</members><members>NewServiceTest'))
+        self.assertEqual({'ApexClass': ['Service', 'NewServiceTest'], 'CustomObject': ['Account']}, package.members)
+        self.assertEqual(['Service', 'NewServiceTest'], package.class_objects())
+        with package.open() as file:
+            self.assertEqual(package.data, file.read())
+
+    def test_wildcard(self):
+        package = DeployPackage(self._write_zip('*'))
+        self.assertEqual(['NewServiceTest', 'Service'], package.class_objects())
+
+    def test_scan_classes(self):
+        scan = DeployPackage(self._write_zip('*')).scan_classes()
+        self.assertEqual(['NewServiceTest', 'Service'], sorted(scan.keys()))
+        self.assertTrue(scan['NewServiceTest']['IsTest'])
+        self.assertFalse(scan['Service']['IsTest'])
+        self.assertTrue(scan['Service']['IsActive'])
+
+    def test_read_class_body(self):
+        zip_path = self._write_zip('*')
+        package = DeployPackage(zip_path, self._source_dir)
+        self.assertEqual('public class Service {}', package.read_class_body('Service'))
+        self.assertEqual('@isTest\nprivate class ServiceTest {}', package.read_class_body('ServiceTest'))
+        with self.assertRaises(Exception):
+            DeployPackage(zip_path).read_class_body('ServiceTest')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from metamatelib import git_diff
+
+
+class GitDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self._repo = tempfile.TemporaryDirectory()
+        self._source_dir = os.path.join(self._repo.name, 'src')
+        os.makedirs(os.path.join(self._source_dir, 'classes'))
+        self._git('init', '-q')
+        for name in ['RealClass', 'RealClassTest', 'UnrealClass']:
+            self._write('classes/%s.cls' % name, 'public class %s {}' % name)
+            self._write('classes/%s.cls-meta.xml' % name, '<status>Active</status>')
+        self._write('package.xml', '<Package/>')
+        self._git('add', '-A')
+        self._git('-c', 'user.name=metamate', '-c', 'user.email=metamate@example.com', 'commit', '-q', '-m', 'init')
+
+    def tearDown(self):
+        self._repo.cleanup()
+
+    def _git(self, *args):
+        subprocess.check_call(['git', '-C', self._repo.name] + list(args))
+
+    def _write(self, file_path, content):
+        with open(os.path.join(self._source_dir, file_path), 'w') as file:
+            file.write(content)
+
+    def test_find_changed_class_objects(self):
+        base = git_diff.get_head_commit(self._source_dir)
+        self.assertIsNotNone(base)
+        self._write('classes/RealClass.cls', 'public class RealClass { }')
+        self._write('classes/UnrealClass.cls-meta.xml', '<status>Deleted</status>')
+        self._write('classes/NewClass.cls', 'public class NewClass {}')
+        self._write('package.xml', '<Package></Package>')
+        os.remove(os.path.join(self._source_dir, 'classes', 'RealClassTest.cls'))
+        self.assertEqual(
+            (['NewClass', 'RealClass', 'UnrealClass'], ['RealClassTest']),
+            git_diff.find_changed_class_objects(self._source_dir, base))
+
+    def test_get_head_commit_outside_repository(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.assertIsNone(git_diff.get_head_commit(directory.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from xml.etree import ElementTree as ET
+
+from metamatelib.junit_report import build_junit_xml
+
+
+class JunitReportTest(unittest.TestCase):
+
+    def test_build_junit_xml(self):
+        root = ET.fromstring(build_junit_xml([
+            {'class': 'BTest', 'method': 'test', 'time': 1500.0, 'message': None, 'stack_trace': None,
+             'failed': False},
+            {'class': 'ATest', 'method': 'test', 'time': 30.0, 'message': 'Assertion Failed',
+             'stack_trace': 'Class.ATest.test: line 5', 'failed': True}
+        ], [
+            {'type': 'ApexClass', 'file': 'classes/Broken.cls', 'status': 'Error', 'message': 'Unexpected token'}
+        ]))
+        self.assertEqual(('3', '2'), (root.get('tests'), root.get('failures')))
+        self.assertEqual(['ATest', 'BTest', 'Deployment'], [suite.get('name') for suite in root])
+        failure = root.find("testsuite[@name='ATest']/testcase/failure")
+        self.assertEqual('Assertion Failed', failure.get('message'))
+        self.assertEqual('Class.ATest.test: line 5', failure.text)
+        self.assertEqual('1.500', root.find("testsuite[@name='BTest']/testcase").get('time'))
+        self.assertIsNone(root.find("testsuite[@name='BTest']/testcase/failure"))
+        component = root.find("testsuite[@name='Deployment']/testcase")
+        self.assertEqual(('classes/Broken.cls', 'ApexClass'), (component.get('name'), component.get('classname')))
+        self.assertEqual('Error: Unexpected token', component.find('failure').text)
+
+
+if __name__ == '__main__':
+    unittest.main()
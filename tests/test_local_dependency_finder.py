@@ -0,0 +1,51 @@
+import unittest
+
+from metamatelib import local_dependency_finder
+
+SCAN = {
+    'RealClass': {'ClassNames': ['RealClass', 'Helper'], 'Hash': None},
+    'RealClassTest': {'ClassNames': ['RealClassTest'], 'Hash': None},
+    'UnrealClass': {'ClassNames': ['UnrealClass'], 'Hash': None}
+}
+BODY = """@isTest
+private class RealClassTest {
+    // UnrealClass is not used anymore
+    /* neither is
+       UnrealClass */
+    static testMethod void test() {
+        realclass.Helper h = new REALCLASS.Helper('UnrealClass \\' UnrealClass');
+        System.assertEquals(null, h);
+    }
+}"""
+
+
+class LocalDependencyFinderTest(unittest.TestCase):
+
+    def test_extract_local_references(self):
+        class_name_index = local_dependency_finder.build_class_name_index(SCAN)
+        self.assertEqual(
+            ['RealClass'],
+            local_dependency_finder.extract_local_references(BODY, 'RealClassTest', class_name_index))
+
+    def test_compare_dependencies(self):
+        reference = {
+            'RealClassTest': {'References': ['RealClass', 'System']},
+            'UnrealClassTest': {'References': ['UnrealClass']}
+        }
+        candidate = {
+            'RealClassTest': {'References': ['RealClass', 'UnrealClass']},
+            'UnrealClassTest': {'References': []}
+        }
+        report = local_dependency_finder.compare_dependencies(
+            reference, candidate, ['RealClass', 'UnrealClass', 'RealClassTest', 'UnrealClassTest'])
+        self.assertEqual({
+            'RealClassTest': {'Missing': [], 'Extra': ['UnrealClass']},
+            'UnrealClassTest': {'Missing': ['UnrealClass'], 'Extra': []}
+        }, report['Classes'])
+        self.assertEqual((1, 1, 1), (report['Matched'], report['Missing'], report['Extra']))
+        self.assertEqual(0.5, report['Precision'])
+        self.assertEqual(0.5, report['Recall'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from xml.etree import ElementTree as ET
+
+from metamatelib.metadata_api import MetadataApi
+
+DEPLOY_RECENT_VALIDATION_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+xmlns="http://soap.sforce.com/2006/04/metadata">
+<soapenv:Body><deployRecentValidationResponse><result>0Af000000000002</result></deployRecentValidationResponse>
+</soapenv:Body></soapenv:Envelope>"""
+
+FAULT_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body><soapenv:Fault><faultcode>sf:INVALID_ID_FIELD</faultcode>
+<faultstring>INVALID_ID_FIELD: Validation is not eligible for quick deploy</faultstring>
+</soapenv:Fault></soapenv:Body></soapenv:Envelope>"""
+
+CANCEL_DEPLOY_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+xmlns="http://soap.sforce.com/2006/04/metadata">
+<soapenv:Body><cancelDeployResponse><result><done>false</done><id>0Af000000000001</id></result>
+</cancelDeployResponse></soapenv:Body></soapenv:Envelope>"""
+
+IN_PROGRESS_RESULT = """<result xmlns="http://soap.sforce.com/2006/04/metadata">
+<status>InProgress</status>
+<details>
+<componentFailures><componentType>ApexClass</componentType><fileName>classes/Broken.cls</fileName>
+<problemType>Error</problemType><problem>Variable does not exist: x</problem></componentFailures>
+<runTestResult>
+<successes><name>GoodTest</name><methodName>test</methodName><time>12.0</time></successes>
+<failures><name>BadTest</name><methodName>test</methodName><time>30.0</time>
+<message>System.AssertException: Assertion Failed</message><stackTrace>Class.BadTest.test: line 5</stackTrace>
+</failures>
+</runTestResult>
+</details>
+</result>"""
+
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.requests = list()
+
+    def is_connected(self):
+        return True
+
+    def get_session_id(self):
+        return '00DSESSION'
+
+    def get_server_url(self):
+        return 'https://mock.salesforce.com'
+
+    def get_api_version(self):
+        return '37.0'
+
+    def post(self, url, headers, data):
+        self.requests.append((url, headers, data))
+        return self.response
+
+
+class MetadataApiTest(unittest.TestCase):
+
+    def test_deploy_recent_validation(self):
+        session = FakeSession(FakeResponse(200, DEPLOY_RECENT_VALIDATION_RESPONSE))
+        mapi = MetadataApi(session)
+        self.assertEqual('0Af000000000002', mapi.deploy_recent_validation('0Af000000000001'))
+        url, headers, data = session.requests[0]
+        self.assertEqual('https://mock.salesforce.com/services/Soap/m/37.0', url)
+        self.assertEqual('deployRecentValidation', headers['SOAPAction'])
+        self.assertIn('<met:validationId>0Af000000000001</met:validationId>', data)
+
+    def test_deploy_recent_validation_rejected(self):
+        mapi = MetadataApi(FakeSession(FakeResponse(500, FAULT_RESPONSE)))
+        with self.assertRaisesRegex(Exception, 'not eligible for quick deploy'):
+            mapi.deploy_recent_validation('0Af000000000001')
+
+    def test_cancel_deploy(self):
+        session = FakeSession(FakeResponse(200, CANCEL_DEPLOY_RESPONSE))
+        MetadataApi(session).cancel_deploy('0Af000000000001')
+        url, headers, data = session.requests[0]
+        self.assertEqual('cancelDeploy', headers['SOAPAction'])
+        self.assertIn('<met:String>0Af000000000001</met:String>', data)
+
+        mapi = MetadataApi(FakeSession(FakeResponse(500, FAULT_RESPONSE)))
+        with self.assertRaisesRegex(Exception, 'Cancellation of deployment 0Af000000000001 was rejected'):
+            mapi.cancel_deploy('0Af000000000001')
+
+    def test_failures_of_deployment_in_progress(self):
+        mapi = MetadataApi(FakeSession(None))
+        self.assertEqual([], mapi.get_test_results())
+        mapi.last_deploy_result = ET.fromstring(IN_PROGRESS_RESULT)
+        self.assertEqual([
+            {'class': 'GoodTest', 'method': 'test', 'time': 12.0, 'message': None, 'stack_trace': None,
+             'failed': False},
+            {'class': 'BadTest', 'method': 'test', 'time': 30.0, 'message': 'System.AssertException: Assertion Failed',
+             'stack_trace': 'Class.BadTest.test: line 5', 'failed': True}
+        ], mapi.get_test_results())
+        self.assertEqual([{'type': 'ApexClass', 'file': 'classes/Broken.cls', 'status': 'Error',
+                           'message': 'Variable does not exist: x'}], mapi.get_component_failures())
+
+
+if __name__ == '__main__':
+    unittest.main()
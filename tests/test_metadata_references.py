@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from metamatelib import metadata_references
+from metamatelib.deploy_package import DeployPackage
+from metamatelib.dependency_finder import reverse_class_dependencies
+from metamatelib.test_extractor import scan_classes, scan_trigger_source, scan_triggers
+
+PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <types><members>AccountTrigger</members><members>CaseTrigger</members><name>ApexTrigger</name></types>
+    <types><members>Invoice__c</members><name>CustomObject</name></types>
+    <types><members>Account.Code__c</members><members>Contact.Email</members><name>CustomField</name></types>
+    <types><members>Opportunity.Amount_Required</members><name>ValidationRule</name></types>
+    <types><members>Lead_Router</members><name>Flow</name></types>
+    <types><members>Setting.Default</members><name>CustomMetadata</name></types>
+    <types><members>Admin</members><name>Profile</name></types>
+    <version>45.0</version>
+</Package>"""
+FLOW_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Flow xmlns="http://soap.sforce.com/2006/04/metadata">
+    <start><object>Lead</object><recordTriggerType>Create</recordTriggerType></start>
+</Flow>"""
+TESTS = {
+    'AccountTest': "@isTest\nprivate class AccountTest {\n    // Lead is not touched\n    Account a;\n}",
+    'InvoiceTest': "@isTest\nprivate class InvoiceTest {\n    INVOICE__C i;\n}",
+    'LeadTest': "@isTest\nprivate class LeadTest {\n    Lead l;\n}",
+    'FlowTest': "@isTest\nprivate class FlowTest {\n    Flow.Interview.Lead_Router f;\n}",
+    'CaseTest': "@isTest\nprivate class CaseTest {\n    String s = 'Case';\n}",
+    'OrderTest': "@isTest\nprivate class OrderTest {\n    Order o;\n}",
+    'ContactTest': "@isTest\nprivate class ContactTest {\n    Contact c = new Contact(LastName = 'Email');\n}",
+    'ContactServiceTest': "@isTest\nprivate class ContactServiceTest {\n    ContactService s;\n}"
+}
+# Tests reach components through non-test classes they depend on
+CLASSES = {
+    'ContactService': "public class ContactService {\n    void notify(Contact c) { send(c.Email); }\n}"
+}
+
+
+class MetadataReferencesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._source_dir = os.path.join(self._dir.name, 'src')
+        for folder in ['classes', 'triggers']:
+            os.makedirs(os.path.join(self._source_dir, folder))
+        for name, body in list(TESTS.items()) + list(CLASSES.items()):
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls-meta.xml' % name), 'w') as file:
+                file.write('<ApexClass><status>Active</status></ApexClass>')
+        triggers = {
+            'CaseTrigger': '/* trigger fires on Lead */\ntrigger CaseTrigger on Case (before insert) {}',
+            'OrderTrigger': 'trigger OrderTrigger on Order (after update) {\n    OrderService.sync();\n}'
+        }
+        for name, body in triggers.items():
+            with open(os.path.join(self._source_dir, 'triggers', '%s.trigger' % name), 'w') as file:
+                file.write(body)
+        zip_path = os.path.join(self._dir.name, 'deploy.zip')
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('package.xml', PACKAGE_XML)
+            zipfile.writestr('triggers/AccountTrigger.trigger',
+                             'trigger AccountTrigger on Account (before insert, before update) {}')
+            zipfile.writestr('flows/Lead_Router.flow', FLOW_XML)
+        self._package = DeployPackage(zip_path, self._source_dir)
+
+    def test_scan_triggers(self):
+        self.assertIsNone(scan_trigger_source('public class NotATrigger {}'))
+        triggers = scan_triggers(self._source_dir)
+        self.assertEqual(['CaseTrigger', 'OrderTrigger'], sorted(triggers))
+        self.assertEqual('Case', triggers['CaseTrigger']['SObject'])
+        self.assertEqual(['order', 'orderservice', 'ordertrigger', 'sync'], triggers['OrderTrigger']['Identifiers'])
+
+    def test_find_component_references(self):
+        self.assertEqual({
+            'ApexTrigger/AccountTrigger': ['account'],
+            'ApexTrigger/CaseTrigger': ['case'],
+            'CustomObject/Invoice__c': ['invoice__c'],
+            'CustomField/Account.Code__c': ['code__c'],
+            'CustomField/Contact.Email': ['contact.email'],
+            'ValidationRule/Opportunity.Amount_Required': ['opportunity'],
+            'Flow/Lead_Router': ['lead', 'lead_router'],
+            'CustomMetadata/Setting.Default': ['setting__mdt']
+        }, metadata_references.find_component_references(self._package, scan_triggers(self._source_dir)))
+
+    def test_select_tests_touching(self):
+        triggers = scan_triggers(self._source_dir)
+        references = metadata_references.find_component_references(self._package, triggers)
+        references.update(metadata_references.find_trigger_references(triggers, ['OrderService']))
+        class_dependencies = reverse_class_dependencies({'ContactServiceTest': {'References': ['ContactService']}})
+        self.assertEqual({
+            'AccountTest': ['ApexTrigger/AccountTrigger'],
+            'ContactServiceTest': ['CustomField/Contact.Email'],
+            'FlowTest': ['Flow/Lead_Router'],
+            'InvoiceTest': ['CustomObject/Invoice__c'],
+            'LeadTest': ['Flow/Lead_Router'],
+            'OrderTest': ['ApexTrigger/OrderTrigger']
+        }, metadata_references.select_tests_touching(
+            references, scan_classes(self._source_dir), sorted(TESTS), class_dependencies))
+
+
+if __name__ == '__main__':
+    unittest.main()
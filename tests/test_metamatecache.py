@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import unittest
+
+import yaml
+
+from metamatelib.metamatecache import CACHE_FORMAT_VERSION, INFO_FILE_NAME, MetamateCache
+from tests.mock_salesforce import use_temporary_home
+
+
+class MetamateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._home = use_temporary_home(self)
+
+    def test_add_and_get_class_data(self):
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        cache.add_classes_data({
+            'RealClassTest': {'Id': '01pU00000026druIAA', 'References': ['RealClass']},
+            'TestableClassTest': {'Id': '01pU00000026druIAB', 'References': ['TestableClass']}
+        })
+        cache.close()
+
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        self.assertEqual(['RealClassTest', 'TestableClassTest'], sorted(cache.class_names()))
+        self.assertEqual(['RealClass'], cache.get_class_data('RealClassTest')['References'])
+        self.assertIsNone(cache.get_class_data('UnrealClassTest'))
+
+        cache.delete_class_data('RealClassTest')
+        self.assertIsNone(cache.get_class_data('RealClassTest'))
+        cache.clear()
+        self.assertEqual([], cache.class_names())
+
+    def test_load_json_from_all_orgs(self):
+        for username, data in [('qa@example.com', {'Org': 'qa'}), ('uat@example.com', {'Org': 'uat'})]:
+            cache = MetamateCache(username)
+            cache.load()
+            cache.save_json('data.json', data)
+            cache.close()
+        self.assertEqual([{'Org': 'qa'}, {'Org': 'uat'}], cache.load_json_from_all_orgs('data.json'))
+        self.assertEqual([], cache.load_json_from_all_orgs('missing.json'))
+
+    def test_generation(self):
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        other = MetamateCache('user@example.com')
+        other.load()
+        self.assertEqual(0, cache.generation)
+        self.assertIsNone(other.get_class_data('RealClassTest'))
+
+        cache.add_class_data('RealClassTest', {'Id': '01pU00000026druIAA', 'References': ['RealClass']})
+        self.assertEqual(1, cache.generation)
+        self.assertFalse(cache.is_changed())
+        self.assertTrue(other.is_changed())
+        other.add_class_data('RealClassTest', {'Id': '01pU00000026druIAA', 'References': []})
+        # Change made by the first instance has not been seen yet
+        self.assertEqual(0, other.generation)
+        other.refresh()
+        self.assertEqual(2, other.generation)
+
+        cache.clear()
+        self.assertEqual(3, cache.generation)
+        self.assertTrue(other.is_changed())
+
+    def test_newer_cache_format_is_rejected(self):
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        cache.save_json(INFO_FILE_NAME, {'Version': CACHE_FORMAT_VERSION + 1, 'Generation': 0})
+        with self.assertRaisesRegex(Exception, 'newer version'):
+            MetamateCache('user@example.com').load()
+
+    def test_concurrent_updates(self):
+        def update(worker):
+            cache = MetamateCache('user@example.com', 'yaml')
+            cache.load()
+            for i in range(20):
+                cache.update_json('counter.json', lambda data: dict(data, Count=data['Count'] + 1), {'Count': 0})
+                cache.add_classes_data({'Class%s_%s' % (worker, i): {'References': []}})
+
+        threads = [threading.Thread(target=update, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cache = MetamateCache('user@example.com', 'yaml')
+        cache.load()
+        self.assertEqual({'Count': 80}, cache.load_json('counter.json'))
+        self.assertEqual(80, len(cache.class_names()))
+        self.assertEqual(80, cache.generation)
+        # Files are written next to their destination and renamed
+        self.assertEqual([], [name for name in os.listdir(cache.org_root_dir) if name.endswith('.tmp')])
+        with open(os.path.join(cache.org_root_dir, INFO_FILE_NAME)) as file:
+            self.assertEqual(CACHE_FORMAT_VERSION, json.load(file)['Version'])
+
+    def test_yaml_cache_is_migrated(self):
+        org_root_dir = os.path.join(self._home, MetamateCache.ROOT_DIR_NAME, 'user@example.com')
+        os.makedirs(org_root_dir)
+        with open(os.path.join(org_root_dir, 'RealClassTest.yaml'), 'w') as file:
+            file.write(yaml.dump({'Id': '01pU00000026druIAA', 'References': ['RealClass']}))
+
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        self.assertEqual(['RealClass'], cache.get_class_data('RealClassTest')['References'])
+        self.assertFalse(os.path.exists(os.path.join(org_root_dir, 'RealClassTest.yaml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
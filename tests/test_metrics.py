@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+
+from metamatelib import metrics
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_request_endpoint(self):
+        base = 'https://cs1.salesforce.com/services'
+        self.assertEqual('GET tooling/query', metrics.request_endpoint(
+            'GET', base + '/data/v45.0/tooling/query/?q=SELECT+Id+FROM+ApexClass'))
+        self.assertEqual('GET tooling/query', metrics.request_endpoint(
+            'GET', base + '/data/v45.0/tooling/query/01gD0000002HU6KIAW-2000'))
+        self.assertEqual('DELETE tooling/sobjects/MetadataContainer', metrics.request_endpoint(
+            'DELETE', base + '/data/v45.0/tooling/sobjects/MetadataContainer/1dc000000000001'))
+        self.assertEqual('POST tooling/composite/sobjects', metrics.request_endpoint(
+            'POST', base + '/data/v45.0/tooling/composite/sobjects'))
+        self.assertEqual('POST soap/m/checkDeployStatus', metrics.request_endpoint(
+            'POST', base + '/Soap/m/45.0', {'SOAPAction': 'checkDeployStatus'}))
+
+    def test_report(self):
+        run_metrics = metrics.Metrics()
+        with run_metrics.phase('scan'):
+            pass
+        with metrics.measure(run_metrics, 'scan'):
+            pass
+        with metrics.measure(None, 'scan'):
+            pass
+        run_metrics.count('dependency_cache_hits', 5)
+        run_metrics.count('dependency_cache_hits')
+        url = 'https://cs1.salesforce.com/services/data/v45.0/tooling/sobjects/ApexClassMember/'
+        run_metrics.record_request('POST', url, None, {'Body': 'x'}, FakeResponse(201, b'{"id":"1"}'), 0.5)
+        run_metrics.record_request('POST', url, None, '{"Body":"x"}', FakeResponse(400, b'[]'), 0.25)
+
+        report = run_metrics.report(Succeeded=True)
+        self.assertTrue(report['Succeeded'])
+        self.assertEqual(2, report['Phases']['scan']['Count'])
+        self.assertEqual(6, report['Counters']['dependency_cache_hits'])
+        self.assertEqual({'Count': 2, 'Errors': 1, 'BytesSent': 25, 'BytesReceived': 12, 'Time': 0.75},
+                         report['Requests']['POST tooling/sobjects/ApexClassMember'])
+
+    def test_write_reports(self):
+        run_metrics = metrics.Metrics()
+        run_metrics.add_phase_time('login', 1.5)
+        run_metrics.count('deploy_polls', 3)
+        run_metrics.record_request('POST', 'https://cs1.salesforce.com/services/Soap/m/45.0',
+                                   {'SOAPAction': 'deploy'}, 'x' * 10, FakeResponse(200, b'ok'), 0.1)
+        with tempfile.TemporaryDirectory() as report_dir:
+            json_path = os.path.join(report_dir, 'report.json')
+            run_metrics.write_json(json_path, Succeeded=False)
+            with open(json_path) as file:
+                self.assertEqual(1.5, json.load(file)['Phases']['login']['Time'])
+
+            prom_path = os.path.join(report_dir, 'metamate.prom')
+            run_metrics.write_prometheus(prom_path, {'username': 'user@example.com'}, Succeeded=True)
+            with open(prom_path) as file:
+                lines = file.read().splitlines()
+            self.assertEqual(['metamate.prom', 'report.json'], sorted(os.listdir(report_dir)))
+        self.assertIn('metamate_run_success{username="user@example.com"} 1', lines)
+        self.assertIn('metamate_phase_seconds{phase="login",username="user@example.com"} 1.5', lines)
+        self.assertIn('metamate_api_bytes_sent{endpoint="POST soap/m/deploy",username="user@example.com"} 10', lines)
+        self.assertIn('metamate_deploy_polls{username="user@example.com"} 3', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from metamatelib import package_minimizer
+from metamatelib.deploy_package import DeployPackage
+
+PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <types>
+        <members>*</members>
+        <name>ApexClass</name>
+    </types>
+    <types>
+        <members>Account</members>
+        <name>CustomObject</name>
+    </types>
+    <types>
+        <members>Account.Code__c</members>
+        <name>CustomField</name>
+    </types>
+    <types>
+        <members>Setting</members>
+        <name>UnknownType</name>
+    </types>
+    <version>37.0</version>
+</Package>"""
+
+EMPTY_PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <version>37.0</version>
+</Package>"""
+
+DESTRUCTIVE_CHANGES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+    <types>
+        <members>OldService</members>
+        <name>ApexClass</name>
+    </types>
+</Package>"""
+
+
+class PackageMinimizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write_zip(self, service_body):
+        zip_path = os.path.join(self._dir.name, 'deploy.zip')
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('package.xml', PACKAGE_XML)
+            zipfile.writestr('classes/Service.cls', service_body)
+            zipfile.writestr('classes/Service.cls-meta.xml', '<ApexClass/>')
+            zipfile.writestr('classes/ServiceTest.cls', '@isTest\nprivate class ServiceTest {}')
+            zipfile.writestr('classes/ServiceTest.cls-meta.xml', '<ApexClass/>')
+            zipfile.writestr('objects/Account.object', '<CustomObject/>')
+            zipfile.writestr('unknown/Setting.unknown', '<Setting/>')
+        return DeployPackage(zip_path)
+
+    def test_hash_components(self):
+        components = package_minimizer.hash_components(self._write_zip('public class Service {}'))
+        self.assertEqual(['ApexClass/Service', 'ApexClass/ServiceTest', 'CustomField/Account.Code__c',
+                          'CustomObject/Account', 'UnknownType/Setting'], sorted(components.keys()))
+        self.assertEqual(['classes/Service.cls', 'classes/Service.cls-meta.xml'],
+                         components['ApexClass/Service']['Files'])
+        self.assertEqual(components['CustomObject/Account']['Hash'],
+                         components['CustomField/Account.Code__c']['Hash'])
+        self.assertIsNone(components['UnknownType/Setting']['Hash'])
+
+    def test_minimize(self):
+        components = package_minimizer.hash_components(self._write_zip('public class Service {}'))
+        deployed_hashes = dict((key, component['Hash']) for key, component in components.items())
+
+        package = self._write_zip('public class Service { Integer i; }')
+        components = package_minimizer.hash_components(package)
+        changed = package_minimizer.select_changed_components(components, deployed_hashes)
+        self.assertEqual(['ApexClass/Service', 'UnknownType/Setting'], changed)
+
+        zip_path = os.path.join(self._dir.name, 'minimized.zip')
+        package_minimizer.write_minimized_package(package, components, changed, zip_path)
+        minimized = DeployPackage(zip_path)
+        self.assertEqual({'ApexClass': ['Service'], 'UnknownType': ['Setting']}, minimized.members)
+        self.assertEqual(['classes/Service.cls', 'classes/Service.cls-meta.xml', 'package.xml',
+                          'unknown/Setting.unknown'], minimized.file_names())
+        self.assertIn('<version>37.0</version>', minimized.read_file('package.xml'))
+
+        # Minimized package with the same contents is identical so that its validation can be quick deployed
+        same_path = os.path.join(self._dir.name, 'same.zip')
+        package_minimizer.write_minimized_package(package, components, changed, same_path)
+        self.assertEqual(minimized.hash, DeployPackage(same_path).hash)
+
+    def test_destructive_changes_only(self):
+        zip_path = os.path.join(self._dir.name, 'destructive.zip')
+        with ZipFile(zip_path, 'w') as zipfile:
+            zipfile.writestr('package.xml', EMPTY_PACKAGE_XML)
+            zipfile.writestr('destructiveChangesPost.xml', DESTRUCTIVE_CHANGES_XML)
+        package = DeployPackage(zip_path)
+        components = package_minimizer.hash_components(package)
+        self.assertEqual({}, components)
+        self.assertEqual([], package_minimizer.select_changed_components(components, dict()))
+        # Destructive manifest is not a listed component, it forces deployment
+        self.assertEqual(['destructiveChangesPost.xml'], package_minimizer.select_unlisted_files(package, components))
+        self.assertEqual(['ApexClass/OldService'], package_minimizer.read_destructive_members(package))
+
+        minimized_path = os.path.join(self._dir.name, 'minimized.zip')
+        self.assertEqual({}, package_minimizer.write_minimized_package(package, components, [], minimized_path))
+        minimized = DeployPackage(minimized_path)
+        self.assertEqual({}, minimized.members)
+        self.assertEqual(['destructiveChangesPost.xml', 'package.xml'], minimized.file_names())
+        self.assertEqual(DESTRUCTIVE_CHANGES_XML, minimized.read_file('destructiveChangesPost.xml'))
+
+    def test_minimized_zip_path(self):
+        self.assertEqual(os.path.join('build', 'deploy-minimized.zip'),
+                         package_minimizer.minimized_zip_path(os.path.join('build', 'deploy.zip')))
+
+
+if __name__ == '__main__':
+    unittest.main()
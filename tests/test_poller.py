@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+
+from metamatelib.poller import Poller
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_intervals_grow_up_to_cap(self):
+        results = iter([False, False, False, False, True])
+        poller = Poller(initial_interval=1, max_interval=5, factor=2)
+        with mock.patch('metamatelib.poller.time.sleep') as sleep:
+            poller.wait(lambda: next(results))
+        self.assertEqual([1, 2, 4, 5, 5], [call[0][0] for call in sleep.call_args_list])
+        self.assertEqual(5, poller.poll_count)
+        self.assertEqual(17, poller.time_waited)
+
+    def test_timeout(self):
+        poller = Poller(initial_interval=0.01, max_interval=0.01, timeout=0.05)
+        with self.assertRaises(Exception):
+            poller.wait(lambda: False, 'deployment')
+        self.assertGreater(poller.poll_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import unittest
+from zipfile import ZipFile
+
+from sfdclib import SfdcLogger
+
+from metamatelib.metamate import parse_command_line_args
+from metamatelib.select_tests import SelectTestsCommand
+from tests.mock_salesforce import MockSalesforce, mock_command, use_temporary_home
+
+CLASSES = {
+    'RealClass': 'public class RealClass {}',
+    'RealClassTest': '@isTest\nprivate class RealClassTest {\n    RealClass c = new RealClass();\n}',
+    'TestableClass': 'public class TestableClass {}',
+    'TestableClassTest': '@isTest\nprivate class TestableClassTest {\n    TestableClass c;\n}'
+}
+META_XML = '<ApexClass><status>Active</status></ApexClass>'
+PACKAGE_XML = """<Package xmlns="http://soap.sforce.com/2006/04/metadata">
+<types><members>RealClass</members><name>ApexClass</name></types><version>45.0</version></Package>"""
+
+
+class SelectTestsCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self._home = use_temporary_home(self)
+        self._source_dir = os.path.join(self._home, 'src')
+        os.makedirs(os.path.join(self._source_dir, 'classes'))
+        for name, body in CLASSES.items():
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls-meta.xml' % name), 'w') as file:
+                file.write(META_XML)
+        self._deploy_zip = os.path.join(self._home, 'deploy.zip')
+        with ZipFile(self._deploy_zip, 'w') as zipfile:
+            zipfile.writestr('package.xml', PACKAGE_XML)
+            zipfile.writestr('classes/RealClass.cls', CLASSES['RealClass'])
+            zipfile.writestr('classes/RealClass.cls-meta.xml', META_XML)
+        self._mock = MockSalesforce(CLASSES).start()
+        self.addCleanup(self._mock.stop)
+
+    def _select_tests(self, *argv):
+        output = os.path.join(self._home, 'tests.txt')
+        args = parse_command_line_args([
+            'select-tests', '--username', 'user@example.com', '--deploy-zip', self._deploy_zip,
+            '--source-dir', self._source_dir, '--use-cache', '--version', '45.0', '--poll-interval', '0',
+            '--output', output] + list(argv))
+        self.assertTrue(mock_command(SelectTestsCommand, args, SfdcLogger(0), self._mock).run())
+        with open(output, 'r', encoding='utf-8') as file:
+            return file.read().splitlines()
+
+    def test_select_tests(self):
+        self.assertEqual(['RealClassTest'], self._select_tests('--password', 'Password'))
+        self.assertEqual(1, self._mock.requests['POST soap/login'])
+        self.assertEqual(1, self._mock.requests['POST sobjects/ContainerAsyncRequest'])
+
+        # Warm cache: no password needed and no requests sent
+        sent = sum(self._mock.requests.values())
+        self.assertEqual(['RealClassTest'], self._select_tests())
+        self.assertEqual(sent, sum(self._mock.requests.values()))
+
+    def test_password_required_when_cache_is_cold(self):
+        with self.assertRaisesRegex(Exception, 'Password is required'):
+            self._select_tests()
+
+    def test_classes_missing_from_org_do_not_force_login(self):
+        # Test added by the package and test which exists only in source directory are not in the org
+        new_test = '@isTest\nprivate class NewTest {\n    RealClass c;\n}'
+        with ZipFile(self._deploy_zip, 'w') as zipfile:
+            zipfile.writestr('package.xml', PACKAGE_XML.replace(
+                '<members>RealClass</members>', '<members>NewTest</members><members>RealClass</members>'))
+            for name, body in [('NewTest', new_test), ('RealClass', CLASSES['RealClass'])]:
+                zipfile.writestr('classes/%s.cls' % name, body)
+                zipfile.writestr('classes/%s.cls-meta.xml' % name, META_XML)
+        for name, body in [('NewTest', new_test),
+                           ('OrphanTest', '@isTest\nprivate class OrphanTest {\n    RealClass c;\n}')]:
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls-meta.xml' % name), 'w') as file:
+                file.write(META_XML)
+        expected = ['NewTest', 'OrphanTest', 'RealClassTest']
+        self.assertEqual(expected, sorted(self._select_tests('--password', 'Password')))
+        self.assertEqual(expected, sorted(self._select_tests('--password', 'Password')))
+        self.assertEqual(1, self._mock.requests['POST soap/login'])
+        self.assertEqual(expected, sorted(self._select_tests()))
+
+    def test_standard_field_touched_through_class(self):
+        with ZipFile(self._deploy_zip, 'w') as zipfile:
+            zipfile.writestr('package.xml', PACKAGE_XML.replace(
+                '<version>', '<types><members>Account.Industry</members><name>CustomField</name></types><version>'))
+            zipfile.writestr('classes/RealClass.cls', CLASSES['RealClass'])
+            zipfile.writestr('classes/RealClass.cls-meta.xml', META_XML)
+        account_service = "public class AccountService {\n    void rate(Account a) { a.Industry = 'Banking'; }\n}"
+        for name, body in [
+                ('AccountService', account_service),
+                ('AccountServiceTest', '@isTest\nprivate class AccountServiceTest {\n    AccountService s;\n}'),
+                ('AccountTest', '@isTest\nprivate class AccountTest {\n    Account a;\n}')]:
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls' % name), 'w') as file:
+                file.write(body)
+            with open(os.path.join(self._source_dir, 'classes', '%s.cls-meta.xml' % name), 'w') as file:
+                file.write(META_XML)
+        self.assertEqual(['AccountServiceTest', 'RealClassTest'], sorted(self._select_tests(
+            '--password', 'Password', '--dependency-mode', 'local')))
+
+    def _git(self, *args):
+        subprocess.check_call(['git', '-C', self._source_dir, '-c', 'user.name=metamate',
+                               '-c', 'user.email=metamate@example.com'] + list(args))
+
+    def test_git_base_with_index_from_older_checkout(self):
+        self._git('init', '-q')
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'init')
+        git_argv = ['--password', 'Password', '--git-base', 'HEAD', '--dependency-mode', 'local']
+        self.assertEqual([], self._select_tests(*git_argv))
+
+        # Test added after scan index was built must be found when its dependency changes
+        with open(os.path.join(self._source_dir, 'classes', 'BarTest.cls'), 'w') as file:
+            file.write('@isTest\nprivate class BarTest {\n    RealClass c;\n}')
+        with open(os.path.join(self._source_dir, 'classes', 'BarTest.cls-meta.xml'), 'w') as file:
+            file.write(META_XML)
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'add BarTest')
+        with open(os.path.join(self._source_dir, 'classes', 'RealClass.cls'), 'w') as file:
+            file.write('public class RealClass { Integer i; }')
+        self.assertEqual(['BarTest', 'RealClassTest'], sorted(self._select_tests(*git_argv)))
+
+
+if __name__ == '__main__':
+    unittest.main()
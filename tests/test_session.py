@@ -0,0 +1,140 @@
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metamatelib.metamatecache import MetamateCache
+from metamatelib.session import MetamateSession, SessionCache, SESSION_FILE_NAME
+from metamatelib.tooling_api import ToolingApi
+from tests.mock_salesforce import use_temporary_home
+
+LOGIN_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns="urn:enterprise.soap.sforce.com">
+<soapenv:Body><loginResponse><result>
+<serverUrl>https://mock.salesforce.com/services/Soap/c/37.0/00D</serverUrl>
+<sessionId>%s</sessionId>
+<userInfo><sessionSecondsValid>3600</sessionSecondsValid></userInfo>
+</result></loginResponse></soapenv:Body></soapenv:Envelope>"""
+
+
+class MockLoginServer:
+    """ Accepts only session id returned by the last login """
+    def __init__(self):
+        self.logins = 0
+        self.session_id = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, status, data):
+                data = data.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                server.logins += 1
+                server.session_id = '00DSESSION%s' % server.logins
+                self._respond(200, LOGIN_RESPONSE % server.session_id)
+
+            def do_GET(self):
+                if self.headers.get('Authorization') != 'Bearer %s' % server.session_id:
+                    self._respond(401, '[{"errorCode":"INVALID_SESSION_ID","message":"Session expired"}]')
+                else:
+                    self._respond(200, '{"size":0,"done":true,"records":[]}')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MockMetamateSession(MetamateSession):
+    def __init__(self, server_url):
+        super().__init__(username='user@example.com', password='password', token='TOKEN')
+        self._server_url = server_url
+
+    def get_server_url(self):
+        return self._server_url
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = MockLoginServer()
+
+    def tearDown(self):
+        self._server.stop()
+
+    def test_refresh_invalid_session(self):
+        session = MockMetamateSession(self._server.url)
+        session.login()
+        self.assertEqual(3600, session.seconds_valid)
+        self._server.session_id = '00DEXPIRED'
+
+        tooling = ToolingApi(session)
+        self.assertEqual([], tooling.query_all("SELECT Id FROM ApexClass"))
+        self.assertEqual(2, session.login_count)
+        self.assertEqual('00DSESSION2', session.get_session_id())
+
+    def test_invalid_session_without_password(self):
+        session = MockMetamateSession(self._server.url)
+        session.login()
+        session._password = None
+        self._server.session_id = '00DEXPIRED'
+        response = session.get(session.construct_url('/services/data/v37.0/tooling/query/'),
+                               headers={'Authorization': 'Bearer %s' % session.get_session_id()})
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(1, session.login_count)
+
+
+@unittest.skipUnless(SessionCache.is_available(), 'cryptography package is not installed')
+class SessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = MockLoginServer()
+        use_temporary_home(self)
+        self._cache = MetamateCache('user@example.com')
+        self._cache.load()
+
+    def tearDown(self):
+        self._cache.close()
+        self._server.stop()
+
+    def test_reuse_session(self):
+        session = MockMetamateSession(self._server.url)
+        session.session_cache = SessionCache(self._cache, 'password', 'TOKEN')
+        session.login()
+        with open(os.path.join(self._cache.org_root_dir, SESSION_FILE_NAME)) as file:
+            self.assertNotIn(session.get_session_id(), file.read())
+
+        session = MockMetamateSession(self._server.url)
+        self.assertTrue(SessionCache(self._cache, 'password', 'TOKEN').restore(session))
+        self.assertEqual('00DSESSION1', session.get_session_id())
+        self.assertEqual('mock', session.get_instance())
+
+        self.assertFalse(SessionCache(self._cache, 'changed', 'TOKEN').restore(MockMetamateSession(self._server.url)))
+
+        self._cache.clear()
+        self.assertFalse(SessionCache(self._cache, 'password', 'TOKEN').restore(MockMetamateSession(self._server.url)))
+
+    def test_expired_session(self):
+        session = MockMetamateSession(self._server.url)
+        session.login()
+        session.seconds_valid = 0
+        SessionCache(self._cache, 'password', 'TOKEN').save(session)
+        self.assertFalse(SessionCache(self._cache, 'password', 'TOKEN').restore(MockMetamateSession(self._server.url)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from metamatelib import test_extractor
+from metamatelib.metamatecache import MetamateCache
+from tests.mock_salesforce import use_temporary_home
+
+CLASS_META_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ApexClass xmlns="http://soap.sforce.com/2006/04/metadata">
+    <apiVersion>37.0</apiVersion>
+    <status>%s</status>
+</ApexClass>"""
+
+
+class TestExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._source_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self._source_dir.name, 'classes'))
+        self._write_class('RealClass', 'public class RealClass {}', 'Active')
+        self._write_class('RealClassTest', '@isTest\nprivate class RealClassTest {}', 'Active')
+        self._write_class('DeletedClassTest', '@isTest\nprivate class DeletedClassTest {}', 'Deleted')
+        self._write_class('UnrealClass', 'public class UnrealClass {\n    public class Inner {}\n}', 'Active')
+
+    def tearDown(self):
+        self._source_dir.cleanup()
+
+    def _write_class(self, name, body, status):
+        classes_dir = os.path.join(self._source_dir.name, 'classes')
+        with open(os.path.join(classes_dir, '%s.cls' % name), 'w') as file:
+            file.write(body)
+        with open(os.path.join(classes_dir, '%s.cls-meta.xml' % name), 'w') as file:
+            file.write(CLASS_META_XML % status)
+
+    def test_scan_classes(self):
+        for workers in [1, 4]:
+            scan = test_extractor.scan_classes(self._source_dir.name, workers=workers)
+            self.assertEqual(['DeletedClassTest', 'RealClass', 'RealClassTest', 'UnrealClass'], sorted(scan.keys()))
+            self.assertEqual(['RealClassTest'], test_extractor.select_active_test_objects(scan))
+            self.assertEqual(
+                ['RealClassTest'],
+                test_extractor.select_test_objects(scan, ['RealClass', 'RealClassTest', 'MissingClass']))
+            self.assertEqual(
+                ['UnrealClass', 'Inner', 'RealClass'],
+                test_extractor.select_class_names(scan, ['UnrealClass', 'RealClass']))
+
+    def test_scan_index(self):
+        use_temporary_home(self)
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        index = test_extractor.ScanIndex(cache, self._source_dir.name)
+        test_extractor.scan_classes(self._source_dir.name, index=index)
+        self.assertEqual((0, 4), (index.hits, index.misses))
+        index.save()
+
+        self._write_class('RealClass', '@isTest\nprivate class RealClass { }', 'Active')
+        os.remove(os.path.join(self._source_dir.name, 'classes', 'UnrealClass.cls'))
+        index = test_extractor.ScanIndex(cache, self._source_dir.name)
+        scan = test_extractor.scan_classes(self._source_dir.name, index=index)
+        self.assertEqual((2, 1), (index.hits, index.misses))
+        self.assertEqual(['RealClass', 'RealClassTest'], sorted(test_extractor.select_active_test_objects(scan)))
+        self.assertNotIn('UnrealClass', index.entries)
+        self.assertTrue(index.changed)
+        index.save()
+
+        # Unchanged directory does not rewrite the index
+        index = test_extractor.ScanIndex(cache, self._source_dir.name)
+        test_extractor.scan_classes(self._source_dir.name, index=index)
+        self.assertEqual((3, 0), (index.hits, index.misses))
+        self.assertFalse(index.changed)
+        with mock.patch.object(cache, 'update_json') as update_json:
+            index.save()
+        update_json.assert_not_called()
+
+    def test_scan_index_of_triggers(self):
+        use_temporary_home(self)
+        cache = MetamateCache('user@example.com')
+        cache.load()
+        # Index written by older version is discarded
+        cache.save_json(test_extractor.ScanIndex.FILE_NAME, {os.path.abspath(self._source_dir.name): {
+            'RealClass': {'Stat': None}
+        }})
+        triggers_dir = os.path.join(self._source_dir.name, 'triggers')
+        os.makedirs(triggers_dir)
+        with open(os.path.join(triggers_dir, 'CaseTrigger.trigger'), 'w') as file:
+            file.write('trigger CaseTrigger on Case (before insert) {\n    CaseService.assign(Trigger.new);\n}')
+        index = test_extractor.ScanIndex(cache, self._source_dir.name)
+        self.assertEqual({}, index.entries)
+        test_extractor.scan_classes(self._source_dir.name, index=index)
+        triggers = test_extractor.scan_triggers(self._source_dir.name, index=index)
+        self.assertEqual((0, 5), (index.hits, index.misses))
+        self.assertEqual(['assign', 'case', 'caseservice', 'casetrigger'], triggers['CaseTrigger']['Identifiers'])
+        index.save()
+
+        index = test_extractor.ScanIndex(cache, self._source_dir.name)
+        scan = test_extractor.scan_classes(self._source_dir.name, index=index)
+        self.assertEqual(triggers, test_extractor.scan_triggers(self._source_dir.name, index=index))
+        self.assertEqual((5, 0), (index.hits, index.misses))
+        self.assertEqual(['inner', 'unrealclass'], scan['UnrealClass']['Identifiers'])
+
+        os.remove(os.path.join(triggers_dir, 'CaseTrigger.trigger'))
+        self.assertEqual({}, test_extractor.scan_triggers(self._source_dir.name, index=index))
+        self.assertEqual({}, index.trigger_entries)
+        self.assertTrue(index.changed)
+
+    def test_unreadable_file(self):
+        with open(os.path.join(self._source_dir.name, 'classes', 'BrokenClass.cls'), 'wb') as file:
+            file.write(b'public class BrokenClass { String s = \'\xff\'; }')
+        log = mock.Mock()
+        scan = test_extractor.scan_classes(self._source_dir.name, workers=1, log=log)
+        self.assertNotIn('BrokenClass', scan)
+        self.assertIn('BrokenClass.cls', log.wrn.call_args[0][0])
+        with self.assertRaisesRegex(Exception, 'Could not process file .*BrokenClass.cls'):
+            test_extractor.scan_classes(self._source_dir.name, workers=1)
+
+    def test_legacy_helpers(self):
+        self.assertEqual(['RealClassTest'], test_extractor.find_test_objects(self._source_dir.name))
+        self.assertEqual(
+            ['RealClassTest'],
+            test_extractor.extract_test_objects(['RealClass', 'RealClassTest'], self._source_dir.name))
+        self.assertEqual(['RealClass'], test_extractor.extract_class_names(['RealClass'], self._source_dir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from xml.etree import ElementTree as ET
+
+from metamatelib import test_sharding
+from metamatelib.metadata_api import MetadataApi
+
+DEPLOY_RESULT = """<result xmlns="http://soap.sforce.com/2006/04/metadata">
+    <details>
+        <runTestResult>
+            <successes><name>ServiceTest</name><methodName>testOne</methodName><time>120.0</time></successes>
+            <successes><name>ServiceTest</name><methodName>testTwo</methodName><time>80.0</time></successes>
+            <failures><name>UtilTest</name><methodName>testOne</methodName><time>35.5</time></failures>
+        </runTestResult>
+    </details>
+</result>"""
+
+
+class TestShardingTest(unittest.TestCase):
+
+    def test_split_into_shards(self):
+        runtimes = {'ATest': 900.0, 'BTest': 600.0, 'CTest': 500.0, 'DTest': 400.0, 'ETest': 100.0}
+        shards = test_sharding.split_into_shards(sorted(runtimes.keys()), runtimes, 2)
+        self.assertEqual([{'Tests': ['ATest', 'DTest'], 'Time': 1300.0},
+                          {'Tests': ['BTest', 'CTest', 'ETest'], 'Time': 1200.0}], shards)
+
+        # Tests without known run time are expected to take median time
+        shards = test_sharding.split_into_shards(['ATest', 'NewTest', 'NewTest'], {'ATest': 900.0}, 3)
+        self.assertEqual([['ATest'], ['NewTest'], []], [shard['Tests'] for shard in shards])
+
+    def test_shards_do_not_depend_on_test_order(self):
+        tests = ['Test%s' % i for i in range(20)]
+        runtimes = dict((test, float(i % 7)) for i, test in enumerate(tests))
+        self.assertEqual(test_sharding.split_into_shards(tests, runtimes, 3),
+                         test_sharding.split_into_shards(list(reversed(tests)), runtimes, 3))
+
+    def test_merge_test_runtimes(self):
+        qa = test_sharding.update_test_runtimes(dict(), {'ATest': 100.0, 'BTest': 200.0}, recorded=1.0)
+        uat = test_sharding.update_test_runtimes(dict(), {'BTest': 250.0}, recorded=2.0)
+        self.assertEqual({'ATest': 100.0, 'BTest': 250.0}, test_sharding.merge_test_runtimes([qa, uat]))
+        self.assertEqual({'ATest': 100.0, 'BTest': 250.0}, test_sharding.merge_test_runtimes([uat, qa]))
+
+    def test_shard_plans(self):
+        key = test_sharding.shard_plan_key(['BTest', 'ATest', 'ATest'], 2)
+        self.assertEqual(key, test_sharding.shard_plan_key(['ATest', 'BTest'], 2))
+        self.assertNotEqual(key, test_sharding.shard_plan_key(['ATest', 'BTest'], 3))
+
+        first = [{'Tests': ['ATest'], 'Time': 1000.0}, {'Tests': ['BTest'], 'Time': 1000.0}]
+        second = [{'Tests': ['BTest'], 'Time': 1000.0}, {'Tests': ['ATest'], 'Time': 1000.0}]
+        qa = test_sharding.record_shard_plan(dict(), key, first, recorded=100.0)
+        uat = test_sharding.record_shard_plan(dict(), key, second, recorded=200.0)
+        # Plan is never replaced once recorded
+        self.assertEqual(first, test_sharding.record_shard_plan(qa, key, second, recorded=150.0)[key]['Shards'])
+        # The earliest plan recorded by any org wins, expired plans are ignored and dropped
+        self.assertEqual(first, test_sharding.find_shard_plan([uat, qa], key, now=300.0))
+        self.assertIsNone(test_sharding.find_shard_plan([qa], 'other', now=300.0))
+        expired = 100.0 + test_sharding.SHARD_PLAN_MAX_AGE + 1
+        self.assertIsNone(test_sharding.find_shard_plan([qa], key, now=expired))
+        self.assertEqual(['other'], list(test_sharding.record_shard_plan(qa, 'other', first, recorded=expired)))
+
+    def test_get_test_class_times(self):
+        mapi = MetadataApi.__new__(MetadataApi)
+        mapi.last_deploy_result = None
+        self.assertEqual({}, mapi.get_test_class_times())
+        mapi.last_deploy_result = ET.fromstring(DEPLOY_RESULT)
+        self.assertEqual({'ServiceTest': 200.0, 'UtilTest': 35.5}, mapi.get_test_class_times())
+
+
+if __name__ == '__main__':
+    unittest.main()
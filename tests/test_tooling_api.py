@@ -0,0 +1,34 @@
+import unittest
+from unittest import mock
+
+from sfdclib import SfdcSession, SfdcToolingApi
+
+from metamatelib.tooling_api import ToolingApi
+
+LIMIT_EXCEEDED = [{'errorCode': 'REQUEST_LIMIT_EXCEEDED', 'message': 'ConcurrentPerOrgLongTxn Limit exceeded.'}]
+
+
+class ToolingApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tooling = ToolingApi(SfdcSession(instance='na1', session_id='00D'), max_retries=2, backoff=0)
+
+    def test_retries_when_request_limit_exceeded(self):
+        with mock.patch.object(SfdcToolingApi, 'get', side_effect=[LIMIT_EXCEEDED, {'size': 0, 'records': []}]) \
+                as get:
+            self.assertEqual({'size': 0, 'records': []}, self._tooling.get('/query/?q=SELECT'))
+            self.assertEqual(2, get.call_count)
+
+    def test_gives_up_after_max_retries(self):
+        with mock.patch.object(SfdcToolingApi, 'get', return_value=LIMIT_EXCEEDED) as get:
+            self.assertEqual(LIMIT_EXCEEDED, self._tooling.get('/query/?q=SELECT'))
+            self.assertEqual(3, get.call_count)
+
+    def test_post_sends_json(self):
+        with mock.patch.object(SfdcToolingApi, 'post', return_value={'success': True}) as post:
+            self._tooling.post('/sobjects/MetadataContainer/', {'Name': 'MetamateMetadataContainer'})
+            post.assert_called_once_with('/sobjects/MetadataContainer/', '{"Name": "MetamateMetadataContainer"}')
+
+
+if __name__ == '__main__':
+    unittest.main()